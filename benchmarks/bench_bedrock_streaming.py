@@ -0,0 +1,91 @@
+"""
+Time to a routing decision with the blocking Bedrock call against the
+streamed call (BEDROCK_STREAMING=true), using the local AWS stand-in.
+
+    python benchmarks/bench_bedrock_streaming.py [--iterations 10] [--generation-ms 1500] [--first-token-ms 300]
+
+The stand-in generates a full analysis (intents and extracted PII) in
+--generation-ms. Modes:
+  blocking         invoke_model, the analysis is parsed when it is complete
+  streaming        streamed, the whole analysis is still read
+  streaming_early  streamed, returns as soon as the intent and pii fields are known
+"""
+import argparse
+
+import common
+from bench_handler import Context, contact_event
+from local_aws import LocalAws
+
+import lambda_function
+
+ANALYSIS = {
+    "intent": "Car loan request",
+    "pii": True,
+    "intents": ["Car loan request", "Interest rate question", "Payment schedule question"],
+    "info": {
+        "phone": "+1 555 010 3000",
+        "email": "sam@example.com",
+        "name": "Sam Example",
+        "address": "123 Main Street, Springfield",
+        "other": ["Date of birth 1980-01-01"]
+    }
+}
+
+MODES = {
+    'blocking': (False, None),
+    'streaming': (True, 60.0),
+    'streaming_early': (True, 0.0),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--generation-ms', type=float, default=1500)
+    parser.add_argument('--first-token-ms', type=float, default=300)
+    args = parser.parse_args()
+
+    files = {'email': {'messageContent': "Hi, I'd like to finance a new car. Call me on +1 555 010 3000. Sam"}}
+    latencies = {'connect': 0, 'download': 0, 'comprehend': 0,
+                 'bedrock': args.generation_ms / 1000, 'bedrock_first_token': args.first_token_ms / 1000}
+
+    records = []
+    lambda_function.metrics.enabled = True
+    lambda_function.metrics.writer = records.append
+    lambda_function.enable_analysis_cache = False
+    lambda_function.intent_classifier = None
+
+    results = {'config': {'iterations': args.iterations, 'generation_ms': args.generation_ms,
+                          'first_token_ms': args.first_token_ms}}
+    with LocalAws(files, latencies, bedrock_responder=lambda request: ANALYSIS) as stand_in:
+        lambda_function.connectClient = stand_in.client('connect')
+        lambda_function.bedrock = stand_in.client('bedrock-runtime')
+        lambda_function.comprehend = stand_in.client('comprehend')
+
+        for mode, (streaming, fill_timeout) in MODES.items():
+            lambda_function.bedrock_streaming = streaming
+            if fill_timeout is not None:
+                lambda_function.bedrock_fill_timeout = fill_timeout
+            totals, bedrock, decision, complete = [], [], [], 0
+            for index in range(args.iterations + 1):
+                response = lambda_function.lambda_handler(contact_event(index, 'email'), Context(f'{mode}-{index}'))
+                if index == 0:
+                    # Connection setup
+                    continue
+                record = records[-1]
+                totals.append(record['total_ms'] / 1000)
+                bedrock.append(record['bedrock_ms'] / 1000)
+                decision.append(record.get('bedrock_decision_ms', record['bedrock_ms']) / 1000)
+                complete += response.get('name') == ANALYSIS['info']['name']
+            results[mode] = {
+                'end_to_end': common.summarize_ms(totals),
+                'bedrock': common.summarize_ms(bedrock),
+                'routing_fields_known': common.summarize_ms(decision),
+                'complete_analyses': complete,
+            }
+
+    common.emit('bedrock_streaming', results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+Long emails analyzed in one Bedrock call against the long-input mode
+(LONG_INPUT_MODE=true), which splits them into chunks that are analyzed
+concurrently and merged, against the local stand-in.
+
+    python benchmarks/bench_chunked_analysis.py [--sizes 1000,2000,3500,5000] [--emails 5]
+                                                [--chunk-tokens 1000] [--parallelism 1,2,4]
+
+Each email is a customer message in front of a pasted statement, `size` tokens
+long in all. The stand-in's Bedrock call takes 0.3 seconds plus 0.15 seconds per
+thousand input tokens, so a single-shot call grows with the email while chunks
+of a bounded size take about the same time each. Both modes get the whole email:
+the trim budget is raised to the largest size for single-shot analysis as the
+long-input mode raises it to MAX_CHUNKS chunks. Reported per size and mode:
+end-to-end latency, Bedrock calls and input tokens per email, and whether the
+merged primary intent matches the single-shot one (the stand-in names the
+intent from the customer message, wherever it is in the chunk).
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import common
+from local_aws import LocalAws
+
+import lambda_function
+
+EVENT = {"Details": {"ContactData": {"InstanceARN": "arn:aws:connect:us-east-1:111122223333:instance/bench",
+                                     "ContactId": "bench"}}}
+MESSAGE = ("Hello, I do not recognise two card payments on my statement below and want to dispute them. "
+           "Please call me on 555 0100. Kind regards, Sam Lee. ")
+STATEMENT_LINE = "03 Mar CARD PAYMENT TO GROCERY STORE 42.10 GBP balance 1,204.55. "
+LATENCIES = {'bedrock': 0.3, 'bedrock_per_1k_input': 0.15}
+
+
+class Context:
+    aws_request_id = 'bench'
+
+    def get_remaining_time_in_millis(self):
+        return 30000
+
+
+def make_email(tokens):
+    lines = max(0, (tokens * 4 - len(MESSAGE)) // len(STATEMENT_LINE))
+    return MESSAGE + STATEMENT_LINE * lines
+
+
+def responder(request):
+    """Card dispute for the chunk holding the customer message, otherwise a statement query"""
+    content = request['messages'][0]['content']
+    if 'dispute' in content:
+        return {"intent": "Card dispute", "pii": True, "info": {"phone": "555 0100", "name": "Sam Lee"}}
+    return {"intent": "Statement query", "pii": False}
+
+
+def run(email, emails, stand_in):
+    lambda_function.extract_email_content = lambda event, deadline=None: email
+    calls_before = stand_in.calls['bedrock']
+    totals, intents = [], []
+    for _ in range(emails):
+        started = time.perf_counter()
+        response = lambda_function.lambda_handler(EVENT, Context())
+        totals.append(time.perf_counter() - started)
+        intents.append(response['user_intent'])
+    return totals, intents, (stand_in.calls['bedrock'] - calls_before) / emails
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='1000,2000,3500,5000')
+    parser.add_argument('--emails', type=int, default=5)
+    parser.add_argument('--chunk-tokens', type=int, default=1000)
+    parser.add_argument('--parallelism', default='1,2,4')
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(',')]
+    parallelisms = [int(workers) for workers in args.parallelism.split(',')]
+
+    lambda_function.enable_analysis_cache = False
+    lambda_function.intent_classifier = None
+    lambda_function.language_detector = 'local'
+    lambda_function.metrics.enabled = False
+    lambda_function.chunk_tokens = args.chunk_tokens
+    lambda_function.max_chunks = max(1, -(-max(sizes) // args.chunk_tokens))
+    # Single-shot analysis sees as much of the email as the chunks do
+    lambda_function.trim_head_tokens = max(sizes)
+
+    results = {'emails': args.emails, 'chunk_tokens': args.chunk_tokens, 'latency': LATENCIES}
+    with LocalAws(latencies=LATENCIES, bedrock_responder=responder) as stand_in:
+        lambda_function.bedrock = stand_in.client('bedrock-runtime')
+        # One untimed email to open the connections
+        lambda_function.extract_email_content = lambda event, deadline=None: MESSAGE
+        lambda_function.lambda_handler(EVENT, Context())
+
+        for size in sizes:
+            email = make_email(size)
+            input_tokens = len(email) // 4
+            lambda_function.long_input_mode = False
+            totals, single_intents, calls = run(email, args.emails, stand_in)
+            modes = {'single_shot': {'end_to_end': common.summarize_ms(totals), 'bedrock_calls': calls,
+                                     'user_intent': single_intents[0]}}
+            lambda_function.long_input_mode = True
+            lambda_function.long_input_threshold_tokens = min(args.chunk_tokens, size - 1)
+            for workers in parallelisms:
+                lambda_function.chunk_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='chunk')
+                totals, intents, calls = run(email, args.emails, stand_in)
+                lambda_function.chunk_executor.shutdown()
+                modes[f'chunked_x{workers}'] = {
+                    'end_to_end': common.summarize_ms(totals),
+                    'bedrock_calls': calls,
+                    'user_intent': intents[0],
+                    'agrees_with_single_shot': all(intent == single_intents[0] for intent in intents),
+                }
+            results[f'{size}_tokens'] = dict(modes, input_tokens=input_tokens)
+
+    common.emit('chunked_analysis', results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+Cold start of the Lambda module: import time and the first invocations of a
+fresh process, against the local AWS stand-in.
+
+    python benchmarks/bench_cold_start.py [--runs 5] [--import-budget-ms 400]
+
+Each run starts a new Python process, as a new Lambda execution environment would:
+  import_ms          importing lambda_function
+  first_invoke_ms    the first lambda_handler call, including lazy AWS client creation
+  second_invoke_ms   the next call, with clients and connections already in place
+The lazily created clients reach the stand-in through AWS_ENDPOINT_URL.
+
+A separate `python -X importtime -c "import lambda_function"` run lists the
+modules with the most import time of their own.
+
+The run exits with status 1 if the median import_ms is above --import-budget-ms.
+Wall-clock time depends on the machine, so the unit tests only check that the
+import skips the AWS SDK and creates no clients.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import common
+from local_aws import LocalAws
+
+FILE_ID = 'cold-start'
+EMAIL = {'messageContent': "Hello, could you tell me what documents I need to refinance? Thanks, Sam"}
+
+
+def child():
+    """Runs in the fresh process; prints its timings as JSON."""
+    started = time.perf_counter()
+    import lambda_function
+    imported = time.perf_counter()
+
+    class Context:
+        aws_request_id = 'cold-start'
+
+        @staticmethod
+        def get_remaining_time_in_millis():
+            return 30000
+
+    timings = {'import_ms': (imported - started) * 1000}
+    previous = imported
+    for name in ('first_invoke_ms', 'second_invoke_ms'):
+        response = lambda_function.lambda_handler({"Details": {"ContactData": {
+            "InstanceARN": "arn:aws:connect:us-east-1:111122223333:instance/benchmark",
+            "ContactId": name,
+            "References": {"email": {"Type": "EMAIL_MESSAGE", "Value": FILE_ID}}
+        }}}, Context())
+        assert 'error' not in response, response
+        now = time.perf_counter()
+        timings[name] = (now - previous) * 1000
+        previous = now
+    timings['clients_created'] = sorted(name for name in ('connectClient', 's3Client', 'bedrock', 'comprehend')
+                                        if getattr(lambda_function, name).created)
+    print(json.dumps(timings))
+
+
+def child_env(endpoint):
+    return dict(os.environ, AWS_ENDPOINT_URL=endpoint, AWS_ACCESS_KEY_ID='local', AWS_SECRET_ACCESS_KEY='local',
+                AWS_DEFAULT_REGION='us-east-1', ENABLE_METRICS='false', ANALYSIS_CACHE='false',
+                FAST_PATH_CLASSIFIER='false', PYTHONDONTWRITEBYTECODE='1')
+
+
+def import_profile(top):
+    """Modules with the largest self import time, from python -X importtime."""
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import lambda_function'],
+                            cwd=common.LAMBDA_DIR, env=child_env('http://127.0.0.1:9'),
+                            capture_output=True, text=True, check=True).stderr
+    modules = []
+    for line in output.splitlines():
+        if line.startswith('import time:') and '|' in line and 'self [us]' not in line:
+            self_us, cumulative_us, name = line[len('import time:'):].split('|')
+            modules.append((int(self_us), int(cumulative_us), name.strip()))
+    total = next(cumulative for _, cumulative, name in modules if name == 'lambda_function')
+    return {
+        'lambda_function_ms': round(total / 1000, 3),
+        'top_self_ms': {name: round(self_us / 1000, 3) for self_us, _, name in sorted(modules, reverse=True)[:top]},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=8)
+    parser.add_argument('--import-budget-ms', type=float, default=400)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child()
+
+    runs = []
+    with LocalAws({FILE_ID: EMAIL}) as stand_in:
+        for _ in range(args.runs):
+            output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child'],
+                                    env=child_env(stand_in.endpoint), capture_output=True, text=True, check=True)
+            runs.append(json.loads(output.stdout.strip().splitlines()[-1]))
+
+    results = {
+        'runs': args.runs,
+        'clients_created': runs[-1]['clients_created'],
+        'importtime': import_profile(args.top),
+    }
+    for name in ('import_ms', 'first_invoke_ms', 'second_invoke_ms'):
+        values = [run[name] for run in runs]
+        results[name] = {'median': round(statistics.median(values), 3), 'max': round(max(values), 3)}
+    results['import_budget_ms'] = args.import_budget_ms
+    results['import_within_budget'] = results['import_ms']['median'] <= args.import_budget_ms
+    common.emit('cold_start', results)
+    if not results['import_within_budget']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+"""
+End-to-end latency, per-stage latency and memory of lambda_handler, driven
+with Amazon Connect contact events against a local stand-in for Amazon Connect,
+Amazon Bedrock, Amazon Comprehend and the presigned download URL (local_aws.py).
+No AWS account is needed.
+
+    python benchmarks/bench_handler.py [--iterations 5] [--bedrock-latency 300] [--cache]
+
+The corpus has three kinds of email: small plain-text messages, large
+Outlook-style HTML threads and long plain-text reply chains. Stage timings
+come from the handler's own EMF metrics record. Peak memory is measured in a
+separate pass under tracemalloc (which slows the code down), and includes
+the small allocations of the in-process stand-in.
+"""
+import argparse
+import tracemalloc
+from collections import defaultdict
+
+import common
+from bench_html_normalizer import SAMPLE, build_thread
+from local_aws import LocalAws
+
+import lambda_function
+
+
+class Context:
+    def __init__(self, request_id):
+        self.aws_request_id = request_id
+
+    @staticmethod
+    def get_remaining_time_in_millis():
+        return 8000
+
+
+def long_thread(sample, depth):
+    """Nest a plain-text reply under `depth` levels of quoted history."""
+    body = sample
+    for level in range(depth):
+        quoted = '\n'.join('> ' + line for line in body.split('\n'))
+        body = f"Following up on this, any news?\n\nOn Mon, Apr {level % 28 + 1}, 2024 at 9:00 AM Sam wrote:\n{quoted}"
+    return body
+
+
+def build_corpus():
+    with open(SAMPLE, encoding='utf-8') as f:
+        template = f.read()
+    samples = [s['text'] for s in common.load_jsonl('language_samples.jsonl') if s['language'] == 'en']
+    threads = [t['body'] for t in common.load_jsonl('email_threads.jsonl')]
+    return {
+        'small': samples[:8],
+        'large_html': [build_thread(template, depth) for depth in (5, 20, 60)],
+        'long_thread': [long_thread(body, 15) for body in threads],
+    }
+
+
+def contact_event(index, file_id):
+    return {"Details": {"ContactData": {
+        "InstanceARN": "arn:aws:connect:us-east-1:111122223333:instance/benchmark",
+        "ContactId": f"contact-{index}",
+        "References": {"email": {"Type": "EMAIL_MESSAGE", "Value": file_id}}
+    }}}
+
+
+def run(corpus, iterations, records):
+    """Invoke the handler for every email; returns (end-to-end seconds, stage seconds) per category."""
+    total = {}
+    stages = {}
+    invocation = 0
+    for category, emails in corpus.items():
+        total[category] = []
+        stages[category] = defaultdict(list)
+        for _ in range(iterations):
+            for index in range(len(emails)):
+                invocation += 1
+                lambda_function.lambda_handler(contact_event(invocation, f'{category}-{index}'),
+                                               Context(f'request-{invocation}'))
+                record = records[-1]
+                total[category].append(record['total_ms'] / 1000)
+                for name, value in record.items():
+                    if name.endswith('_ms') and name != 'total_ms':
+                        stages[category][name[:-3]].append(value / 1000)
+    return total, stages
+
+
+def measure_memory(corpus):
+    peaks = {}
+    tracemalloc.start()
+    try:
+        for category, emails in corpus.items():
+            peaks[category] = []
+            for index in range(len(emails)):
+                tracemalloc.reset_peak()
+                baseline = tracemalloc.get_traced_memory()[0]
+                lambda_function.lambda_handler(contact_event(index, f'{category}-{index}'), Context('memory'))
+                peaks[category].append(tracemalloc.get_traced_memory()[1] - baseline)
+    finally:
+        tracemalloc.stop()
+    return {category: {'peak_kb_max': round(max(values) / 1024, 1),
+                       'peak_kb_mean': round(sum(values) / len(values) / 1024, 1)}
+            for category, values in peaks.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=5)
+    parser.add_argument('--connect-latency', type=float, default=20, help='milliseconds')
+    parser.add_argument('--download-latency', type=float, default=30, help='milliseconds')
+    parser.add_argument('--comprehend-latency', type=float, default=40, help='milliseconds')
+    parser.add_argument('--bedrock-latency', type=float, default=300, help='milliseconds')
+    parser.add_argument('--cache', action='store_true', help='keep the analysis cache on (repeated emails become hits)')
+    args = parser.parse_args()
+
+    corpus = build_corpus()
+    files = {f'{category}-{index}': {'messageContent': body}
+             for category, emails in corpus.items() for index, body in enumerate(emails)}
+    latencies = {
+        'connect': args.connect_latency / 1000,
+        'download': args.download_latency / 1000,
+        'comprehend': args.comprehend_latency / 1000,
+        'bedrock': args.bedrock_latency / 1000,
+    }
+
+    records = []
+    lambda_function.metrics.enabled = True
+    lambda_function.metrics.writer = records.append
+    lambda_function.enable_analysis_cache = args.cache
+
+    with LocalAws(files, latencies) as stand_in:
+        lambda_function.connectClient = stand_in.client('connect')
+        lambda_function.bedrock = stand_in.client('bedrock-runtime')
+        lambda_function.comprehend = stand_in.client('comprehend')
+
+        # The first invocation pays for connection setup; keep it out of the distributions
+        lambda_function.lambda_handler(contact_event(0, 'small-0'), Context('warm-up'))
+        cold_ms = records[-1]['total_ms']
+
+        total, stages = run(corpus, args.iterations, records)
+        memory = measure_memory(corpus)
+        calls = dict(stand_in.calls)
+
+    results = {
+        'config': {'iterations': args.iterations, 'latency_ms': {k: v * 1000 for k, v in latencies.items()},
+                   'analysis_cache': args.cache, 'fast_path': lambda_function.intent_classifier is not None},
+        'first_invocation_ms': cold_ms,
+        'calls': calls,
+        'categories': {
+            category: {
+                'emails': len(corpus[category]),
+                'input_chars_max': max(len(body) for body in corpus[category]),
+                'end_to_end': common.summarize_ms(total[category]),
+                'stages': {name: common.summarize_ms(values) for name, values in sorted(stages[category].items())},
+                'memory': memory[category],
+            }
+            for category in corpus
+        },
+    }
+    common.emit('handler', results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+CPU time and size reduction of the streaming HTML normalizer against the
+original two-regex cleanup (tag strip, then whitespace collapse) on Outlook-style
+HTML emails of increasing size.
+
+    python benchmarks/bench_html_normalizer.py [--repeat 5]
+
+Large documents are built by nesting the sample's quoted-reply section, the way
+long Outlook threads grow.
+"""
+import argparse
+import os
+import re
+import time
+
+import common
+from html_normalizer import normalize_html
+
+SAMPLE = os.path.join(common.DATA_DIR, 'html_emails', 'outlook_reply.html')
+
+
+def legacy_cleanup(body):
+    # process_body + clean_string before the streaming normalizer
+    body = re.sub(r'<[^>]+>', '', body).strip()
+    return re.sub(r'\s+', ' ', body).strip()
+
+
+def build_thread(template, depth):
+    head, tail = template.split('<!--QUOTED-->')
+    body_start = head.index('<div class="WordSection1">')
+    quoted = head[body_start:]
+    document = template
+    for _ in range(depth):
+        document = document.replace('<!--QUOTED-->', '<blockquote>' + quoted + '<!--QUOTED--></blockquote>', 1)
+    return document
+
+
+def chunks(text, size=64 * 1024):
+    for start in range(0, len(text), size):
+        yield text[start:start + size]
+
+
+def measure(fn, document, repeat):
+    cpu = []
+    for _ in range(repeat):
+        started = time.process_time()
+        output = fn(document)
+        cpu.append(time.process_time() - started)
+    return output, common.summarize_ms(cpu)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--max-chars', type=int, default=20000)
+    args = parser.parse_args()
+
+    with open(SAMPLE, encoding='utf-8') as f:
+        template = f.read()
+
+    results = {}
+    for depth in (0, 20, 200):
+        document = build_thread(template, depth)
+        legacy_output, legacy_cpu = measure(legacy_cleanup, document, args.repeat)
+        full_output, full_cpu = measure(lambda doc: normalize_html(chunks(doc)), document, args.repeat)
+        capped_output, capped_cpu = measure(lambda doc: normalize_html(chunks(doc), args.max_chars), document, args.repeat)
+        results[f'thread_depth_{depth}'] = {
+            'input_chars': len(document),
+            'legacy': {'output_chars': len(legacy_output), 'cpu': legacy_cpu},
+            'streaming': {'output_chars': len(full_output), 'cpu': full_cpu},
+            'streaming_capped': {'output_chars': len(capped_output), 'cpu': capped_cpu},
+        }
+
+    common.emit('html_normalizer', results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""
+Routing from the nearest-neighbour intent index (INTENT_INDEX_DIR) against the
+Bedrock-only path, on the labelled examples in benchmarks/data/intent_examples.jsonl.
+
+    python benchmarks/bench_intent_index.py [--margins 0.3,0.5,0.7] [--k 7] [--dims 512]
+                                            [--bedrock-latency 600]
+
+The index is built from the examples marked "train" and asked about those
+marked "test", which include paraphrases of no training example. The local
+stand-in's Bedrock answers every email with its labelled intent, so the
+Bedrock-only path is the reference: accuracy is measured for the emails the
+index answers, and emails it leaves to Bedrock count as correct. The keyword
+rules are off so every email reaches the index. Reported: build time and
+index size, lookup latency, and per margin threshold the share of emails
+answered by the index, their accuracy, Bedrock calls per email and
+end-to-end latency of lambda_handler.
+"""
+import argparse
+import tempfile
+import time
+
+import common
+from local_aws import LocalAws
+
+import lambda_function
+from intent_index import INTENT_LABELS, HashingVectorizer, IntentIndex
+
+EVENT = {"Details": {"ContactData": {"InstanceARN": "arn:aws:connect:us-east-1:111122223333:instance/bench",
+                                     "ContactId": "bench"}}}
+
+
+class Context:
+    aws_request_id = 'bench'
+
+    def get_remaining_time_in_millis(self):
+        return 30000
+
+
+def label(intent):
+    return INTENT_LABELS.get(intent, intent)
+
+
+def run(examples, stand_in):
+    """Handler latency and routing of each example; returns (durations, correct, answered locally)"""
+    calls_before = stand_in.calls['bedrock']
+    durations, correct = [], 0
+    for example in examples:
+        lambda_function.extract_email_content = lambda event, deadline=None: example['text']
+        started = time.perf_counter()
+        response = lambda_function.lambda_handler(EVENT, Context())
+        durations.append(time.perf_counter() - started)
+        correct += response['user_intent'] == label(example['intent'])
+    return durations, correct, len(examples) - (stand_in.calls['bedrock'] - calls_before)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--margins', default='0.3,0.5,0.7')
+    parser.add_argument('--k', type=int, default=7)
+    parser.add_argument('--dims', type=int, default=512)
+    parser.add_argument('--bedrock-latency', type=float, default=600, help='milliseconds')
+    args = parser.parse_args()
+
+    examples = common.load_jsonl('intent_examples.jsonl')
+    train = [example for example in examples if example['split'] == 'train']
+    test = [example for example in examples if example['split'] == 'test']
+    labels = {example['text']: label(example['intent']) for example in examples}
+
+    started = time.perf_counter()
+    built = IntentIndex.build(train, HashingVectorizer(args.dims))
+    build_seconds = time.perf_counter() - started
+    with tempfile.TemporaryDirectory() as directory:
+        built.save(directory)
+        started = time.perf_counter()
+        index = IntentIndex.load(directory, k=args.k)
+        load_seconds = time.perf_counter() - started
+        lookups = []
+        for example in test * 20:
+            started = time.perf_counter()
+            index.search(example['text'])
+            lookups.append(time.perf_counter() - started)
+
+        def responder(request):
+            content = request['messages'][0]['content']
+            return {"intent": next((intent for text, intent in labels.items() if text in content), 'Unknown'),
+                    "pii": False}
+
+        lambda_function.enable_analysis_cache = False
+        lambda_function.intent_classifier = None
+        lambda_function.language_detector = 'local'
+        lambda_function.metrics.enabled = False
+
+        results = {
+            'train_examples': len(train),
+            'test_examples': len(test),
+            'index_bytes': int(index.vectors.nbytes + index.labels.nbytes),
+            'build_ms': round(build_seconds * 1000, 3),
+            'load_ms': round(load_seconds * 1000, 3),
+            'lookup': common.summarize_ms(lookups),
+        }
+        with LocalAws(latencies={'bedrock': args.bedrock_latency / 1000}, bedrock_responder=responder) as stand_in:
+            lambda_function.bedrock = stand_in.client('bedrock-runtime')
+            lambda_function.intent_index = None
+            # One untimed email to open the connections
+            run(test[:1], stand_in)
+            durations, correct, _ = run(test, stand_in)
+            results['bedrock_only'] = {'end_to_end': common.summarize_ms(durations),
+                                       'accuracy': round(correct / len(test), 3), 'bedrock_calls': 1.0}
+            for margin in [float(value) for value in args.margins.split(',')]:
+                index.margin = margin
+                lambda_function.intent_index = index
+                durations, correct, answered = run(test, stand_in)
+                local_correct = correct - (len(test) - answered)
+                results[f'margin_{margin}'] = {
+                    'end_to_end': common.summarize_ms(durations),
+                    'answered_by_index': round(answered / len(test), 3),
+                    'index_accuracy': round(local_correct / answered, 3) if answered else None,
+                    'accuracy': round(correct / len(test), 3),
+                    'bedrock_calls': round((len(test) - answered) / len(test), 3),
+                }
+
+    common.emit('intent_index', results)
+
+
+if __name__ == '__main__':
+    main()
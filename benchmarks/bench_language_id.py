@@ -0,0 +1,72 @@
+"""
+Accuracy and latency of the local language identifier on a labelled sample corpus.
+
+    python benchmarks/bench_language_id.py [--repeat 20] [--comprehend]
+
+--comprehend also calls Amazon Comprehend for every sample (needs AWS credentials)
+and reports its latency and agreement with the local result.
+"""
+import argparse
+
+import common
+from language_id import LanguageIdentifier
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--threshold', type=float, default=0.75)
+    parser.add_argument('--comprehend', action='store_true')
+    args = parser.parse_args()
+
+    samples = common.load_jsonl('language_samples.jsonl')
+    identifier = LanguageIdentifier.load()
+
+    latencies = []
+    correct = 0
+    confident = 0
+    confident_correct = 0
+    for _ in range(args.repeat):
+        for sample in samples:
+            (language, confidence), elapsed = common.timed(identifier.detect, sample['text'])
+            latencies.append(elapsed)
+            correct += language == sample['language']
+            if confidence >= args.threshold:
+                confident += 1
+                confident_correct += language == sample['language']
+
+    total = len(samples) * args.repeat
+    results = {
+        'samples': len(samples),
+        'local': {
+            'accuracy': round(correct / total, 4),
+            # Share answered locally in 'auto' mode, and how accurate those answers are
+            'confident_rate': round(confident / total, 4),
+            'confident_accuracy': round(confident_correct / confident, 4) if confident else None,
+            'latency': common.summarize_ms(latencies),
+        }
+    }
+
+    if args.comprehend:
+        import boto3
+        client = boto3.client('comprehend')
+        latencies = []
+        agree = 0
+        correct = 0
+        for sample in samples:
+            response, elapsed = common.timed(lambda text: client.detect_dominant_language(Text=text), sample['text'])
+            latencies.append(elapsed)
+            language = response['Languages'][0]['LanguageCode']
+            correct += language == sample['language']
+            agree += language == identifier.detect(sample['text'])[0]
+        results['comprehend'] = {
+            'accuracy': round(correct / len(samples), 4),
+            'agreement_with_local': round(agree / len(samples), 4),
+            'latency': common.summarize_ms(latencies),
+        }
+
+    common.emit('language_id', results)
+
+
+if __name__ == '__main__':
+    main()
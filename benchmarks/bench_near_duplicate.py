@@ -0,0 +1,73 @@
+"""
+Reuse of earlier analyses by near-duplicate detection (NEAR_DUPLICATE=true) on
+the labelled pairs in benchmarks/data/near_duplicate_pairs.jsonl.
+
+    python benchmarks/bench_near_duplicate.py [--thresholds 8:0.9,12:0.85,16:0.8] [--num-perm 64]
+
+Each pair is an earlier email and a later one from the same sender, labelled
+with whether the earlier analysis may be reused (resends, follow-ups, changed
+greetings, typos, changed phone or account numbers) or not (another intent, another request). The earlier email
+is added to an empty index and the later one looked up. Reported: fingerprint
+and lookup latency, and per max Hamming distance:min Jaccard similarity the
+share of reusable pairs that are reused, the number of pairs wrongly reused
+(with their kind) and the lookups that a close SimHash sent to the Jaccard or
+key-terms check and were rejected there.
+"""
+import argparse
+import time
+
+import common
+
+from intent_rules import IntentRuleClassifier
+from near_duplicate import Fingerprinter, NearDuplicateIndex
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--thresholds', default='8:0.9,12:0.85,16:0.8')
+    parser.add_argument('--num-perm', type=int, default=64)
+    args = parser.parse_args()
+
+    pairs = common.load_jsonl('near_duplicate_pairs.jsonl')
+    rules = IntentRuleClassifier()
+    fingerprinter = Fingerprinter(num_perm=args.num_perm, key_terms=lambda text: rules.score(text).keys())
+
+    durations = []
+    fingerprints = []
+    for pair in pairs:
+        started = time.perf_counter()
+        first = fingerprinter.fingerprint(pair['a'])
+        durations.append(time.perf_counter() - started)
+        fingerprints.append((first, fingerprinter.fingerprint(pair['b'])))
+
+    results = {'pairs': len(pairs), 'reusable': sum(pair['reuse'] for pair in pairs),
+               'fingerprint': common.summarize_ms(durations)}
+    for threshold in args.thresholds.split(','):
+        max_hamming, min_jaccard = threshold.split(':')
+        reused, false_reuse, lookups, rejected = 0, [], [], 0
+        for pair, (first, second) in zip(pairs, fingerprints):
+            if first is None or second is None:
+                continue
+            index = NearDuplicateIndex(max_hamming=int(max_hamming), min_jaccard=float(min_jaccard))
+            index.add(['sender:bench'], first, {'user_intent': pair['kind']})
+            started = time.perf_counter()
+            hit = index.find(['sender:bench'], second) is not None
+            lookups.append(time.perf_counter() - started)
+            rejected += index.stats['rejected']
+            if hit and pair['reuse']:
+                reused += 1
+            elif hit:
+                false_reuse.append(pair['kind'])
+        results[f'hamming_{max_hamming}_jaccard_{min_jaccard}'] = {
+            'reuse_rate': round(reused / results['reusable'], 3),
+            'false_reuse': len(false_reuse),
+            'false_reuse_kinds': false_reuse,
+            'rejected_by_jaccard_or_terms': rejected,
+            'lookup': common.summarize_ms(lookups),
+        }
+
+    common.emit('near_duplicate', results)
+
+
+if __name__ == '__main__':
+    main()
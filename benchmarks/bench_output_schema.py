@@ -0,0 +1,91 @@
+"""
+Size of the model output with the compact schema the instruction asks for against
+the previous verbose schema, and the cost of building the Bedrock request from the
+precompiled template against serializing it on every call.
+
+    python benchmarks/bench_output_schema.py [--repeat 2000]
+
+Output tokens are estimated at four characters per token. Haiku generates output
+at a roughly constant rate, so output tokens saved translate into Bedrock latency.
+"""
+import argparse
+import json
+import time
+
+import common
+from local_aws import estimate_tokens
+
+import lambda_function
+
+# The same analyses in the compact form the model is asked for
+CASES = {
+    'no_pii': {"intent": "Home loan request", "pii": False},
+    'several_intents': {"intent": "Car loan request", "pii": False,
+                        "intents": ["Car loan request", "Interest rate question"]},
+    'pii': {"intent": "Home equity line of credit", "pii": True,
+            "info": {"phone": "+1 555 010 3000", "name": "Sam Example", "account": "12345678"}},
+}
+
+VERBOSE_INFO = ('phone_number', 'email_address', 'name', 'address', 'account_number', 'other_pii')
+
+
+def verbose_output(compact):
+    """The previous output format: every field present, in the order that schema listed them."""
+    analysis = lambda_function.complete_analysis(compact)
+    info = analysis['extracted_info']
+    return {
+        "intents": analysis['intents'],
+        "pii_detected": analysis['pii_detected'],
+        "extracted_info": {name: info.get(name, [] if name == 'other_pii' else '') for name in VERBOSE_INFO},
+        "user_intent": analysis['user_intent']
+    }
+
+
+def build_request(email_content):
+    return json.dumps({
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": 1000,
+        "system": lambda_function.instruction,
+        "messages": [{"role": "user", "content": email_content}],
+        "temperature": 0
+    })
+
+
+def build_from_template(email_content):
+    prefix, suffix = lambda_function.request_template(lambda_function.instruction)
+    return prefix + json.dumps(email_content) + suffix
+
+
+def time_calls(fn, arg, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn(arg)
+    return (time.perf_counter() - started) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=2000)
+    args = parser.parse_args()
+
+    results = {'output': {}}
+    for name, compact in CASES.items():
+        # Both as the model tends to write them, pretty-printed
+        verbose_text = json.dumps(verbose_output(compact), indent=2)
+        compact_text = json.dumps(compact)
+        results['output'][name] = {
+            'verbose_tokens': estimate_tokens(verbose_text),
+            'compact_tokens': estimate_tokens(compact_text),
+        }
+
+    email = "Hi, I'd like to refinance my home loan. " * 50
+    results['request_build'] = {
+        'email_chars': len(email),
+        'serialize_us': round(time_calls(build_request, email, args.repeat) * 1e6, 3),
+        'template_us': round(time_calls(build_from_template, email, args.repeat) * 1e6, 3),
+    }
+    common.emit('output_schema', results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""
+Bedrock failures with and without the resilience layer (retries with jittered
+backoff, circuit breaker, admission control), against the local stand-in.
+
+    python benchmarks/bench_resilience.py [--emails 500] [--rate 50]
+
+Emails arrive at `rate` per second and go through lambda_handler on their own
+threads, as concurrent Lambda instances would (sharing one breaker and one
+token bucket, as instances share the admission table). Scenarios:
+  burst     the stand-in throttles 30% of the Bedrock calls at random
+  outage    for the middle third of the run every Bedrock call fails with
+            ServiceUnavailableException after OUTAGE_LATENCY seconds, as a
+            degraded endpoint would
+  quota     the stand-in throttles calls above QUOTA_RPS, as the account's
+            requests-per-minute quota would
+Modes:
+  none       one attempt, no breaker (the behaviour before the resilience layer)
+  retries    up to three attempts with jittered backoff
+  breaker    retries and the circuit breaker
+  admission  retries, breaker and a token bucket at the quota (quota scenario only)
+Reported per scenario and mode: the share of emails routed by the fallback
+instead of the analysis, end-to-end latency, and Bedrock calls (answered and
+failed) per email.
+"""
+import argparse
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.config import Config
+
+import common
+from local_aws import LocalAws
+
+import lambda_function
+from admission import AdmissionController, LocalTokenBuckets
+from resilience import CircuitBreaker, Guard, RetryPolicy
+
+EVENT = {"Details": {"ContactData": {"InstanceARN": "arn:aws:connect:us-east-1:111122223333:instance/bench",
+                                     "ContactId": "bench"}}}
+EMAIL = "Hello, I would like to apply for a home loan for a house we are buying in May. Kind regards, Sam"
+# Bedrock calls per second the quota scenario allows
+QUOTA_RPS = 40
+# Seconds a failing call takes during the outage
+OUTAGE_LATENCY = 2.0
+
+
+class Context:
+    aws_request_id = 'bench'
+
+    def get_remaining_time_in_millis(self):
+        return 30000
+
+
+class Faults:
+    """bedrock_fault for the stand-in; decides per call from the scenario and the time into the run"""
+
+    def __init__(self, scenario, duration, seed=7):
+        self.scenario = scenario
+        self.duration = duration
+        self.started = time.monotonic()
+        self.rng = random.Random(seed)
+        self.recent = []
+        self.lock = threading.Lock()
+
+    def __call__(self, request):
+        with self.lock:
+            now = time.monotonic()
+            if self.scenario == 'burst':
+                return 'ThrottlingException' if self.rng.random() < 0.3 else None
+            if self.scenario == 'outage':
+                third = self.duration / 3
+                return 'ServiceUnavailableException' if third <= now - self.started < 2 * third else None
+            self.recent = [t for t in self.recent if now - t < 1.0]
+            if len(self.recent) >= QUOTA_RPS:
+                return 'ThrottlingException'
+            self.recent.append(now)
+            return None
+
+
+def make_guard(mode):
+    if mode == 'none':
+        return Guard('bedrock', RetryPolicy(max_attempts=1))
+    breaker = CircuitBreaker(min_calls=10, open_seconds=1.0) if mode != 'retries' else None
+    admission = None
+    if mode == 'admission':
+        admission = AdmissionController(LocalTokenBuckets({'requests': QUOTA_RPS * 60}, burst_seconds=1))
+    return Guard('bedrock', RetryPolicy(max_attempts=3), breaker, admission, min_attempt=lambda_function.min_bedrock_budget)
+
+
+def one():
+    started = time.perf_counter()
+    response = lambda_function.lambda_handler(EVENT, Context())
+    return response, time.perf_counter() - started
+
+
+def run(stand_in, scenario, mode, emails, rate):
+    lambda_function.bedrock_guard = make_guard(mode)
+    stand_in.bedrock_fault = Faults(scenario, emails / rate)
+    calls_before = stand_in.calls['bedrock'] + stand_in.calls['bedrock_fault']
+
+    # Open loop: emails keep arriving at the same rate however slow the answers are
+    with ThreadPoolExecutor(max_workers=emails) as pool:
+        futures = []
+        for _ in range(emails):
+            futures.append(pool.submit(one))
+            time.sleep(1.0 / rate)
+        results = [future.result() for future in futures]
+    calls = stand_in.calls['bedrock'] + stand_in.calls['bedrock_fault'] - calls_before
+    fallbacks = sum(1 for response, _ in results if response.get('user_intent') != 'Home loan request')
+    return {
+        'fallback_share': round(fallbacks / emails, 4),
+        'end_to_end': common.summarize_ms([elapsed for _, elapsed in results]),
+        'bedrock_calls_per_email': round(calls / emails, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--emails', type=int, default=500)
+    parser.add_argument('--rate', type=float, default=50)
+    args = parser.parse_args()
+
+    lambda_function.enable_analysis_cache = False
+    lambda_function.intent_classifier = None
+    lambda_function.language_detector = 'local'
+    lambda_function.metrics.enabled = False
+    # Each Lambda instance runs one email at a time; inline stages keep the emails from queueing
+    # for the shared stage thread pool
+    lambda_function.concurrent_stages = False
+    lambda_function.extract_email_content = lambda event, deadline=None: EMAIL
+
+    # Errors are logged whatever the log level; the report is the last document printed
+    results = {'emails': args.emails, 'rate': args.rate}
+    for scenario in ('burst', 'outage', 'quota'):
+        modes = ('none', 'retries', 'breaker') + (('admission',) if scenario == 'quota' else ())
+        fault_latency = OUTAGE_LATENCY if scenario == 'outage' else 0.02
+        with LocalAws(latencies={'bedrock': 0.05, 'bedrock_fault': fault_latency}) as stand_in:
+            # The guards retry; the client itself makes one attempt per call
+            lambda_function.bedrock = stand_in.client('bedrock-runtime',
+                                                      config=Config(retries={'total_max_attempts': 1},
+                                                                    max_pool_connections=50))
+            results[scenario] = {mode: run(stand_in, scenario, mode, args.emails, args.rate) for mode in modes}
+
+    common.emit('resilience', results)
+
+
+if __name__ == '__main__':
+    main()
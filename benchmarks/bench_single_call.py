@@ -0,0 +1,108 @@
+"""
+Two-call analysis (language detection and Amazon Bedrock) against the single-call
+mode (LANGUAGE_DETECTOR=bedrock), where the Bedrock analysis also returns the language.
+
+    python benchmarks/bench_single_call.py [--two-call-detector comprehend] [--sequential] [--aws]
+
+Every sample of benchmarks/data/language_samples.jsonl goes through lambda_handler
+in both modes. Reported per mode: end-to-end latency and AWS calls per email;
+with --aws also the accuracy against the labelled language, and how often both
+modes agree. With
+concurrent stages the Comprehend call overlaps the Bedrock call, so the saving
+is one paid call per email; --sequential (CONCURRENT_STAGES=false) also shows
+its latency.
+
+By default Amazon Bedrock and Amazon Comprehend are served by the local stand-in,
+which answers every email with the same language, so accuracy and agreement are
+not reported offline. --aws uses the real services (needs AWS credentials and
+Bedrock model access) and reports them.
+"""
+import argparse
+import time
+
+import common
+from language_id import LanguageIdentifier
+from local_aws import LocalAws
+
+import lambda_function
+
+EVENT = {"Details": {"ContactData": {"InstanceARN": "arn:aws:connect:us-east-1:111122223333:instance/bench",
+                                     "ContactId": "bench"}}}
+
+
+class Context:
+    aws_request_id = 'bench'
+
+    def get_remaining_time_in_millis(self):
+        return 30000
+
+
+def run_mode(samples, detector, identifier):
+    lambda_function.language_detector = detector
+    # As at import: the local profiles are not loaded when only Comprehend is used
+    lambda_function.language_identifier = identifier if detector != 'comprehend' else None
+    lambda_function.instruction = lambda_function.build_instruction(with_language=detector == 'bedrock')
+    languages, totals = [], []
+    for sample in samples:
+        lambda_function.extract_email_content = lambda event, deadline=None, text=sample['text']: text
+        started = time.perf_counter()
+        response = lambda_function.lambda_handler(EVENT, Context())
+        totals.append(time.perf_counter() - started)
+        languages.append(response.get('language'))
+    return languages, totals
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--two-call-detector', default='comprehend', choices=['comprehend', 'auto'])
+    parser.add_argument('--sequential', action='store_true')
+    parser.add_argument('--aws', action='store_true')
+    args = parser.parse_args()
+
+    samples = common.load_jsonl('language_samples.jsonl')
+
+    def respond(request):
+        return {"intent": "Home loan request", "pii": False, "lang": "en"}
+
+    lambda_function.enable_analysis_cache = False
+    lambda_function.intent_classifier = None
+    lambda_function.metrics.enabled = False
+    lambda_function.concurrent_stages = not args.sequential
+    identifier = lambda_function.language_identifier or LanguageIdentifier.load()
+
+    results = {'samples': len(samples), 'sequential': args.sequential}
+    stand_in = None
+    if not args.aws:
+        stand_in = LocalAws(bedrock_responder=respond).__enter__()
+        lambda_function.bedrock = stand_in.client('bedrock-runtime')
+        lambda_function.comprehend = stand_in.client('comprehend')
+    try:
+        modes = {'two_call': args.two_call_detector, 'single_call': 'bedrock'}
+        answers = {}
+        for mode, detector in modes.items():
+            # One untimed email to open the connections
+            run_mode(samples[:1], detector, identifier)
+            calls_before = dict(stand_in.calls) if stand_in else None
+            languages, totals = run_mode(samples, detector, identifier)
+            answers[mode] = languages
+            results[mode] = {'end_to_end': common.summarize_ms(totals)}
+            if args.aws:
+                results[mode]['accuracy'] = round(sum(language == sample['language'] for language, sample
+                                                      in zip(languages, samples)) / len(samples), 4)
+            if stand_in:
+                results[mode]['calls_per_email'] = {
+                    api: round((stand_in.calls[api] - calls_before[api]) / len(samples), 3)
+                    for api in ('bedrock', 'comprehend')
+                }
+        if args.aws:
+            results['agreement'] = round(sum(a == b for a, b in zip(answers['two_call'], answers['single_call']))
+                                         / len(samples), 4)
+    finally:
+        if stand_in:
+            stand_in.__exit__(None, None, None)
+
+    common.emit('single_call', results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+import json
+import os
+import sys
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BENCHMARK_DIR, 'data')
+LAMBDA_DIR = os.path.join(BENCHMARK_DIR, '..', 'lambda')
+
+# Make the Lambda modules importable and give boto3 the settings it expects at import time
+sys.path.insert(0, os.path.abspath(LAMBDA_DIR))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('instName', 'benchmark-instance')
+os.environ.setdefault('connectBucket', 'benchmark-bucket')
+os.environ.setdefault('ENABLE_LOGGING', 'false')
+
+
+def load_jsonl(name):
+    with open(os.path.join(DATA_DIR, name), encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize_ms(samples):
+    """Latency summary in milliseconds for a list of durations in seconds."""
+    return {
+        'count': len(samples),
+        'mean_ms': round(sum(samples) / len(samples) * 1000, 4) if samples else 0.0,
+        'p50_ms': round(percentile(samples, 50) * 1000, 4),
+        'p99_ms': round(percentile(samples, 99) * 1000, 4),
+        'max_ms': round(max(samples) * 1000, 4) if samples else 0.0,
+    }
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+def emit(name, results):
+    """Print results as one JSON document so runs can be diffed between commits."""
+    print(json.dumps({'benchmark': name, 'results': results}, indent=2, sort_keys=True))
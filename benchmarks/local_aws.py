@@ -0,0 +1,230 @@
+"""
+Local HTTP stand-in for the AWS APIs the Lambda calls (Amazon Connect
+GetAttachedFile, Amazon Bedrock InvokeModel and InvokeModelWithResponseStream,
+Amazon Comprehend DetectDominantLanguage) and for the presigned download URL
+of the email file.
+
+boto3 clients pointed at it with endpoint_url go through their normal request
+signing, serialization and response parsing, so benchmarks include the
+client-side cost of every call. Latencies are injected per API.
+"""
+import base64
+import binascii
+import json
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import boto3
+
+# Analysis returned by the Bedrock stand-in unless a custom responder is given, in the compact
+# form and field order the instruction asks for
+DEFAULT_ANALYSIS = {"intent": "Home loan request", "pii": False}
+
+# Injected latency in seconds per API. 'bedrock' is the time to generate the whole response;
+# a streamed response starts after 'bedrock_first_token' and spreads the rest evenly over the output.
+# 'bedrock_fault' is the time to answer a Bedrock call with an injected error.
+# 'bedrock_per_1k_input' is added to an InvokeModel call per thousand input tokens, as reading a long
+# prompt takes the model longer.
+DEFAULT_LATENCIES = {'connect': 0.02, 'download': 0.03, 'comprehend': 0.04, 'bedrock': 0.3,
+                     'bedrock_first_token': 0.1, 'bedrock_fault': 0.02, 'bedrock_per_1k_input': 0.0}
+# HTTP status of the Bedrock errors bedrock_fault can inject
+FAULT_STATUS = {'ThrottlingException': 429, 'ServiceUnavailableException': 503, 'ModelTimeoutException': 408,
+                'InternalServerException': 500}
+# Characters of output text per streamed chunk, roughly one token
+STREAM_CHUNK_CHARS = 4
+
+
+def estimate_tokens(text):
+    """Rough token count, about four characters per token."""
+    return max(1, len(text) // 4)
+
+
+def bedrock_response(analysis, input_tokens=0):
+    """An Anthropic messages response whose text is the given analysis as JSON."""
+    text = json.dumps(analysis, indent=2)
+    return {
+        "id": "msg_local",
+        "type": "message",
+        "role": "assistant",
+        "content": [{"type": "text", "text": text}],
+        "stop_reason": "end_turn",
+        "usage": {"input_tokens": input_tokens, "output_tokens": estimate_tokens(text)}
+    }
+
+
+def event_stream_message(event, event_type='chunk'):
+    """Encode one streamed Bedrock event in the binary application/vnd.amazon.eventstream framing."""
+    payload = json.dumps({'bytes': base64.b64encode(json.dumps(event).encode()).decode()}).encode()
+    headers = b''
+    for name, value in ((':event-type', event_type), (':content-type', 'application/json'),
+                        (':message-type', 'event')):
+        name, value = name.encode(), value.encode()
+        headers += struct.pack('>B', len(name)) + name + b'\x07' + struct.pack('>H', len(value)) + value
+    prelude = struct.pack('>II', 12 + len(headers) + len(payload) + 4, len(headers))
+    message = prelude + struct.pack('>I', binascii.crc32(prelude)) + headers + payload
+    return message + struct.pack('>I', binascii.crc32(message))
+
+
+def streamed_events(text, input_tokens=0):
+    """The Anthropic messages events for a response whose output is text."""
+    yield {'type': 'message_start', 'message': {'id': 'msg_local', 'role': 'assistant', 'content': [],
+                                                'usage': {'input_tokens': input_tokens, 'output_tokens': 1}}}
+    yield {'type': 'content_block_start', 'index': 0, 'content_block': {'type': 'text', 'text': ''}}
+    for start in range(0, len(text), STREAM_CHUNK_CHARS):
+        yield {'type': 'content_block_delta', 'index': 0,
+               'delta': {'type': 'text_delta', 'text': text[start:start + STREAM_CHUNK_CHARS]}}
+    yield {'type': 'content_block_stop', 'index': 0}
+    yield {'type': 'message_delta', 'delta': {'stop_reason': 'end_turn'},
+           'usage': {'output_tokens': estimate_tokens(text)}}
+    yield {'type': 'message_stop'}
+
+
+class LocalAws:
+    """
+    Serves email files and AWS API responses on 127.0.0.1 from a background thread.
+
+    files maps a file ID to the email JSON served at its download URL.
+    bedrock_responder(request_json) returns the analysis for one InvokeModel call.
+    bedrock_fault(request_json), if given, returns an error code (e.g. 'ThrottlingException')
+    to fail that call with, or None to answer it.
+    Use as a context manager; calls counts requests per API.
+    """
+
+    def __init__(self, files=None, latencies=None, bedrock_responder=None, bedrock_fault=None):
+        self.files = dict(files or {})
+        self.latencies = dict(DEFAULT_LATENCIES, **(latencies or {}))
+        self.bedrock_responder = bedrock_responder or (lambda request: DEFAULT_ANALYSIS)
+        self.bedrock_fault = bedrock_fault
+        self.calls = {name: 0 for name in DEFAULT_LATENCIES}
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def endpoint(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def download_url(self, file_id):
+        return f"{self.endpoint}/download/{file_id}"
+
+    def client(self, service_name, **kwargs):
+        """A boto3 client for service_name that sends its requests to this stand-in; kwargs go to boto3.client."""
+        return boto3.client(service_name, endpoint_url=self.endpoint, region_name='us-east-1',
+                            aws_access_key_id='local', aws_secret_access_key='local', **kwargs)
+
+    def __enter__(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Send headers and body together, without Nagle delays, as AWS endpoints do
+            disable_nagle_algorithm = True
+            wbufsize = 64 * 1024
+
+            def do_GET(self):
+                stand_in._handle(self)
+
+            def do_POST(self):
+                stand_in._handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            def handle_error(self, request, client_address):
+                # Clients closing pooled connections are expected
+                pass
+
+        self._server = Server(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _count(self, api, wait=True, extra=0.0):
+        with self._lock:
+            self.calls[api] += 1
+        if wait:
+            time.sleep(self.latencies.get(api, 0) + extra)
+
+    def _handle(self, request):
+        length = int(request.headers.get('Content-Length') or 0)
+        body = request.rfile.read(length) if length else b''
+        path = request.path.split('?', 1)[0]
+
+        if path.startswith('/download/'):
+            self._count('download')
+            document = self.files.get(path[len('/download/'):])
+            if document is None:
+                return self._reply(request, 404, {'message': 'Not found'})
+            return self._reply(request, 200, document)
+
+        if path.startswith('/attached-files/'):
+            self._count('connect')
+            file_id = path.rsplit('/', 1)[1]
+            if file_id not in self.files:
+                return self._reply(request, 404, {'Message': 'File not found'},
+                                   {'x-amzn-ErrorType': 'ResourceNotFoundException'})
+            return self._reply(request, 200, {
+                'FileId': file_id,
+                'FileStatus': 'APPROVED',
+                'DownloadUrlMetadata': {'Url': self.download_url(file_id)}
+            })
+
+        if path.startswith('/model/') and self.bedrock_fault is not None:
+            code = self.bedrock_fault(json.loads(body))
+            if code is not None:
+                self._count('bedrock_fault')
+                return self._reply(request, FAULT_STATUS.get(code, 500), {'message': code},
+                                   {'x-amzn-ErrorType': code})
+
+        if path.startswith('/model/') and path.endswith('/invoke'):
+            input_tokens = estimate_tokens(body.decode())
+            self._count('bedrock', extra=self.latencies['bedrock_per_1k_input'] * input_tokens / 1000)
+            analysis = self.bedrock_responder(json.loads(body))
+            return self._reply(request, 200, bedrock_response(analysis, input_tokens))
+
+        if path.startswith('/model/') and path.endswith('/invoke-with-response-stream'):
+            self._count('bedrock', wait=False)
+            return self._stream(request, json.dumps(self.bedrock_responder(json.loads(body)), indent=2),
+                                estimate_tokens(body.decode()))
+
+        if request.headers.get('X-Amz-Target', '').endswith('.DetectDominantLanguage'):
+            self._count('comprehend')
+            return self._reply(request, 200, {'Languages': [{'LanguageCode': 'en', 'Score': 0.99}]})
+
+        self._reply(request, 400, {'message': f'Unsupported request {request.command} {path}'})
+
+    def _stream(self, request, text, input_tokens):
+        request.send_response(200)
+        request.send_header('Content-Type', 'application/vnd.amazon.eventstream')
+        request.send_header('Transfer-Encoding', 'chunked')
+        request.end_headers()
+        events = list(streamed_events(text, input_tokens))
+        first_token = self.latencies.get('bedrock_first_token', 0)
+        interval = max(0.0, self.latencies.get('bedrock', 0) - first_token) / max(1, len(events))
+        time.sleep(first_token)
+        for event in events:
+            data = event_stream_message(event)
+            request.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+            request.wfile.flush()
+            time.sleep(interval)
+        request.wfile.write(b'0\r\n\r\n')
+
+    @staticmethod
+    def _reply(request, status, payload, headers=None):
+        data = json.dumps(payload).encode('utf-8')
+        request.send_response(status)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            request.send_header(name, value)
+        request.end_headers()
+        request.wfile.write(data)
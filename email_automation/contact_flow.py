@@ -0,0 +1,67 @@
+"""
+The routing contact flows, read from email_assessor/ and adapted to the stack: queue and
+Lambda references, and the time limit of an asynchronous invocation.
+"""
+import copy
+import json
+
+FLOW_PATH = "./email_assessor/Intent_Routing_Email_Flow.content.json"
+# The same routing with the Lambda invoked asynchronously: a Wait step for the invocation follows it,
+# and routing reads the contact attributes the Lambda sets itself instead of $.External. Experimental:
+# written from the synchronous export, not exported from Amazon Connect.
+ASYNC_FLOW_PATH = "./email_assessor/Intent_Routing_Email_Flow_Async.content.json"
+
+# How the flow invokes the Lambda (FLOW_INVOCATION_MODE). Synchronous invocations are limited to
+# 8 seconds; asynchronous ones run for up to 60 while the flow waits for the result.
+INVOCATION_MODES = ('sync', 'async')
+SYNC_TIME_LIMIT = 8
+ASYNC_TIME_LIMIT_MAX = 60
+
+
+def load_flow(path=FLOW_PATH):
+    with open(path, "r") as file:
+        return json.load(file)
+
+
+def _invoke_action(content):
+    return next(action for action in content['Actions'] if action['Type'] == 'InvokeLambdaFunction')
+
+
+def set_async_time_limit(content, time_limit):
+    """
+    Set how long the asynchronous flow waits for the Lambda
+    Args:
+        content (dict): The flow of ASYNC_FLOW_PATH
+        time_limit (int): Seconds, at most 60
+    Returns:
+        dict: A copy of the flow. The invocation and its Wait step get the limit, and the
+            invocation passes it to the Lambda as the flow_time_budget attribute.
+    """
+    if not 1 <= time_limit <= ASYNC_TIME_LIMIT_MAX:
+        raise ValueError(f"The asynchronous invocation time limit must be 1 to {ASYNC_TIME_LIMIT_MAX} seconds")
+    content = copy.deepcopy(content)
+    invoke = _invoke_action(content)
+    if invoke['Parameters'].get('InvocationType') != 'ASYNCHRONOUS':
+        raise ValueError("The asynchronous flow must invoke the Lambda with InvocationType ASYNCHRONOUS")
+    invoke['Parameters']['InvocationTimeLimitSeconds'] = str(time_limit)
+    invoke['Parameters'].setdefault('LambdaInvocationAttributes', {})['flow_time_budget'] = str(time_limit)
+    wait = next(action for action in content['Actions'] if action['Identifier'] == invoke['Transitions']['NextAction'])
+    wait['Parameters']['TimeoutSeconds'] = str(time_limit)
+    return content
+
+
+def resolve_references(content, queue_arns, lambda_arn):
+    """
+    Point the queue steps at the stack's queues and the invocation at the Lambda
+    Args:
+        queue_arns (dict): Queue name, as in the flow file's QueueId, mapped to its ARN
+        lambda_arn: ARN (or CloudFormation token) of the Lambda alias
+    """
+    for action in content['Actions']:
+        if action['Type'] == 'UpdateContactTargetQueue':
+            queue_name = action['Parameters']['QueueId'].split('/')[-1]
+            if queue_name in queue_arns:
+                action['Parameters']['QueueId'] = queue_arns[queue_name]
+        elif action['Type'] == 'InvokeLambdaFunction':
+            action['Parameters']['LambdaFunctionARN'] = lambda_arn
+    return content
@@ -1,11 +1,17 @@
 from aws_cdk import (
-    App,
     Stack,
     aws_lambda as lambda_,
     aws_connect as connect,
     aws_iam as iam,
+    aws_dynamodb as dynamodb,
+    aws_sqs as sqs,
+    aws_lambda_event_sources as lambda_event_sources,
+    aws_applicationautoscaling as appscaling,
+    Annotations,
     CfnOutput,
     Duration,
+    RemovalPolicy,
+    TimeZone,
 )
 from constructs import Construct
 import os
@@ -14,8 +20,8 @@ import json
 import uuid
 import logging
 import subprocess
-import shutil
-import tempfile
+
+from email_automation import contact_flow, layer_build
 
 # Load environment variables from .env file
 load_dotenv()
@@ -24,6 +30,22 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# The layer's packages, installed for the Python version of the function's runtime (PYTHON_3_11)
+LAYER_REQUIREMENTS = ('botocore==1.35.76',)
+LAYER_PYTHON_VERSION = '3.11'
+# Added to the layer for the nearest-neighbour intent index (ENABLE_INTENT_INDEX)
+INTENT_INDEX_REQUIREMENTS = ('numpy==1.26.4',)
+
+# The Lambda code only uses botocore, and only these service models. The models of all other
+# services are removed from the layer, which is most of its size.
+LAYER_SERVICES = ('connect', 'bedrock-runtime', 'comprehend', 's3', 'dynamodb', 'sts')
+
+# Lambda architectures (LAMBDA_ARCHITECTURE) and the pip platform the layer is installed for
+ARCHITECTURES = {
+    'x86_64': (lambda_.Architecture.X86_64, 'manylinux2014_x86_64'),
+    'arm64': (lambda_.Architecture.ARM_64, 'manylinux2014_aarch64'),
+}
+
 class EmailAutomationStack(Stack):
 
     def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
@@ -37,23 +59,90 @@ class EmailAutomationStack(Stack):
 
         connect_instance_arn = os.environ['CONNECT_INSTANCE_ARN']
         hours_of_operation_arn = os.environ['HOURS_OF_OPERATION_ARN']
+        # 'bedrock' has the analysis call return the language too (one call per email instead of two);
+        # 'auto' and 'comprehend' can call Amazon Comprehend, 'local' never does
+        language_detector = self.setting('LANGUAGE_DETECTOR', 'auto')
         environment = {
            "connectBucket": os.environ['CONNECT_BUCKET'],
-           "instName": os.environ['INSTANCE_NAME']
+           "instName": os.environ['INSTANCE_NAME'],
+           "LANGUAGE_DETECTOR": language_detector
         }
 
+        # Capacity settings, from .env or CDK context (cdk deploy -c LAMBDA_MEMORY_SIZE=1024)
+        architecture_name = self.setting('LAMBDA_ARCHITECTURE', 'x86_64').lower()
+        if architecture_name not in ARCHITECTURES:
+            raise ValueError(f"LAMBDA_ARCHITECTURE must be one of {', '.join(ARCHITECTURES)}")
+        architecture, layer_platform = ARCHITECTURES[architecture_name]
+        # Lambda CPU scales with memory: 1769 MB is one full vCPU
+        memory_size = int(self.setting('LAMBDA_MEMORY_SIZE', '256'))
+        reserved_concurrency = self.setting('LAMBDA_RESERVED_CONCURRENCY')
+        reserved_concurrency = int(reserved_concurrency) if reserved_concurrency is not None else None
+        provisioned_concurrency = int(self.setting('PROVISIONED_CONCURRENCY', '0'))
+        provisioned_concurrency_max = int(self.setting('PROVISIONED_CONCURRENCY_MAX', str(provisioned_concurrency)))
+        if provisioned_concurrency_max < provisioned_concurrency:
+            raise ValueError("PROVISIONED_CONCURRENCY_MAX must not be less than PROVISIONED_CONCURRENCY")
+        if reserved_concurrency is not None and provisioned_concurrency_max > reserved_concurrency:
+            raise ValueError("Provisioned concurrency must fit in LAMBDA_RESERVED_CONCURRENCY")
+
         # Generate a unique ID for the contact flow
         contact_flow_id = str(uuid.uuid4())
 
+        # 'async' has the contact flow invoke the Lambda asynchronously and wait up to FLOW_ASYNC_TIME_LIMIT
+        # seconds for the result, instead of failing the contact after the 8 seconds of a synchronous call
+        invocation_mode = self.setting('FLOW_INVOCATION_MODE', 'sync').lower()
+        if invocation_mode not in contact_flow.INVOCATION_MODES:
+            raise ValueError(f"FLOW_INVOCATION_MODE must be one of {', '.join(contact_flow.INVOCATION_MODES)}")
+        flow_time_limit = contact_flow.SYNC_TIME_LIMIT
+        if invocation_mode == 'async':
+            flow_time_limit = int(self.setting('FLOW_ASYNC_TIME_LIMIT', str(contact_flow.ASYNC_TIME_LIMIT_MAX)))
+            # The asynchronous flow file was written by hand from the synchronous export, not exported
+            # from Amazon Connect, so its invoke and wait steps have not been checked against the service
+            Annotations.of(self).add_warning(
+                "FLOW_INVOCATION_MODE=async is experimental: "
+                f"{contact_flow.ASYNC_FLOW_PATH} is not an Amazon Connect export. Check the flow in a test "
+                "instance, or replace the file with the flow exported from the console, before routing live email"
+            )
+
+        # Optionally keep the Bedrock calls of all Lambda instances under the model's requests and tokens
+        # per minute quotas, with token buckets shared through a DynamoDB table. The backfill worker paces
+        # itself on throttles instead, so it does not take the contact flow's admission.
+        admission_table = None
+        bedrock_rpm = int(self.setting('BEDROCK_RPM', '0'))
+        bedrock_tpm = int(self.setting('BEDROCK_TPM', '0'))
+        if bedrock_rpm or bedrock_tpm:
+            admission_table = dynamodb.Table(
+                self, "AdmissionTable",
+                partition_key=dynamodb.Attribute(name="bucket", type=dynamodb.AttributeType.STRING),
+                billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+                removal_policy=RemovalPolicy.DESTROY
+            )
+            environment.update({
+                "BEDROCK_RPM": str(bedrock_rpm),
+                "BEDROCK_TPM": str(bedrock_tpm),
+                "ADMISSION_TABLE": admission_table.table_name
+            })
+
+        # Optionally route emails the keyword rules do not settle from the nearest labelled examples in an
+        # index built with lambda/intent_index.py into lambda/<INTENT_INDEX_DIR>. It needs numpy in the layer.
+        layer_requirements = LAYER_REQUIREMENTS
+        if self.setting('ENABLE_INTENT_INDEX', 'false').lower() == 'true':
+            intent_index_dir = self.setting('INTENT_INDEX_DIR', 'intent_index')
+            if not os.path.isfile(os.path.join('./lambda', intent_index_dir, 'index.json')):
+                raise ValueError(f"No intent index in lambda/{intent_index_dir}; build it with "
+                                 f"python lambda/intent_index.py --examples <file> --output lambda/{intent_index_dir}")
+            layer_requirements = LAYER_REQUIREMENTS + INTENT_INDEX_REQUIREMENTS
+            environment["INTENT_INDEX_DIR"] = intent_index_dir
+
         # Build the Lambda layer
-        layer_asset_path = self.build_layer()
+        layer_asset_path = self.build_layer(layer_platform, layer_requirements)
 
         # Create a Lambda Layer
         lambda_layer = lambda_.LayerVersion(
             self, "LambdaLayer",
             code=lambda_.Code.from_asset(layer_asset_path),
             compatible_runtimes=[lambda_.Runtime.PYTHON_3_11, lambda_.Runtime.PYTHON_3_12],
-            description="Lambda Layer for boto3 and other dependencies"
+            compatible_architectures=[architecture],
+            description="Lambda Layer for botocore and its dependencies"
         )
 
         # Create a Python Lambda function
@@ -62,13 +151,132 @@ class EmailAutomationStack(Stack):
             code=lambda_.Code.from_asset("./lambda"),
             handler="lambda_function.lambda_handler",
             runtime=lambda_.Runtime.PYTHON_3_11,
+            architecture=architecture,
             layers=[lambda_layer],
             environment=environment,
-            timeout=Duration.seconds(30),
-            memory_size=256,
+            # Outlasts the flow's wait, so the Lambda can return its fallback response in time
+            timeout=Duration.seconds(max(30, flow_time_limit + 5)),
+            memory_size=memory_size,
+            reserved_concurrent_executions=reserved_concurrency,
             tracing=lambda_.Tracing.ACTIVE  # Enable X-Ray tracing
         )
 
+        # The contact flow invokes this alias of the published version, which keeps the provisioned
+        # (already initialized) execution environments
+        lambda_alias = lambda_.Alias(
+            self, "LambdaAlias",
+            alias_name="live",
+            version=lambda_fn.current_version,
+            provisioned_concurrent_executions=provisioned_concurrency or None
+        )
+        if provisioned_concurrency_max > provisioned_concurrency:
+            scaling = lambda_alias.add_auto_scaling(
+                min_capacity=provisioned_concurrency,
+                max_capacity=provisioned_concurrency_max
+            )
+            # Track the share of provisioned concurrency in use; 0 leaves only the schedule
+            utilization_target = float(self.setting('PROVISIONED_UTILIZATION_TARGET', '0.7'))
+            if utilization_target > 0:
+                scaling.scale_on_utilization(utilization_target=utilization_target)
+            # Raise the floor ahead of a known surge (e.g. cron(45 7 ? * MON-FRI *)) and lower it after
+            surge_start = self.setting('PROVISIONED_SURGE_START')
+            surge_end = self.setting('PROVISIONED_SURGE_END')
+            time_zone = TimeZone.of(self.setting('PROVISIONED_SURGE_TIME_ZONE', 'UTC'))
+            if surge_start:
+                scaling.scale_on_schedule(
+                    "SurgeStart",
+                    schedule=appscaling.Schedule.expression(surge_start),
+                    min_capacity=int(self.setting('PROVISIONED_SURGE_CONCURRENCY', str(provisioned_concurrency_max))),
+                    time_zone=time_zone
+                )
+            if surge_end:
+                scaling.scale_on_schedule(
+                    "SurgeEnd",
+                    schedule=appscaling.Schedule.expression(surge_end),
+                    min_capacity=provisioned_concurrency,
+                    time_zone=time_zone
+                )
+
+        # Associate the alias with the Connect instance so the contact flow can invoke it
+        connect.CfnIntegrationAssociation(
+            self, "LambdaIntegrationAssociation",
+            instance_id=connect_instance_arn,
+            integration_type="LAMBDA_FUNCTION",
+            integration_arn=lambda_alias.function_arn
+        )
+
+        if admission_table is not None:
+            admission_table.grant_read_write_data(lambda_fn)
+
+        # Optionally create a shared analysis cache table so identical emails skip Bedrock across Lambda instances
+        if self.setting('ENABLE_SHARED_ANALYSIS_CACHE', 'false').lower() == 'true':
+            cache_table = dynamodb.Table(
+                self, "AnalysisCacheTable",
+                partition_key=dynamodb.Attribute(name="cache_key", type=dynamodb.AttributeType.STRING),
+                billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+                time_to_live_attribute="expires_at",
+                removal_policy=RemovalPolicy.DESTROY
+            )
+            cache_table.grant_read_write_data(lambda_fn)
+            lambda_fn.add_environment("ANALYSIS_CACHE_TABLE", cache_table.table_name)
+            CfnOutput(self, "AnalysisCacheTableName", value=cache_table.table_name)
+
+        # Optionally record every analysis result (intent, PII flag, language, stage timings, model) in
+        # gzipped JSON-lines objects under results/dt=<date>/ in the Connect bucket, for analytics
+        if self.setting('ENABLE_RESULT_LOG', 'false').lower() == 'true':
+            lambda_fn.add_environment("RESULT_LOG", "true")
+            lambda_fn.add_to_role_policy(iam.PolicyStatement(
+                actions=["s3:PutObject"],
+                resources=[f"arn:aws:s3:::{os.environ['CONNECT_BUCKET']}/results/*"]
+            ))
+
+        # Optionally create a backfill queue and worker that re-analyze past contacts in bulk.
+        # Each message is {"contact_id": ..., "instance_arn": ...}; results go to connectBucket under backfill/
+        if self.setting('ENABLE_BACKFILL', 'false').lower() == 'true':
+            backfill_timeout = Duration.minutes(5)
+            backfill_dlq = sqs.Queue(self, "BackfillDeadLetterQueue", retention_period=Duration.days(14))
+            backfill_queue = sqs.Queue(
+                self, "BackfillQueue",
+                # SQS recommends six times the function timeout so batches are not redelivered while running
+                visibility_timeout=Duration.minutes(30),
+                dead_letter_queue=sqs.DeadLetterQueue(max_receive_count=3, queue=backfill_dlq)
+            )
+            backfill_fn = lambda_.Function(
+                self, "BackfillFunction",
+                code=lambda_.Code.from_asset("./lambda"),
+                handler="backfill.sqs_handler",
+                runtime=lambda_.Runtime.PYTHON_3_11,
+                # The layer is installed for this architecture
+                architecture=architecture,
+                layers=[lambda_layer],
+                environment=dict(environment, ENABLE_METRICS="false"),
+                timeout=backfill_timeout,
+                memory_size=512
+            )
+            backfill_fn.add_event_source(lambda_event_sources.SqsEventSource(
+                backfill_queue,
+                batch_size=50,
+                max_batching_window=Duration.seconds(30),
+                report_batch_item_failures=True,
+                # Keeps the total Bedrock request rate bounded; each worker adapts its own rate to throttling
+                max_concurrency=int(self.setting('BACKFILL_MAX_CONCURRENCY', '2'))
+            ))
+            backfill_fn.add_to_role_policy(iam.PolicyStatement(
+                actions=["connect:ListContactReferences", "connect:GetAttachedFile"],
+                resources=[f"{connect_instance_arn}/*"]
+            ))
+            backfill_fn.add_to_role_policy(iam.PolicyStatement(
+                actions=["bedrock:InvokeModel"],
+                resources=[
+                    f"arn:aws:bedrock:{self.region}::foundation-model/anthropic.claude-3-haiku-20240307-v1:0"
+                ]
+            ))
+            backfill_fn.add_to_role_policy(iam.PolicyStatement(
+                actions=["s3:PutObject"],
+                resources=[f"arn:aws:s3:::{os.environ['CONNECT_BUCKET']}/backfill/*"]
+            ))
+            CfnOutput(self, "BackfillQueueURL", value=backfill_queue.queue_url)
+
         # Add IAM permissions for Amazon Connect API access (scoped down)
         lambda_fn.add_to_role_policy(iam.PolicyStatement(
             actions=[
@@ -80,19 +288,21 @@ class EmailAutomationStack(Stack):
         # Add IAM permissions for Amazon Bedrock model access (Claude Haiku)
         lambda_fn.add_to_role_policy(iam.PolicyStatement(
             actions=[
-                "bedrock:InvokeModel"
+                "bedrock:InvokeModel",
+                "bedrock:InvokeModelWithResponseStream"
             ],
             resources=[
                 f"arn:aws:bedrock:{self.region}::foundation-model/anthropic.claude-3-haiku-20240307-v1:0"
             ]
         ))
-        # Add IAM permissions for Amazon Comprehend DetectDominantLanguage
-        lambda_fn.add_to_role_policy(iam.PolicyStatement(
-            actions=[
-                "comprehend:DetectDominantLanguage"
-            ],
-            resources=["*"]
-        ))
+        # Add IAM permissions for Amazon Comprehend DetectDominantLanguage, only if the Lambda can call it
+        if language_detector in ('auto', 'comprehend'):
+            lambda_fn.add_to_role_policy(iam.PolicyStatement(
+                actions=[
+                    "comprehend:DetectDominantLanguage"
+                ],
+                resources=["*"]
+            ))
 
         # Create Queues
         queue_names = ["HomeEquity", "CarLoan", "HomeLoan", "Unknown"]
@@ -116,18 +326,21 @@ class EmailAutomationStack(Stack):
 
         # Create Contact Flow
         try:
-            with open("./email_assessor/Intent_Routing_Email_Flow.content.json", "r") as file:
-                content = json.load(file)
+            if invocation_mode == 'async':
+                content = contact_flow.set_async_time_limit(contact_flow.load_flow(contact_flow.ASYNC_FLOW_PATH),
+                                                            flow_time_limit)
+            else:
+                content = contact_flow.load_flow()
         except (FileNotFoundError, json.JSONDecodeError) as e:
             logger.error(f"Error reading contact flow file: {str(e)}")
             raise
 
-        # Update queue references in the content
-        for action in content['Actions']:
-            if action['Type'] == 'UpdateContactTargetQueue':
-                queue_name = action['Parameters']['QueueId'].split('/')[-1]
-                if queue_name in queues:
-                    action['Parameters']['QueueId'] = queues[queue_name].attr_queue_arn
+        # Update queue and Lambda references in the content
+        contact_flow.resolve_references(
+            content,
+            {queue_name: queue.attr_queue_arn for queue_name, queue in queues.items()},
+            lambda_alias.function_arn
+        )
 
         cfn_contact_flow = connect.CfnContactFlow(self, "EmailRoutingContactFlow",
             content=json.dumps(content),
@@ -140,58 +353,44 @@ class EmailAutomationStack(Stack):
 
         # Outputs
         CfnOutput(self, "LambdaFunctionARN", value=lambda_fn.function_arn)
+        CfnOutput(self, "LambdaAliasARN", value=lambda_alias.function_arn)
         CfnOutput(self, "LambdaLayerARN", value=lambda_layer.layer_version_arn)
         CfnOutput(self, "ContactFlowARN", value=cfn_contact_flow.attr_contact_flow_arn)
         for queue_name, queue in queues.items():
             CfnOutput(self, f"Queue{queue_name}ARN", value=queue.attr_queue_arn)
 
-    def build_layer(self):
+    def setting(self, name, default=None):
+        """
+        A deployment setting from CDK context, or else from the environment (.env)
+        Args:
+            name (str): e.g. 'LAMBDA_MEMORY_SIZE'
+            default (str): Used when the setting is not given or empty
+        Returns:
+            str: The setting's value
+        """
+        value = self.node.try_get_context(name)
+        if value is None:
+            value = os.environ.get(name)
+        return default if value is None or value == '' else str(value)
+
+    def build_layer(self, platform='manylinux2014_x86_64', requirements=LAYER_REQUIREMENTS):
         """
-        Build Lambda layer with specific boto3 version and dependencies
+        Build Lambda layer with a specific botocore version and its dependencies, or reuse the
+        cached build for the same requirements, platform and Python version
+        Args:
+            platform (str): pip platform matching the function's architecture
+            requirements (tuple): pip requirement lines
         Returns:
-            str: Path to the created layer zip file
+            str: Path to the layer zip file
         """
-        # Create a temporary directory
-        layer_build_dir = tempfile.mkdtemp(prefix="lambda_layer_")
-        
+        cache_dir = self.setting('LAYER_CACHE_DIR', '.layer_cache')
+        offline = self.setting('LAYER_OFFLINE', 'false').lower() == 'true'
         try:
-            # Create a directory for the layer
-            layer_dir = os.path.join(layer_build_dir, 'python')
-            os.makedirs(layer_dir)
-            
-            # Create requirements.txt with specific versions
-            requirements_path = os.path.join(layer_build_dir, 'requirements.txt')
-            with open(requirements_path, 'w') as f:
-                f.write('boto3==1.35.76\n')
-                f.write('botocore==1.35.76\n')
-            
-            # Install dependencies
-            logger.info("Installing dependencies for Lambda layer...")
-            subprocess.run([
-                'pip3',
-                'install',
-                '-r', requirements_path,
-                '-t', layer_dir,
-                '--platform', 'manylinux2014_x86_64',
-                '--only-binary=:all:'
-            ], check=True)
-            
-            # Create a zip file of the layer contents
-            logger.info("Creating Lambda layer zip file...")
-            layer_zip = os.path.join(layer_build_dir, 'layer.zip')
-            shutil.make_archive(os.path.join(layer_build_dir, 'layer'), 'zip', layer_dir)
-            
-            logger.info(f"Successfully created Lambda layer at: {layer_zip}")
-            return layer_zip
-                
+            return layer_build.build_layer(cache_dir, requirements, platform, LAYER_PYTHON_VERSION,
+                                           LAYER_SERVICES, offline=offline)
         except subprocess.CalledProcessError as e:
             logger.error(f"Failed to install dependencies: {str(e)}")
             raise
         except Exception as e:
             logger.error(f"Error building Lambda layer: {str(e)}")
             raise
-
-
-app = App()
-EmailAutomationStack(app, "EmailAutomationStack")
-app.synth()
\ No newline at end of file
@@ -0,0 +1,140 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import zipfile
+
+logger = logging.getLogger(__name__)
+
+# Bump when the way the layer is built changes, so older cache entries are not reused
+BUILD_FORMAT = 1
+
+# Timestamp of every zip entry (the earliest a zip file can hold), so the same files give the same bytes
+ZIP_TIMESTAMP = (1980, 1, 1, 0, 0, 0)
+
+
+class LayerCacheMiss(RuntimeError):
+    """The layer is not in the cache and building it is not allowed (offline mode)"""
+
+
+def cache_key(requirements, platform, python_version, services):
+    """
+    Content address of a layer build
+    Args:
+        requirements (list): pip requirement lines, e.g. ['botocore==1.35.76']
+        platform (str): pip platform, e.g. 'manylinux2014_aarch64'
+        python_version (str): Python version of the Lambda runtime, e.g. '3.11'
+        services (tuple): botocore service models kept in the layer
+    Returns:
+        str: hex digest that changes whenever any input changes
+    """
+    inputs = {
+        'format': BUILD_FORMAT,
+        'requirements': sorted(requirements),
+        'platform': platform,
+        'python_version': python_version,
+        'services': sorted(services),
+    }
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def write_zip(source_dir, zip_path, prefix=''):
+    """
+    Zip a directory so the same files always give the same bytes: entries in sorted
+    order, one fixed timestamp and the same permissions (rw-r--r--) for every file
+    Args:
+        source_dir (str): Directory to zip
+        zip_path (str): Zip file to write
+        prefix (str): Path of source_dir inside the zip, e.g. 'python/'
+    """
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for root, dirs, files in os.walk(source_dir):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                info = zipfile.ZipInfo(prefix + os.path.relpath(path, source_dir).replace(os.sep, '/'), ZIP_TIMESTAMP)
+                info.compress_type = zipfile.ZIP_DEFLATED
+                info.external_attr = 0o100644 << 16
+                with open(path, 'rb') as f:
+                    archive.writestr(info, f.read())
+
+
+def install(requirements, target_dir, platform, python_version):
+    """pip install the requirements as wheels for the Lambda platform and Python version"""
+    build_dir = os.path.dirname(target_dir)
+    requirements_path = os.path.join(build_dir, 'requirements.txt')
+    with open(requirements_path, 'w') as f:
+        f.write(''.join(f'{line}\n' for line in requirements))
+    subprocess.run([
+        'pip3',
+        'install',
+        '-r', requirements_path,
+        '-t', target_dir,
+        '--platform', platform,
+        '--python-version', python_version,
+        '--only-binary=:all:',
+        # .pyc files embed build times; Lambda compiles what it imports anyway
+        '--no-compile',
+        '--disable-pip-version-check'
+    ], check=True)
+
+
+def prune_services(layer_dir, services):
+    """Remove the botocore service models the Lambda does not use, which are most of the layer's size"""
+    botocore_data = os.path.join(layer_dir, 'botocore', 'data')
+    for entry in os.listdir(botocore_data):
+        path = os.path.join(botocore_data, entry)
+        if os.path.isdir(path) and entry not in services:
+            shutil.rmtree(path)
+
+
+def build_layer(cache_dir, requirements, platform, python_version, services, offline=False):
+    """
+    Return the layer zip for these inputs, building it only if it is not cached yet
+    Args:
+        cache_dir (str): Directory holding one <key>/layer.zip per build
+        requirements (list): pip requirement lines
+        platform (str): pip platform matching the function's architecture
+        python_version (str): Python version of the Lambda runtime
+        services (tuple): botocore service models kept in the layer
+        offline (bool): Raise LayerCacheMiss instead of running pip when the zip is not cached
+    Returns:
+        str: Path to the layer zip file
+    """
+    key = cache_key(requirements, platform, python_version, services)
+    layer_zip = os.path.join(cache_dir, key, 'layer.zip')
+    if os.path.isfile(layer_zip):
+        logger.info(f"Using cached Lambda layer {layer_zip}")
+        return layer_zip
+    if offline:
+        raise LayerCacheMiss(
+            f"Lambda layer for {platform}, Python {python_version} is not in {cache_dir}; "
+            f"run cdk synth once with network access or unset LAYER_OFFLINE"
+        )
+
+    build_dir = tempfile.mkdtemp(prefix="lambda_layer_")
+    try:
+        layer_dir = os.path.join(build_dir, 'python')
+        os.makedirs(layer_dir)
+        logger.info("Installing dependencies for Lambda layer...")
+        install(requirements, layer_dir, platform, python_version)
+        prune_services(layer_dir, services)
+
+        logger.info("Creating Lambda layer zip file...")
+        os.makedirs(os.path.dirname(layer_zip), exist_ok=True)
+        # Written next to its final name and renamed, so an interrupted build never looks cached
+        partial_zip = f"{layer_zip}.{os.getpid()}.partial"
+        try:
+            # Lambda puts /opt/python on the path, so the packages go under python/
+            write_zip(layer_dir, partial_zip, prefix='python/')
+            os.replace(partial_zip, layer_zip)
+        finally:
+            if os.path.exists(partial_zip):
+                os.remove(partial_zip)
+        logger.info(f"Successfully created Lambda layer at: {layer_zip}")
+        return layer_zip
+    finally:
+        shutil.rmtree(build_dir, ignore_errors=True)
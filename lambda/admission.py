@@ -0,0 +1,161 @@
+import json
+import threading
+import time
+
+from resilience import error_code
+
+
+class AdmissionDenied(RuntimeError):
+    """Raised when a call would exceed the quota and waiting for it would take too long"""
+
+
+def take(levels, updated_at, now, costs, limits, burst_seconds):
+    """
+    Refill token buckets for the time passed and take the costs from them, all or nothing
+    Args:
+        levels (dict): Tokens per bucket at updated_at; a missing bucket is full
+        costs (dict): Tokens to take per bucket, e.g. {'requests': 1, 'tokens': 900}
+        limits (dict): Quota per minute per bucket, e.g. {'requests': 200, 'tokens': 200000}
+        burst_seconds (float): Bucket size in seconds of quota
+    Returns:
+        tuple: (new levels, seconds to wait before the costs fit, 0 if they were taken)
+    """
+    elapsed = max(0.0, now - updated_at)
+    refilled = {}
+    wait = 0.0
+    for name, limit in limits.items():
+        rate = limit / 60.0
+        capacity = rate * burst_seconds
+        level = min(capacity, levels.get(name, capacity) + elapsed * rate)
+        refilled[name] = level
+        cost = min(costs.get(name, 0), capacity)
+        if cost > level:
+            wait = max(wait, (cost - level) / rate)
+    if wait > 0:
+        return refilled, wait
+    return {name: level - min(costs.get(name, 0), level) for name, level in refilled.items()}, 0.0
+
+
+class LocalTokenBuckets:
+    """
+    Token buckets held in memory, for one Lambda execution environment. The
+    stand-in for DynamoDBTokenBuckets when no table is configured, and offline.
+    """
+
+    def __init__(self, limits, burst_seconds=10, clock=time.time):
+        self.limits = dict(limits)
+        self.burst_seconds = burst_seconds
+        self.clock = clock
+        self._levels = {}
+        self._updated_at = clock()
+        self._lock = threading.Lock()
+
+    def try_take(self, costs):
+        """Take the costs if they fit; returns the seconds to wait before they would fit, 0 if taken"""
+        with self._lock:
+            now = self.clock()
+            levels, wait = take(self._levels, self._updated_at, now, costs, self.limits, self.burst_seconds)
+            self._levels, self._updated_at = levels, now
+            return wait
+
+
+class DynamoDBTokenBuckets:
+    """
+    Token buckets shared by all Lambda instances, kept in one item of a DynamoDB
+    table with a 'bucket' partition key. Each take reads the item and writes it
+    back on the condition that nobody else wrote it in between; on a conflict
+    the take is repeated with the new levels.
+    """
+
+    def __init__(self, client, table_name, bucket, limits, burst_seconds=10, max_conflicts=3, clock=time.time):
+        self.client = client
+        self.table_name = table_name
+        self.bucket = bucket
+        self.limits = dict(limits)
+        self.burst_seconds = burst_seconds
+        self.max_conflicts = max_conflicts
+        self.clock = clock
+        self.conflicts = 0
+
+    def try_take(self, costs):
+        """Take the costs if they fit; returns the seconds to wait before they would fit, 0 if taken"""
+        for _ in range(self.max_conflicts):
+            item = self.client.get_item(
+                TableName=self.table_name,
+                Key={'bucket': {'S': self.bucket}},
+                ConsistentRead=True
+            ).get('Item')
+            levels, updated_at = {}, 0.0
+            if item:
+                levels = json.loads(item['levels']['S'])
+                updated_at = float(item['updated_at']['N'])
+            now = max(self.clock(), updated_at)
+            levels, wait = take(levels, updated_at, now, costs, self.limits, self.burst_seconds)
+            if wait > 0:
+                return wait
+            condition = {'ConditionExpression': 'attribute_not_exists(#b)', 'ExpressionAttributeNames': {'#b': 'bucket'}}
+            if item:
+                condition = {
+                    'ConditionExpression': 'updated_at = :previous',
+                    'ExpressionAttributeValues': {':previous': item['updated_at']}
+                }
+            try:
+                self.client.put_item(
+                    TableName=self.table_name,
+                    Item={
+                        'bucket': {'S': self.bucket},
+                        'levels': {'S': json.dumps(levels)},
+                        'updated_at': {'N': repr(now)}
+                    },
+                    **condition
+                )
+                return 0.0
+            except Exception as e:
+                if error_code(e) != 'ConditionalCheckFailedException':
+                    raise
+                self.conflicts += 1
+        # Still contended: back off briefly rather than keep the table busy
+        return 0.05
+
+
+class AdmissionController:
+    """
+    Admits a call once its costs fit in the token buckets, waiting up to
+    max_wait seconds (and never past the deadline) for them to refill. Errors
+    of the buckets' table are counted and the call is admitted, so an outage of
+    the table never blocks the calls it protects.
+    """
+
+    def __init__(self, buckets, max_wait=0.5, sleep=time.sleep):
+        self.buckets = buckets
+        self.max_wait = max_wait
+        self.sleep = sleep
+        self.stats = {'admitted': 0, 'denied': 0, 'errors': 0, 'waited_seconds': 0.0}
+
+    def admit(self, costs, deadline=None):
+        """
+        Args:
+            costs (dict): Tokens per bucket
+            deadline (Deadline): The call is denied rather than kept waiting past it
+        Raises:
+            AdmissionDenied: The costs do not fit in time
+        """
+        waited = 0.0
+        while True:
+            try:
+                wait = self.buckets.try_take(costs)
+            except Exception:
+                self.stats['errors'] += 1
+                wait = 0.0
+            if wait <= 0:
+                self.stats['admitted'] += 1
+                self.stats['waited_seconds'] += waited
+                return
+            allowed = self.max_wait - waited
+            if deadline is not None:
+                allowed = min(allowed, deadline.remaining())
+            if wait > allowed:
+                self.stats['denied'] += 1
+                raise AdmissionDenied(f"AdmissionDenied: quota reached, next call fits in {wait:.2f}s")
+            self.sleep(wait)
+            waited += wait
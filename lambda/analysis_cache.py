@@ -0,0 +1,158 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+def make_cache_key(email_content, model_id, instruction):
+    """
+    Build a content-addressed cache key for an analysis request
+    Returns:
+        str: Hex SHA-256 digest of the model ID, instruction and cleaned email body
+    """
+    digest = hashlib.sha256()
+    for part in (model_id, instruction, email_content):
+        digest.update(part.encode('utf-8'))
+        # Separator so ("ab", "c") and ("a", "bc") hash differently
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def only_fields(value, fields):
+    """The given fields of a dict value, or the whole value when fields is None"""
+    if fields is None:
+        return value
+    return {key: value[key] for key in fields if key in value}
+
+
+class LRUTier:
+    """Bounded in-process tier. Lives at module level so it survives warm invocations."""
+
+    def __init__(self, max_entries=256, ttl_seconds=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        expires_at = time.time() + self.ttl_seconds if self.ttl_seconds else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class InMemoryBackend:
+    """Shared-tier stand-in with the same TTL semantics as the DynamoDB backend, for offline use."""
+
+    def __init__(self, ttl_seconds=86400):
+        self.ttl_seconds = ttl_seconds
+        self.items = {}
+
+    def get(self, key):
+        item = self.items.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at <= time.time():
+            del self.items[key]
+            return None
+        return json.loads(value)
+
+    def put(self, key, value):
+        self.items[key] = (json.dumps(value), int(time.time()) + self.ttl_seconds)
+
+
+class DynamoDBBackend:
+    """
+    Shared tier backed by a DynamoDB table with a 'cache_key' partition key and
+    TTL enabled on 'expires_at'. DynamoDB deletes expired items lazily, so reads
+    also check the expiry themselves.
+    """
+
+    def __init__(self, client, table_name, ttl_seconds=86400):
+        self.client = client
+        self.table_name = table_name
+        self.ttl_seconds = ttl_seconds
+
+    def get(self, key):
+        response = self.client.get_item(
+            TableName=self.table_name,
+            Key={'cache_key': {'S': key}}
+        )
+        item = response.get('Item')
+        if not item or int(item['expires_at']['N']) <= time.time():
+            return None
+        return json.loads(item['result']['S'])
+
+    def put(self, key, value):
+        self.client.put_item(
+            TableName=self.table_name,
+            Item={
+                'cache_key': {'S': key},
+                'result': {'S': json.dumps(value)},
+                'expires_at': {'N': str(int(time.time()) + self.ttl_seconds)}
+            }
+        )
+
+
+class AnalysisCache:
+    """
+    Two-tier cache of analysis results: a local LRU tier checked first, then an
+    optional shared tier. Shared-tier hits are copied into the local tier.
+    Errors from the shared tier are counted and treated as misses so a cache
+    outage never fails an invocation. With shared_fields, only those fields of
+    a value are written to the shared tier, e.g. to keep PII out of a table
+    every instance reads.
+    """
+
+    def __init__(self, local, shared=None, shared_fields=None):
+        self.local = local
+        self.shared = shared
+        self.shared_fields = shared_fields
+        self.stats = {'local_hits': 0, 'shared_hits': 0, 'misses': 0, 'errors': 0}
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is not None:
+            self.stats['local_hits'] += 1
+            return value
+
+        if self.shared is not None:
+            try:
+                value = self.shared.get(key)
+            except Exception:
+                self.stats['errors'] += 1
+                value = None
+            if value is not None:
+                self.stats['shared_hits'] += 1
+                self.local.put(key, value)
+                return value
+
+        self.stats['misses'] += 1
+        return None
+
+    def put(self, key, value):
+        self.local.put(key, value)
+        if self.shared is not None:
+            try:
+                self.shared.put(key, only_fields(value, self.shared_fields))
+            except Exception:
+                self.stats['errors'] += 1
@@ -0,0 +1,53 @@
+import threading
+
+# botocore is imported and its session created on the first client request, not at module import
+_session = None
+_lock = threading.RLock()
+
+
+def create_client(service_name, **kwargs):
+    """
+    Create an AWS client from one botocore session shared by all clients
+    Args:
+        service_name (str): e.g. 'bedrock-runtime'
+        kwargs: Passed to create_client (region_name, endpoint_url, config, ...); a config
+            given as a dict is turned into a botocore Config here, so callers need not import botocore
+    """
+    global _session
+    if isinstance(kwargs.get('config'), dict):
+        from botocore.config import Config
+        kwargs['config'] = Config(**kwargs['config'])
+    # Sessions are not safe to create clients from concurrently
+    with _lock:
+        if _session is None:
+            import botocore.session
+            _session = botocore.session.get_session()
+        return _session.create_client(service_name, **kwargs)
+
+
+class LazyClient:
+    """
+    Stands in for an AWS client that is only created the first time one of its
+    methods or attributes is used, then kept for later invocations. Clients the
+    invocation never touches cost nothing at cold start.
+    """
+
+    def __init__(self, service_name, **kwargs):
+        self.service_name = service_name
+        self._kwargs = kwargs
+        self._client = None
+
+    @property
+    def created(self):
+        return self._client is not None
+
+    def get(self):
+        if self._client is None:
+            with _lock:
+                if self._client is None:
+                    self._client = create_client(self.service_name, **self._kwargs)
+        return self._client
+
+    def __getattr__(self, name):
+        # Only called for attributes not set in __init__, i.e. those of the client
+        return getattr(self.get(), name)
@@ -0,0 +1,249 @@
+"""
+Bulk re-analysis of past email contacts, e.g. after the instruction prompt changed.
+
+Runs extract_email_content and call_bedrock from lambda_function for many
+contacts (or exported email JSON files) with bounded concurrency and an
+adaptive rate limit that backs off when Bedrock throttles. Results are
+written to connectBucket as JSON-lines objects of batch_size records each.
+
+As a CLI, progress is checkpointed to a local file after every written
+batch, and a rerun with the same checkpoint skips what is already done:
+
+    python lambda/backfill.py --instance-arn <arn> --contact-ids ids.txt --checkpoint run.ckpt
+    python lambda/backfill.py --files exported/*.json --output-dir results/
+
+As an SQS-triggered Lambda (handler backfill.sqs_handler), each message is
+{"contact_id": "...", "instance_arn": "..."}; failed contacts are reported as
+batch item failures so SQS redelivers only those.
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import lambda_function
+from resilience import Guard, RetryPolicy
+from result_store import BatchWriter, LocalStore, S3Store
+
+# One unit of backfill work: a contact to fetch from Amazon Connect, or an exported email JSON file
+BackfillItem = namedtuple('BackfillItem', ['item_id', 'contact_event', 'path'])
+
+# Error codes that mean "slow down" rather than "this email failed"
+THROTTLE_ERRORS = ('ThrottlingException', 'TooManyRequestsException', 'ServiceUnavailableException',
+                   'ModelNotReadyException')
+
+# Bedrock calls of the backfill make one attempt each, without the handler's circuit breaker and
+# admission control: every throttle reaches the AdaptiveRateLimiter, which does the retrying and pacing
+bedrock_guard = Guard('backfill_bedrock', RetryPolicy(max_attempts=1))
+
+
+class AdaptiveRateLimiter:
+    """
+    Spaces calls evenly at the current rate (calls per second). The rate grows
+    additively after each success, by about `increase` calls per second every
+    second, and is multiplied by `decrease` after each throttle (AIMD), so it
+    settles just below the account's Bedrock quota.
+    """
+
+    def __init__(self, rate=5.0, min_rate=0.2, max_rate=50.0, increase=0.5, decrease=0.5,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.throttles = 0
+        self._clock = clock
+        self._sleep = sleep
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = self._clock()
+            slot = max(now, self._next)
+            self._next = slot + 1.0 / self.rate
+        if slot > now:
+            self._sleep(slot - now)
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+
+    def on_throttle(self):
+        with self._lock:
+            self.throttles += 1
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            # Nobody goes again until a full interval at the new rate has passed
+            self._next = max(self._next, self._clock() + 1.0 / self.rate)
+
+
+class Checkpoint:
+    """Append-only file of the IDs whose results have been written."""
+
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.done = {line.strip() for line in f if line.strip()}
+
+    def mark(self, item_ids):
+        item_ids = [item_id for item_id in item_ids if item_id not in self.done]
+        if not item_ids:
+            return
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(''.join(item_id + '\n' for item_id in item_ids))
+            f.flush()
+            os.fsync(f.fileno())
+        self.done.update(item_ids)
+
+
+def is_throttle(error):
+    return any(code in error for code in THROTTLE_ERRORS)
+
+
+def contact_item(instance_arn, contact_id):
+    return BackfillItem(contact_id, {"InstanceARN": instance_arn, "ContactId": contact_id}, None)
+
+
+def file_item(path):
+    return BackfillItem(os.path.basename(path), None, path)
+
+
+def load_email(item):
+    if item.contact_event is not None:
+        return lambda_function.extract_email_content(item.contact_event)
+    with open(item.path, encoding='utf-8') as f:
+        return lambda_function.process_body(lambda_function.get_message_content(json.load(f)))
+
+
+def analyze_item(item, limiter, instruction, max_attempts=5):
+    """Analyze one email; returns a result record, never raises."""
+    record = {'id': item.item_id, 'model_id': lambda_function.model_id}
+    try:
+        email_content, _ = lambda_function.trim_body(load_email(item))
+    except Exception as e:
+        return dict(record, status='error', error=f"extract: {e}", attempts=0)
+
+    for attempt in range(1, max_attempts + 1):
+        limiter.acquire()
+        result = lambda_function.call_bedrock(lambda_function.bedrock, lambda_function.model_id,
+                                              instruction, email_content, guard=bedrock_guard)
+        if result['success']:
+            limiter.on_success()
+            return dict(record, status='ok', analysis=result['data'], usage=result.get('usage', {}), attempts=attempt)
+        if not is_throttle(result['data']):
+            break
+        limiter.on_throttle()
+    return dict(record, status='error', error=result['data'], attempts=attempt)
+
+
+def run_backfill(items, writer, limiter=None, checkpoint=None, concurrency=8, instruction=None, max_attempts=5):
+    """
+    Analyze items with at most `concurrency` in flight and write the results
+    Returns:
+        dict: counts of ok, error and skipped items, the failed IDs and the objects written
+    """
+    limiter = limiter or AdaptiveRateLimiter()
+    instruction = instruction or lambda_function.instruction
+    done = checkpoint.done if checkpoint else set()
+    stats = {'ok': 0, 'error': 0, 'skipped': 0, 'failed_ids': []}
+
+    def written(records):
+        # Only successes are checkpointed, so a rerun retries the failures
+        if checkpoint:
+            checkpoint.mark([record['id'] for record in records if record['status'] == 'ok'])
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='backfill') as executor:
+        in_flight = []
+        window = concurrency * 4
+
+        def drain(keep):
+            while len(in_flight) > keep:
+                record = in_flight.pop(0).result()
+                stats[record['status']] += 1
+                if record['status'] != 'ok':
+                    stats['failed_ids'].append(record['id'])
+                written(writer.add(record))
+
+        for item in items:
+            if item.item_id in done:
+                stats['skipped'] += 1
+                continue
+            in_flight.append(executor.submit(analyze_item, item, limiter, instruction, max_attempts))
+            # Bounded look-ahead keeps memory flat for very long ID lists
+            drain(window)
+        drain(0)
+
+    written(writer.flush())
+    stats['objects'] = list(writer.objects)
+    stats['final_rate'] = round(limiter.rate, 2)
+    stats['throttles'] = limiter.throttles
+    return stats
+
+
+def sqs_handler(event, context):
+    """Analyze the contacts in a batch of SQS messages and write their results as one object."""
+    items = {}
+    for message in event['Records']:
+        body = json.loads(message['body'])
+        items[message['messageId']] = contact_item(body['instance_arn'], body['contact_id'])
+
+    prefix = f"{os.environ.get('BACKFILL_PREFIX', 'backfill')}/{time.strftime('%Y-%m-%d', time.gmtime())}"
+    writer = BatchWriter(S3Store(lambda_function.s3Client, os.environ['connectBucket']), prefix,
+                         batch_size=len(items) or 1)
+    limiter = AdaptiveRateLimiter(rate=float(os.environ.get('BACKFILL_RATE', '5')),
+                                  max_rate=float(os.environ.get('BACKFILL_MAX_RATE', '50')))
+    stats = run_backfill(items.values(), writer, limiter,
+                         concurrency=int(os.environ.get('BACKFILL_CONCURRENCY', '8')))
+
+    failed = set(stats['failed_ids'])
+    return {'batchItemFailures': [{'itemIdentifier': message_id}
+                                  for message_id, item in items.items() if item.item_id in failed]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--instance-arn', help='Amazon Connect instance ARN of the contacts')
+    parser.add_argument('--contact-ids', help='File with one contact ID per line')
+    parser.add_argument('--files', nargs='*', default=[], help='Exported email JSON files')
+    parser.add_argument('--run-id', default=time.strftime('%Y%m%dT%H%M%S', time.gmtime()))
+    parser.add_argument('--checkpoint', help='Progress file; rerun with the same file to resume')
+    parser.add_argument('--output-dir', help='Write results below this directory instead of connectBucket')
+    parser.add_argument('--instruction-file', help='Instruction prompt to use instead of the current one')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--rate', type=float, default=5.0, help='Initial Bedrock calls per second')
+    parser.add_argument('--max-rate', type=float, default=50.0)
+    parser.add_argument('--batch-size', type=int, default=500, help='Records per output object')
+    args = parser.parse_args()
+
+    items = [file_item(path) for path in args.files]
+    if args.contact_ids:
+        if not args.instance_arn:
+            parser.error('--contact-ids needs --instance-arn')
+        with open(args.contact_ids, encoding='utf-8') as f:
+            items += [contact_item(args.instance_arn, line.strip()) for line in f if line.strip()]
+
+    instruction = None
+    if args.instruction_file:
+        with open(args.instruction_file, encoding='utf-8') as f:
+            instruction = f.read()
+
+    if args.output_dir:
+        store = LocalStore(args.output_dir)
+    else:
+        store = S3Store(lambda_function.s3Client, os.environ['connectBucket'])
+    writer = BatchWriter(store, f"backfill/{args.run_id}", args.batch_size)
+    checkpoint = Checkpoint(args.checkpoint) if args.checkpoint else None
+
+    stats = run_backfill(items, writer, AdaptiveRateLimiter(rate=args.rate, max_rate=args.max_rate),
+                         checkpoint, args.concurrency, instruction)
+    print(json.dumps(stats, indent=2))
+
+
+if __name__ == '__main__':
+    main()
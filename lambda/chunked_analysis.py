@@ -0,0 +1,186 @@
+import re
+import time
+from collections import Counter
+
+from thread_trimmer import CHARS_PER_TOKEN
+
+# Where a chunk may end, best first: after a sentence, then between words
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+WORD_GAP = re.compile(r'\s+')
+
+# Fields of extracted_info that hold one value; other_pii is a list
+SINGLE_INFO_FIELDS = ('phone_number', 'email_address', 'name', 'address', 'account_number')
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN
+
+
+def _cut(text, limit):
+    """Index at most limit characters in at which to end a chunk: a sentence end, a word gap, or limit itself"""
+    window = text[:limit + 1]
+    for pattern in (SENTENCE_END, WORD_GAP):
+        ends = [match.start() for match in pattern.finditer(window) if match.start() > limit // 2]
+        if ends:
+            return ends[-1]
+    return limit
+
+
+def split_chunks(text, chunk_tokens=1000, max_chunks=5):
+    """
+    Split a trimmed email into chunks of at most chunk_tokens, ending them at
+    sentence ends where there is one in the second half of the chunk
+    Args:
+        text (str): Single-line trimmed email text
+        chunk_tokens (int): Size limit of a chunk in tokens (about four characters each)
+        max_chunks (int): Above this the middle chunks are left out; the opening states why
+            the person writes and the end what they ask for, as with the trim budget
+    Returns:
+        tuple: (list of chunks in email order, number of characters left out)
+    """
+    limit = max(1, chunk_tokens * CHARS_PER_TOKEN)
+    chunks = []
+    rest = text.strip()
+    while rest:
+        if len(rest) <= limit:
+            chunks.append(rest)
+            break
+        end = _cut(rest, limit)
+        chunks.append(rest[:end].rstrip())
+        rest = rest[end:].lstrip()
+
+    dropped = 0
+    if len(chunks) > max_chunks:
+        kept = chunks[:max_chunks - 1] + chunks[-1:] if max_chunks > 1 else chunks[:1]
+        dropped = sum(len(chunk) for chunk in chunks) - sum(len(chunk) for chunk in kept)
+        chunks = kept
+    return chunks, dropped
+
+
+def _vote(values):
+    """
+    The value named by the most chunks; ties go to the one named first
+    Args:
+        values (list): One value per chunk in email order, None where the chunk gave none
+    """
+    values = [value for value in values if value]
+    if not values:
+        return None
+    counts = Counter(value.strip().lower() for value in values)
+    best = max(counts.values())
+    return next(value for value in values if counts[value.strip().lower()] == best)
+
+
+def _ordered_union(lists):
+    """Items of the lists in order of first appearance, compared without case"""
+    seen = set()
+    union = []
+    for items in lists:
+        for item in items or []:
+            key = str(item).strip().lower()
+            if key and key not in seen:
+                seen.add(key)
+                union.append(item)
+    return union
+
+
+def _ranked_intents(user_intent, analyses):
+    """The primary intent, then the others by the number of chunks naming them; ties in email order"""
+    named = [_ordered_union([[analysis['user_intent']], analysis.get('intents')]) for analysis in analyses]
+    counts = Counter(str(intent).strip().lower() for intents in named for intent in intents)
+    others = [intent for intent in _ordered_union(named)
+              if str(intent).strip().lower() != str(user_intent).strip().lower()]
+    # sorted is stable, so intents named by as many chunks keep their email order
+    return [user_intent] + sorted(others, key=lambda intent: -counts[str(intent).strip().lower()])
+
+
+def merge_analyses(analyses):
+    """
+    Merge the analyses of the chunks of one email into one analysis. The result
+    depends only on the analyses and their order, not on which finished first.
+      user_intent     the primary intent of the first chunk that gives one. The opening
+                      says why the person writes; the rest of a long email is mostly pasted
+                      statements or history, which would win a majority vote across chunks
+      intents         the primary intent, then every other intent by the number of chunks
+                      naming it, ties in email order
+      pii_detected    true if any chunk found PII
+      extracted_info  per field, the first value found in email order; other_pii is the union
+      language        the language of the most chunks (single-call mode)
+    Args:
+        analyses (list): Completed analyses (see complete_analysis) of the chunks in email order
+    Returns:
+        dict: The merged analysis
+    """
+    user_intent = next((analysis['user_intent'] for analysis in analyses if analysis['user_intent']),
+                       analyses[0]['user_intent'])
+    merged = {
+        'user_intent': user_intent,
+        'intents': _ranked_intents(user_intent, analyses),
+        'pii_detected': any(bool(analysis['pii_detected']) for analysis in analyses),
+        'extracted_info': {},
+    }
+    infos = [analysis.get('extracted_info') or {} for analysis in analyses]
+    for name in SINGLE_INFO_FIELDS:
+        value = next((info[name] for info in infos if info.get(name)), None)
+        if value:
+            merged['extracted_info'][name] = value
+    other_pii = _ordered_union([info.get('other_pii') for info in infos])
+    if other_pii:
+        merged['extracted_info']['other_pii'] = other_pii
+    language = _vote([analysis.get('language') for analysis in analyses])
+    if language:
+        merged['language'] = language
+    return merged
+
+
+def analyze_chunks(analyze, chunks, executor, timeout=None, min_budget=0.0, clock=time.monotonic):
+    """
+    Analyze the chunks concurrently and merge the results
+    Args:
+        analyze (callable): analyze(chunk, timeout) returning a call_bedrock result
+            ({"success", "data", "usage"})
+        chunks (list): Chunks in email order
+        executor (Executor): Runs the chunk calls; its worker count is the parallelism
+        timeout (float): Seconds for all chunks; a chunk that has not started with
+            min_budget seconds left is not sent
+        min_budget (float): Least time worth starting a chunk call with
+    Returns:
+        dict: A call_bedrock result for the whole email, with "chunks" and "failed" counts.
+            The merge of the chunks that succeeded, with the degradation "bedrock_chunks_failed"
+            when some did not, or the degradation of a chunk that succeeded partially; a failure
+            when none did.
+    """
+    expires_at = clock() + timeout if timeout is not None else None
+
+    def run(chunk):
+        remaining = expires_at - clock() if expires_at is not None else None
+        if remaining is not None and remaining < min_budget:
+            return {"success": False, "data": "Not enough time left for the chunk"}
+        return analyze(chunk, remaining)
+
+    futures = [executor.submit(run, chunk) for chunk in chunks]
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception as e:
+            results.append({"success": False, "data": str(e)})
+
+    succeeded = [result for result in results if result['success']]
+    failed = len(results) - len(succeeded)
+    if not succeeded:
+        # All chunks failed alike (e.g. the circuit is open): keep the first failure's degradation
+        return dict(results[0], chunks=len(chunks), failed=failed)
+    usage = {}
+    for result in succeeded:
+        for name, value in (result.get('usage') or {}).items():
+            usage[name] = usage.get(name, 0) + value
+    merged = {"success": True, "data": merge_analyses([result['data'] for result in succeeded]),
+              "usage": usage, "chunks": len(chunks), "failed": failed}
+    if failed:
+        merged['degradation'] = 'bedrock_chunks_failed'
+    else:
+        degradation = next((result['degradation'] for result in succeeded if result.get('degradation')), None)
+        if degradation:
+            merged['degradation'] = degradation
+    return merged
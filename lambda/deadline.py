@@ -0,0 +1,99 @@
+import math
+import threading
+import time
+
+from aws_clients import create_client
+
+
+class Deadline:
+    """
+    Time budget of one invocation. The contact flow stops waiting for the Lambda
+    well before the Lambda itself times out, so the budget is the smaller of the
+    flow's limit and the time Lambda reports as remaining, minus a margin for
+    building and returning the response.
+
+    Stages ask for timeouts that fit the budget, and record the degradations
+    (skipped or cut-short stages) they fall back to.
+    """
+
+    def __init__(self, seconds, clock=time.monotonic):
+        self.clock = clock
+        self.expires_at = clock() + seconds
+        self.degradations = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_context(cls, context, flow_budget, margin=0.0, clock=time.monotonic):
+        seconds = flow_budget
+        get_remaining = getattr(context, 'get_remaining_time_in_millis', None)
+        if get_remaining is not None:
+            seconds = min(seconds, get_remaining() / 1000)
+        return cls(max(0.0, seconds - margin), clock)
+
+    def remaining(self):
+        return max(0.0, self.expires_at - self.clock())
+
+    def allows(self, seconds):
+        """True if at least seconds of the budget are left"""
+        return self.remaining() >= seconds
+
+    def timeout(self, limit):
+        """The stage's own time limit, cut to the remaining budget"""
+        return min(limit, self.remaining())
+
+    def degrade(self, name):
+        with self._lock:
+            if name not in self.degradations:
+                self.degradations.append(name)
+
+
+class BudgetedClients:
+    """
+    Copies of AWS clients whose connect and read timeouts fit a shorter time budget,
+    or the longer one of an asynchronous flow.
+
+    botocore only takes timeouts when a client is created, so a copy is made per
+    timeout step (rounded down to `step` seconds) and kept for later invocations.
+    Copies make a single attempt: a retry would not fit in the budget either.
+    """
+
+    def __init__(self, step=0.5):
+        self.step = step
+        self._copies = {}
+        self._lock = threading.Lock()
+
+    def get(self, client, seconds, limit):
+        """
+        Args:
+            client: AWS client whose read timeout is the stage's own time limit
+            seconds (float): Time left for the call
+            limit (float): The stage's time limit for this call; longer than the client's read
+                timeout when an asynchronous flow allows more time
+        Returns:
+            client when the budget is not shorter than limit and limit is within the client's
+            read timeout, otherwise a copy with timeouts that fit the budget
+        """
+        meta = getattr(client, 'meta', None)
+        if getattr(meta, 'config', None) is None:
+            return client
+        if seconds >= limit and limit <= meta.config.read_timeout:
+            return client
+        timeout = max(self.step, math.floor(min(seconds, limit) / self.step) * self.step)
+        key = (id(client), timeout)
+        with self._lock:
+            entry = self._copies.get(key)
+            if entry is None or entry[0] is not client:
+                from botocore.config import Config
+                copy = create_client(
+                    meta.service_model.service_name,
+                    region_name=meta.region_name,
+                    endpoint_url=meta.endpoint_url,
+                    config=meta.config.merge(Config(
+                        connect_timeout=min(timeout, meta.config.connect_timeout),
+                        read_timeout=timeout,
+                        retries={'total_max_attempts': 1}
+                    ))
+                )
+                # The original is kept so its id cannot be reused by another client
+                entry = self._copies[key] = (client, copy)
+        return entry[1]
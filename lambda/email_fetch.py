@@ -0,0 +1,287 @@
+import codecs
+import json
+import re
+import time
+
+import urllib3
+
+# Fields of the email JSON that may hold the message, most preferred first
+CONTENT_FIELDS = ('messageContent', 'content', 'body', 'text', 'message')
+
+# The body of a JSON string up to (not including) the closing quote or an escape cut off by the chunk end
+STRING_BODY = re.compile(r'[^"\\]*(?:\\(?:["\\/bfnrt]|u[0-9a-fA-F]{4})[^"\\]*)*')
+# The same without validating escapes, for strings that are skipped
+SKIPPED_STRING_BODY = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*', re.S)
+# A UTF-16 high surrogate escape at the end of a chunk; its low surrogate is in the next chunk
+HIGH_SURROGATE_END = re.compile(r'\\u[dD][89abAB][0-9a-fA-F]{2}$')
+WHITESPACE = re.compile(r'[ \t\r\n]*')
+# Rest of a number, true, false or null
+SCALAR = re.compile(r'[^,}\]\s]*')
+# Characters that do not change the nesting of a skipped object or array
+NESTED_TEXT = re.compile(r'[^"{}\[\]]*')
+# Longest escape sequence (\uXXXX)
+MAX_ESCAPE = 6
+
+READ_CHUNK_BYTES = 64 * 1024
+# When reading stops early, up to this many unread bytes are drained so the connection can be reused
+MAX_DRAIN_BYTES = 64 * 1024
+
+_decode_string = json.JSONDecoder(strict=False).decode
+
+
+class JsonContentExtractor:
+    """
+    Pulls the message text out of the email JSON while it is being read,
+    without building the JSON document. Only top-level string values of
+    CONTENT_FIELDS are decoded, and they are fed straight into a sink
+    (normally an HtmlTextNormalizer), so memory stays bounded by the sink's
+    cap no matter how large the email is.
+
+    Like `a or b or c`, the first non-empty field in CONTENT_FIELDS order
+    wins. feed() returns False once nothing later in the document can change
+    the result (the preferred field has been read, or filled the sink).
+    """
+
+    def __init__(self, make_sink, fields=CONTENT_FIELDS):
+        self.make_sink = make_sink
+        self.ranks = {name: rank for rank, name in enumerate(fields)}
+        self.done = False
+        # (rank, sink) of the best non-empty field read so far
+        self._best = None
+        # [rank, sink, non-empty, sink full] of the candidate string being read
+        self._current = None
+        # Raw JSON of a candidate non-string value (an object or number is used as str(value))
+        self._raw = None
+        self._state = 'start'
+        self._pending = ''
+        self._key = None
+        self._key_parts = []
+        self._depth = 0
+
+    def feed(self, text):
+        if self.done:
+            return False
+        data = self._pending + text if self._pending else text
+        self._pending = ''
+        pos = 0
+        end = len(data)
+        while pos < end and not self.done:
+            state = self._state
+            if state == 'string':
+                pos = self._read_string(data, pos)
+            elif state == 'key':
+                pos = self._read_key(data, pos)
+            elif state in ('nested', 'nested_string', 'scalar'):
+                pos = self._skip_value(data, pos)
+            else:
+                pos = WHITESPACE.match(data, pos).end()
+                if pos < end:
+                    pos = self._structure(data[pos], pos)
+        return not self.done
+
+    def close(self):
+        if not self.done and self._state != 'end':
+            raise ValueError("Email file ended before the JSON object was complete")
+        if self._best is None:
+            raise ValueError("No message content found in email file")
+        return self._best[1].close()
+
+    def _structure(self, char, pos):
+        state = self._state
+        if state == 'start' and char == '{':
+            self._state = 'key_or_end'
+        elif state == 'key_or_end' and char == '"':
+            self._key_parts = []
+            self._state = 'key'
+        elif state in ('key_or_end', 'comma_or_end') and char == '}':
+            self._state = 'end'
+            self.done = True
+        elif state == 'comma_or_end' and char == ',':
+            self._state = 'key_or_end'
+        elif state == 'colon' and char == ':':
+            self._state = 'value'
+        elif state == 'value':
+            return self._start_value(char, pos)
+        else:
+            raise ValueError(f"Email file is not a JSON object (unexpected {char!r})")
+        return pos + 1
+
+    def _start_value(self, char, pos):
+        rank = self.ranks.get(self._key)
+        wanted = rank is not None and (self._best is None or rank < self._best[0])
+        if char == '"':
+            self._current = [rank, self.make_sink(), False, False] if wanted else None
+            self._state = 'string'
+            return pos + 1
+        self._raw = [] if wanted else None
+        if char in '{[':
+            self._depth = 1
+            self._state = 'nested'
+            if wanted:
+                self._raw.append(char)
+            return pos + 1
+        self._state = 'scalar'
+        return pos
+
+    def _string_segment(self, data, pos):
+        """Returns (segment, end position, closed); holds back an escape cut off by the chunk end."""
+        match = STRING_BODY.match(data, pos)
+        end = match.end()
+        if end < len(data) and data[end] == '"':
+            return data[pos:end], end + 1, True
+        if end < len(data) and (data[end] != '\\' or len(data) - end >= MAX_ESCAPE):
+            raise ValueError("Email file contains an invalid JSON string escape")
+        segment = data[pos:end]
+        surrogate = HIGH_SURROGATE_END.search(segment)
+        if surrogate:
+            start = surrogate.start()
+            backslashes = len(segment[:start + 1]) - len(segment[:start + 1].rstrip('\\'))
+            if backslashes % 2:
+                segment, end = segment[:start], pos + start
+        self._pending = data[end:]
+        return segment, len(data), False
+
+    def _skip_string(self, data, pos):
+        """Like _string_segment for a string that is not decoded: only finds the closing quote."""
+        end = SKIPPED_STRING_BODY.match(data, pos).end()
+        if end < len(data):
+            if data[end] == '"':
+                return end + 1, True
+            # A backslash as the last character escapes the first character of the next chunk
+            self._pending = '\\'
+        return len(data), False
+
+    def _read_key(self, data, pos):
+        segment, pos, closed = self._string_segment(data, pos)
+        self._key_parts.append(segment)
+        if closed:
+            self._key = _decode_string('"' + ''.join(self._key_parts) + '"')
+            self._state = 'colon'
+        return pos
+
+    def _read_string(self, data, pos):
+        current = self._current
+        if current is None or (current[3] and current[2]):
+            # Not decoded: either not wanted, or the sink is already full
+            pos, closed = self._skip_string(data, pos)
+            segment = ''
+        else:
+            segment, pos, closed = self._string_segment(data, pos)
+        if current is not None and segment:
+            current[2] = True
+            if not current[3]:
+                current[3] = not current[1].feed(_decode_string('"' + segment + '"'))
+            if current[3] and current[0] == 0:
+                # The preferred field filled the sink; the rest of the file cannot matter
+                closed = True
+        if closed:
+            self._state = 'comma_or_end'
+            self._current = None
+            if current is not None and current[2]:
+                self._best = (current[0], current[1])
+                self.done = current[0] == 0
+        return pos
+
+    def _skip_value(self, data, pos):
+        start = pos
+        end = len(data)
+        if self._state == 'scalar':
+            pos = SCALAR.match(data, pos).end()
+            if pos < end:
+                self._state = 'comma_or_end'
+        elif self._state == 'nested_string':
+            pos, closed = self._skip_string(data, pos)
+            if closed:
+                self._state = 'nested'
+            elif self._pending:
+                pos = end = len(data) - len(self._pending)
+        else:
+            pos = NESTED_TEXT.match(data, pos).end()
+            if pos < end:
+                char = data[pos]
+                pos += 1
+                if char == '"':
+                    self._state = 'nested_string'
+                elif char in '{[':
+                    self._depth += 1
+                else:
+                    self._depth -= 1
+                    if self._depth == 0:
+                        self._state = 'comma_or_end'
+
+        if self._raw is not None:
+            self._raw.append(data[start:pos])
+            if self._state == 'comma_or_end':
+                self._finish_raw()
+        return pos if pos < end else len(data)
+
+    def _finish_raw(self):
+        rank = self.ranks[self._key]
+        value = json.loads(''.join(self._raw))
+        self._raw = None
+        if value:
+            sink = self.make_sink()
+            sink.feed(str(value))
+            self._best = (rank, sink)
+            self.done = rank == 0
+
+
+def make_pool(connect_timeout, read_timeout, maxsize=4):
+    """
+    HTTP connection pool for the presigned download URLs. Created once per
+    execution environment so warm invocations reuse open TLS connections.
+    """
+    return urllib3.PoolManager(
+        num_pools=4,
+        maxsize=maxsize,
+        timeout=urllib3.Timeout(connect=connect_timeout, read=read_timeout),
+        retries=urllib3.Retry(total=2, connect=1, read=0, status=0, redirect=2)
+    )
+
+
+def fetch_email_content(pool, url, make_sink, max_bytes, deadline=None):
+    """
+    Download the email JSON and extract its message text in one streaming pass
+    Args:
+        pool (urllib3.PoolManager): Pool from make_pool
+        url (str): Presigned download URL of the email file
+        make_sink (callable): Returns a new sink with feed(text) -> bool and close() -> str
+        max_bytes (int): The download is abandoned with ValueError beyond this size
+        deadline (float): time.monotonic() value after which the download is abandoned
+    Returns:
+        tuple: (message text, bytes read)
+    """
+    response = pool.request('GET', url, preload_content=False)
+    complete = False
+    received = 0
+    declared = response.headers.get('Content-Length')
+    declared = int(declared) if declared and declared.isdigit() else None
+    try:
+        if response.status != 200:
+            raise ValueError(f"Email download failed with HTTP status {response.status}")
+        if declared is not None and declared > max_bytes:
+            raise ValueError(f"Email file is {declared} bytes, over the {max_bytes} byte limit")
+
+        extractor = JsonContentExtractor(make_sink)
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        for chunk in response.stream(READ_CHUNK_BYTES):
+            received += len(chunk)
+            if received > max_bytes:
+                raise ValueError(f"Email file is over the {max_bytes} byte limit")
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError("Email download did not finish in time")
+            if not extractor.feed(decoder.decode(chunk)):
+                break
+        else:
+            complete = True
+            extractor.feed(decoder.decode(b'', final=True))
+        return extractor.close(), received
+    finally:
+        if not complete:
+            # Unread data would corrupt the next request on this connection. A short rest
+            # (typically the closing brace) is cheaper to read than a new TLS handshake.
+            if declared is not None and response.status == 200 and declared - received <= MAX_DRAIN_BYTES:
+                response.drain_conn()
+            else:
+                response.close()
+        response.release_conn()
@@ -0,0 +1,132 @@
+import functools
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# Units accepted by CloudWatch for metrics written in Embedded Metric Format
+MILLISECONDS = 'Milliseconds'
+BYTES = 'Bytes'
+COUNT = 'Count'
+
+
+class InvocationMetrics:
+    """
+    Collects stage durations, payload sizes and the cold-start flag of one
+    invocation and writes them as a single CloudWatch Embedded Metric Format
+    (EMF) log line. CloudWatch turns the line into metrics, so percentiles per
+    stage are available for every invocation without tracing.
+
+    Stages may run on other threads. A stage that is still running when the
+    invocation is flushed (e.g. after a stage timeout) is not recorded, and
+    never leaks into the next invocation.
+
+    writer receives each record as a dict; tests replace it to capture the
+    metrics in memory.
+    """
+
+    def __init__(self, namespace='EmailAutomation', dimensions=None, enabled=True, writer=None):
+        self.namespace = namespace
+        self.dimensions = dict(dimensions or {})
+        self.enabled = enabled
+        self.writer = writer or self.print_record
+        self.cold_start = True
+        self._invocation = 0
+        self._metrics = {}
+        self._properties = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def print_record(record):
+        print(json.dumps(record, default=str))
+
+    def start_invocation(self, **properties):
+        """Reset per-invocation state; the first invocation of the execution environment is the cold start."""
+        with self._lock:
+            self._invocation += 1
+            self._metrics = {'cold_start': (1 if self.cold_start else 0, COUNT)}
+            self._properties = {key: value for key, value in properties.items() if value is not None}
+            self.cold_start = False
+
+    def put_metric(self, name, value, unit=COUNT, invocation=None):
+        with self._lock:
+            if invocation is None or invocation == self._invocation:
+                self._metrics[name] = (value, unit)
+
+    def values(self):
+        """Metric values recorded so far in the current invocation"""
+        with self._lock:
+            return {name: value for name, (value, _) in self._metrics.items()}
+
+    def set_property(self, name, value):
+        """Attach a non-metric value (searchable in Logs Insights) to the record."""
+        with self._lock:
+            self._properties[name] = value
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time the enclosed block as the '<name>_ms' metric. Yields a
+        put_metric(name, value, unit) bound to the current invocation, for
+        sizes measured inside the stage.
+        """
+        invocation = self._invocation
+        started = time.perf_counter()
+        try:
+            yield lambda metric, value, unit=COUNT: self.put_metric(metric, value, unit, invocation)
+        finally:
+            self.put_metric(f"{name}_ms", round((time.perf_counter() - started) * 1000, 3), MILLISECONDS, invocation)
+
+    def timed(self, name):
+        """Decorator form of stage()."""
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def handler(self, fn):
+        """
+        Wrap a Lambda handler: start the invocation, time it as 'total' and
+        flush one record when it returns or raises
+        """
+        @functools.wraps(fn)
+        def wrapper(event, context):
+            self.start_invocation(request_id=getattr(context, 'aws_request_id', None))
+            failed = True
+            try:
+                with self.stage('total'):
+                    result = fn(event, context)
+                failed = isinstance(result, dict) and 'error' in result
+                return result
+            finally:
+                self.put_metric('error', 1 if failed else 0)
+                self.flush()
+        return wrapper
+
+    def flush(self):
+        with self._lock:
+            metrics, self._metrics = self._metrics, {}
+            properties, self._properties = self._properties, {}
+            # Stages still running belong to a finished invocation from now on
+            self._invocation += 1
+        if not self.enabled or not metrics:
+            return None
+
+        record = {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [sorted(self.dimensions)],
+                    'Metrics': [{'Name': name, 'Unit': unit} for name, (_, unit) in sorted(metrics.items())]
+                }]
+            }
+        }
+        record.update(properties)
+        record.update(self.dimensions)
+        record.update({name: value for name, (value, _) in metrics.items()})
+        self.writer(record)
+        return record
@@ -0,0 +1,186 @@
+import html
+import re
+
+# Elements whose content is never visible text
+SKIPPED_ELEMENTS = {'script', 'style', 'head', 'title', 'template', 'noscript', 'xml'}
+# Elements that separate words when rendered, so removing them must leave a space
+BLOCK_ELEMENTS = {
+    'address', 'article', 'aside', 'blockquote', 'br', 'dd', 'div', 'dl', 'dt', 'footer', 'form',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'hr', 'li', 'ol', 'p', 'pre', 'section',
+    'table', 'tbody', 'td', 'tfoot', 'th', 'thead', 'tr', 'ul'
+}
+
+# One token per match: a run of text, a comment opening, a tag, a declaration, or a lone '<'
+TOKEN = re.compile(r"""
+    (?P<text>[^<]+)
+  | (?P<comment><!--)
+  | <(?P<closing>/?)(?P<name>[a-zA-Z][\w:.-]*)(?:[\s/][^>]*)?>
+  | <[!?/][^>]*>
+  | <
+""", re.S | re.X)
+# An entity reference that may be cut off at the end of a chunk
+PARTIAL_ENTITY = re.compile(r'&#?\w{0,32}$')
+COMMENT_END = re.compile('-->')
+SKIPPED_ELEMENT_END = {name: re.compile(rf'</{name}\s*>', re.I) for name in SKIPPED_ELEMENTS}
+# Longest tail kept back while looking for a closing marker split across chunks
+MAX_MARKER = 32
+
+
+class HtmlTextNormalizer:
+    """
+    Converts HTML (or plain text) to a single line of visible text in one pass
+    over the input. Tags are dropped, entities are decoded, comments and the
+    content of script/style/head elements are skipped, and runs of whitespace
+    collapse to a single space. Input can be fed in chunks of any size; only
+    an incomplete tag or entity at the end of a chunk is held back.
+
+    Once max_chars characters have been produced, feed() returns False and the
+    rest of the input can be left unread.
+
+    With keep_lines, line breaks in the text and block-level tags produce a
+    single newline instead of a space, and lines inside <blockquote> are
+    prefixed with '> ' like a plain-text reply, so reply chains can still be
+    recognized afterwards.
+    """
+
+    def __init__(self, max_chars=None, keep_lines=False):
+        self.max_chars = max_chars
+        self.keep_lines = keep_lines
+        self.parts = []
+        self.length = 0
+        self.full = False
+        self.chars_in = 0
+        self._pending = ''
+        # Separator owed before the next word: '', ' ' or '\n'
+        self._separator = ''
+        self._quote_depth = 0
+        # Regex for the end of a skipped region (comment or skipped element), when inside one
+        self._skip_until = None
+
+    def feed(self, chunk):
+        if self.full:
+            return False
+        self.chars_in += len(chunk)
+        self._process(self._pending + chunk if self._pending else chunk, final=False)
+        return not self.full
+
+    def close(self):
+        if self._pending and not self.full:
+            pending, self._pending = self._pending, ''
+            self._process(pending, final=True)
+        return ''.join(self.parts)
+
+    def _process(self, data, final):
+        pos = 0
+        end = len(data)
+        self._pending = ''
+        while pos < end and not self.full:
+            if self._skip_until is not None:
+                match = self._skip_until.search(data, pos)
+                if match is None:
+                    # Keep just enough to recognize a closing marker split across chunks
+                    if not final:
+                        self._pending = data[max(pos, end - MAX_MARKER):]
+                    return
+                self._skip_until = None
+                pos = match.end()
+
+            for token in TOKEN.finditer(data, pos):
+                kind = token.lastgroup
+                if kind == 'text':
+                    text = token.group()
+                    if token.end() == end and not final:
+                        # The text may end in an entity that continues in the next chunk
+                        partial = PARTIAL_ENTITY.search(text, max(0, len(text) - 34))
+                        if partial:
+                            self._pending = text[partial.start():]
+                            text = text[:partial.start()]
+                    self._emit_text(text)
+                elif kind == 'name':
+                    name = token.group('name').lower()
+                    if name in BLOCK_ELEMENTS:
+                        self._break('\n' if self.keep_lines else ' ')
+                        if name == 'blockquote':
+                            self._quote_depth = max(0, self._quote_depth + (-1 if token.group('closing') else 1))
+                    elif name in SKIPPED_ELEMENTS and not token.group('closing') and token.group()[-2] != '/':
+                        self._skip_until = SKIPPED_ELEMENT_END[name]
+                        pos = token.end()
+                        break
+                elif kind == 'comment':
+                    self._skip_until = COMMENT_END
+                    pos = token.end()
+                    break
+                elif token.group() == '<':
+                    # Either a tag cut off at the end of the chunk, or a '<' that is plain text ("x <y")
+                    if not final and data.find('>', token.start()) == -1:
+                        self._pending = data[token.start():]
+                        return
+                    self._emit_text('<')
+                # Declarations (<!DOCTYPE>, <![if mso]>) and processing instructions are dropped
+                if self.full:
+                    return
+            else:
+                return
+
+    def _break(self, separator):
+        # A newline wins over a space when both are owed
+        if separator == '\n' or not self._separator:
+            self._separator = separator
+
+    def _emit_text(self, text):
+        if '&' in text:
+            text = html.unescape(text)
+        if self.keep_lines and '\n' in text:
+            for index, line in enumerate(text.split('\n')):
+                if index:
+                    self._break('\n')
+                self._emit_words(line)
+        else:
+            self._emit_words(text)
+
+    def _emit_words(self, text):
+        words = text.split()
+        if not words:
+            if text:
+                self._break(' ')
+            return
+        if text[0].isspace():
+            self._break(' ')
+
+        piece = ' '.join(words)
+        if self.parts:
+            if self._quote_depth and self._separator == '\n':
+                piece = '\n> ' + piece
+            else:
+                piece = self._separator + piece
+        elif self._quote_depth and self.keep_lines:
+            piece = '> ' + piece
+        self._separator = ''
+        if text[-1].isspace():
+            self._break(' ')
+
+        if self.max_chars is not None and self.length + len(piece) >= self.max_chars:
+            piece = piece[:self.max_chars - self.length].rstrip()
+            self.full = True
+        self.parts.append(piece)
+        self.length += len(piece)
+
+
+def normalize_html(source, max_chars=None, keep_lines=False):
+    """
+    Normalize HTML or plain text to visible text
+    Args:
+        source (str | iterable): The whole document, or an iterable of text chunks read incrementally
+        max_chars (int): Hard cap on the length of the returned text
+        keep_lines (bool): Keep line breaks and mark quoted lines with '> '
+    Returns:
+        str: Visible text with whitespace collapsed
+    """
+    normalizer = HtmlTextNormalizer(max_chars, keep_lines)
+    if isinstance(source, str):
+        normalizer.feed(source)
+    else:
+        for chunk in source:
+            if not normalizer.feed(chunk):
+                break
+    return normalizer.close()
@@ -0,0 +1,137 @@
+import json
+
+_decode = json.JSONDecoder(strict=False).decode
+
+
+class IncrementalObjectParser:
+    """
+    Collects the top-level fields of a JSON object from model output that
+    arrives in pieces. A field is available as soon as its value is complete,
+    before the rest of the object has been generated.
+
+    It tolerates what models put around the JSON: any text before the first
+    '{' (e.g. "Here is the analysis:" or a code fence) and anything after the
+    closing '}' is ignored. Whitespace inside string values is kept as is.
+    """
+
+    def __init__(self):
+        self.fields = {}
+        self.complete = False
+        self._text = ''
+        self._pos = 0
+        self._state = 'seek'
+        self._key = None
+        self._value_start = None
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, text):
+        """Add output text; returns the names of the fields completed by it."""
+        if self.complete:
+            return []
+        self._text += text
+        completed = []
+        text = self._text
+        pos = self._pos
+        end = len(text)
+        while pos < end and not self.complete:
+            char = text[pos]
+            state = self._state
+            if state == 'seek':
+                found = text.find('{', pos)
+                if found == -1:
+                    pos = end
+                    break
+                pos = found
+                self._state = 'key_or_end'
+            elif state in ('key', 'value') and (self._in_string or state == 'key'):
+                pos = self._scan_string(text, pos)
+                if not self._in_string:
+                    if state == 'key':
+                        self._key = _decode(text[self._value_start:pos])
+                        self._state = 'colon'
+                    elif self._depth == 0:
+                        completed.append(self._finish_value(text, pos))
+                continue
+            elif state == 'value':
+                if self._value_start is None:
+                    if char.isspace():
+                        pos += 1
+                        continue
+                    self._value_start = pos
+                if char == '"':
+                    self._in_string = True
+                    pos += 1
+                    continue
+                if char in '{[':
+                    self._depth += 1
+                elif char in '}]' and self._depth:
+                    self._depth -= 1
+                    if self._depth == 0:
+                        completed.append(self._finish_value(text, pos + 1))
+                        pos += 1
+                        continue
+                elif self._depth == 0 and (char in ',}' or char.isspace()):
+                    # End of a number, true, false or null
+                    completed.append(self._finish_value(text, pos))
+                    continue
+                pos += 1
+                continue
+            elif char.isspace():
+                pass
+            elif state == 'key_or_end' and char == '"':
+                self._state = 'key'
+                self._value_start = pos
+                self._in_string = True
+            elif state in ('key_or_end', 'comma_or_end') and char == '}':
+                self.complete = True
+            elif state == 'comma_or_end' and char == ',':
+                self._state = 'key_or_end'
+            elif state == 'colon' and char == ':':
+                self._state = 'value'
+                self._value_start = None
+            else:
+                # Not valid JSON from here; keep what was complete so far
+                self.complete = True
+            pos += 1
+        self._pos = pos
+        return [name for name in completed if name is not None]
+
+    def _scan_string(self, text, pos):
+        """Advance over string content; clears _in_string after the closing quote."""
+        end = len(text)
+        while pos < end:
+            char = text[pos]
+            pos += 1
+            if self._escaped:
+                self._escaped = False
+            elif char == '\\':
+                self._escaped = True
+            elif char == '"':
+                self._in_string = False
+                break
+        return pos
+
+    def _finish_value(self, text, end):
+        self._state = 'comma_or_end'
+        raw = text[self._value_start:end]
+        self._value_start = None
+        try:
+            self.fields[self._key] = _decode(raw)
+        except ValueError:
+            return None
+        return self._key
+
+
+def parse_model_json(text):
+    """
+    Parse the JSON object in a complete model response, ignoring surrounding text
+    Raises:
+        ValueError: If the output contains no complete JSON object
+    """
+    parser = IncrementalObjectParser()
+    parser.feed(text)
+    if not parser.complete or not parser.fields:
+        raise ValueError("Model output does not contain a complete JSON object")
+    return parser.fields
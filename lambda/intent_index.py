@@ -0,0 +1,204 @@
+"""
+Nearest-neighbour intent index built from labelled, already-routed emails.
+
+The examples are embedded into an L2-normalized float32 matrix that is shipped
+with the Lambda code as vectors.npy and memory-mapped at load time. An email is
+routed from a vote of its top-k most similar examples (cosine similarity, one
+matrix-vector product); when the vote is close, the caller falls through to
+Bedrock. numpy is only needed when an index is used.
+
+Build an index from a JSON-lines file of {"text": ..., "intent": ...} examples:
+
+    python lambda/intent_index.py --examples routed_emails.jsonl --output lambda/intent_index
+"""
+import argparse
+import json
+import os
+import re
+import zlib
+
+import numpy as np
+
+from intent_rules import DEFAULT_RULES, PII_HINT
+
+VECTORS_FILE = 'vectors.npy'
+LABELS_FILE = 'labels.npy'
+INDEX_FILE = 'index.json'
+
+# user_intent of each intent; intents the keyword rules know keep their label, so the contact
+# flow's conditions match, and anything else (e.g. Unknown) is returned as it is named
+INTENT_LABELS = {intent: rule['label'] for intent, rule in DEFAULT_RULES.items()}
+
+WORD = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+
+
+class HashingVectorizer:
+    """
+    Word unigrams and bigrams hashed into `dims` signed buckets (CRC32, so the
+    buckets are the same in every process), weighted 1 + log(count) and
+    L2-normalized. Nothing is fitted, so examples can be added without
+    rebuilding a vocabulary.
+    """
+
+    def __init__(self, dims=512, ngrams=2):
+        self.dims = dims
+        self.ngrams = ngrams
+
+    def config(self):
+        return {'type': 'hashing', 'dims': self.dims, 'ngrams': self.ngrams}
+
+    def features(self, text):
+        words = WORD.findall(text.lower())
+        counts = {}
+        for n in range(1, self.ngrams + 1):
+            for start in range(len(words) - n + 1):
+                gram = ' '.join(words[start:start + n])
+                counts[gram] = counts.get(gram, 0) + 1
+        return counts
+
+    def __call__(self, texts):
+        """
+        Args:
+            texts (list): Email texts
+        Returns:
+            numpy.ndarray: float32 matrix with one L2-normalized row per text
+        """
+        matrix = np.zeros((len(texts), self.dims), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for gram, count in self.features(text).items():
+                code = zlib.crc32(gram.encode('utf-8'))
+                matrix[row, code % self.dims] += (1.0 + np.log(count)) * (1.0 if code & 0x80000000 else -1.0)
+        return normalize_rows(matrix)
+
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return (matrix / np.where(norms == 0, 1.0, norms)).astype(np.float32)
+
+
+class IntentIndex:
+    """
+    Top-k cosine vote over labelled example vectors. Each of the k nearest
+    examples adds its similarity to its intent; the margin is the winning
+    intent's lead over the runner-up as a share of all votes. classify()
+    answers like IntentRuleClassifier: a Bedrock-shaped analysis when the
+    margin and the best similarity clear their thresholds, otherwise None.
+
+    embed is any function from a list of texts to a matrix with one row per
+    text, e.g. a sentence embedding model; it must be the one the index was
+    built with.
+    """
+
+    def __init__(self, vectors, labels, intents, embed, k=7, margin=0.5, min_similarity=0.3, skip_pii=True):
+        self.vectors = vectors
+        self.labels = labels
+        self.intents = list(intents)
+        self.embed = embed
+        self.k = min(k, len(labels))
+        self.margin = margin
+        self.min_similarity = min_similarity
+        self.skip_pii = skip_pii
+        self.stats = {'fast_path': 0, 'bedrock': 0}
+
+    @classmethod
+    def build(cls, examples, embed=None, **kwargs):
+        """
+        Args:
+            examples (list): dicts with 'text' and 'intent'
+            embed: Embedding function; a 512-bucket HashingVectorizer by default
+        """
+        embed = embed or HashingVectorizer()
+        intents = sorted({example['intent'] for example in examples})
+        labels = np.array([intents.index(example['intent']) for example in examples], dtype=np.int16)
+        vectors = normalize_rows(np.asarray(embed([example['text'] for example in examples]), dtype=np.float32))
+        return cls(vectors, labels, intents, embed, **kwargs)
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, VECTORS_FILE), self.vectors)
+        np.save(os.path.join(directory, LABELS_FILE), self.labels)
+        embedder = self.embed.config() if isinstance(self.embed, HashingVectorizer) else {'type': 'custom'}
+        with open(os.path.join(directory, INDEX_FILE), 'w') as f:
+            json.dump({'intents': self.intents, 'embedder': embedder, 'examples': len(self.labels)}, f, indent=1)
+
+    @classmethod
+    def load(cls, directory, embed=None, **kwargs):
+        """
+        Memory-map an index written by save(); pages of the matrix are read as they are used
+        Args:
+            embed: Required if the index was built with a custom embedding function
+        """
+        with open(os.path.join(directory, INDEX_FILE)) as f:
+            meta = json.load(f)
+        if embed is None:
+            embedder = meta['embedder']
+            if embedder.get('type') != 'hashing':
+                raise ValueError(f"The index in {directory} was built with a custom embedding function; pass embed")
+            embed = HashingVectorizer(embedder['dims'], embedder['ngrams'])
+        vectors = np.load(os.path.join(directory, VECTORS_FILE), mmap_mode='r')
+        labels = np.load(os.path.join(directory, LABELS_FILE))
+        return cls(vectors, labels, meta['intents'], embed, **kwargs)
+
+    def search(self, text):
+        """
+        Returns:
+            tuple: (intent, margin, similarity of the nearest example)
+        """
+        query = np.asarray(self.embed([text]), dtype=np.float32)[0]
+        similarities = self.vectors @ query
+        top = np.argpartition(-similarities, self.k - 1)[:self.k]
+        votes = np.bincount(self.labels[top], weights=np.maximum(similarities[top], 0.0),
+                            minlength=len(self.intents))
+        ranked = np.argsort(-votes)
+        total = votes.sum()
+        runner_up = votes[ranked[1]] if len(ranked) > 1 else 0.0
+        margin = float((votes[ranked[0]] - runner_up) / total) if total > 0 else 0.0
+        return self.intents[ranked[0]], margin, float(similarities[top].max())
+
+    def classify(self, text):
+        """
+        Returns:
+            dict: Bedrock-shaped analysis result, or None when the email should go to Bedrock
+        """
+        result = None
+        if not (self.skip_pii and PII_HINT.search(text)):
+            intent, margin, similarity = self.search(text)
+            if margin >= self.margin and similarity >= self.min_similarity:
+                label = INTENT_LABELS.get(intent, intent)
+                result = {
+                    "intents": [label],
+                    "pii_detected": False,
+                    "extracted_info": {},
+                    "user_intent": label,
+                    "confidence": round(margin, 3)
+                }
+
+        self.stats['fast_path' if result else 'bedrock'] += 1
+        return result
+
+
+def load_examples(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build an intent index from a JSON lines file of labelled emails")
+    parser.add_argument('--examples', required=True, help='JSON lines with "text" and "intent" per example')
+    parser.add_argument('--output', required=True, help='Directory to write the index to')
+    parser.add_argument('--dims', type=int, default=512)
+    parser.add_argument('--ngrams', type=int, default=2)
+    parser.add_argument('--split', help='Only use examples whose "split" field has this value, e.g. train')
+    args = parser.parse_args()
+
+    examples = load_examples(args.examples)
+    if args.split:
+        examples = [example for example in examples if example.get('split') == args.split]
+    index = IntentIndex.build(examples, HashingVectorizer(args.dims, args.ngrams))
+    index.save(args.output)
+    counts = {intent: int((index.labels == position).sum()) for position, intent in enumerate(index.intents)}
+    print(f"Wrote {len(examples)} examples ({index.vectors.nbytes} bytes of vectors) to {args.output}: {counts}")
+
+
+if __name__ == '__main__':
+    main()
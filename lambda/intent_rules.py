@@ -0,0 +1,167 @@
+import json
+import re
+from collections import deque
+
+# Phrase weights per routing intent. 'label' is returned as user_intent and must
+# match the contact flow's "Check contact attributes" conditions (TextContains
+# "equity", "car loan", "vehicle loan", "home loan", "house purchase", "mortgage").
+DEFAULT_RULES = {
+    "HomeEquity": {
+        "label": "Home equity loan request",
+        "phrases": {
+            "home equity": 3,
+            "heloc": 3,
+            "equity line": 3,
+            "line of credit": 1,
+            "equity loan": 3,
+            "borrow against my home": 2,
+            "borrow against my house": 2,
+            "cash out refinance": 2,
+        }
+    },
+    "CarLoan": {
+        "label": "Car loan request",
+        "phrases": {
+            "car loan": 3,
+            "auto loan": 3,
+            "vehicle loan": 3,
+            "finance a car": 3,
+            "new car": 2,
+            "used car": 2,
+            "buy a car": 2,
+            "purchase a car": 2,
+            "truck": 1,
+            "vehicle": 1,
+            "dealership": 1,
+        }
+    },
+    "HomeLoan": {
+        "label": "Home loan request",
+        "phrases": {
+            "home loan": 3,
+            "mortgage": 3,
+            "first home": 2,
+            "dream home": 2,
+            "buy a house": 2,
+            "purchase a house": 2,
+            "house purchase": 3,
+            "pre-approval": 1,
+            "preapproval": 1,
+            "down payment": 1,
+        }
+    }
+}
+
+# Emails that look like they carry contact details or account numbers still go to
+# Bedrock so the PII attributes are extracted.
+PII_HINT = re.compile(r'@|\d[\d\s().-]{6,}\d')
+
+
+class AhoCorasick:
+    """Multi-pattern matcher that finds every phrase in a single scan of the text."""
+
+    def __init__(self, patterns):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for pattern in patterns:
+            self._add(pattern)
+        self._build()
+
+    def _add(self, pattern):
+        node = 0
+        for char in pattern:
+            if char not in self.goto[node]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+                self.goto[node][char] = len(self.goto) - 1
+            node = self.goto[node][char]
+        self.output[node].append(pattern)
+
+    def _build(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                if node:
+                    fallback = self.fail[node]
+                    while fallback and char not in self.goto[fallback]:
+                        fallback = self.fail[fallback]
+                    self.fail[child] = self.goto[fallback].get(char, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def iter_matches(self, text):
+        """Yield (start, pattern) for every occurrence, including overlapping ones."""
+        node = 0
+        for index, char in enumerate(text):
+            while node and char not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(char, 0)
+            for pattern in self.output[node]:
+                yield index - len(pattern) + 1, pattern
+
+
+class IntentRuleClassifier:
+    """
+    Scores each intent by the summed weight of the distinct phrases found in the
+    email. The confidence is the top intent's share of the total score; a result
+    is only returned when both the top score and the confidence clear their
+    thresholds, otherwise the caller falls through to Bedrock.
+    """
+
+    def __init__(self, rules=None, threshold=0.8, min_score=2.0, skip_pii=True):
+        self.rules = rules or DEFAULT_RULES
+        self.threshold = threshold
+        self.min_score = min_score
+        self.skip_pii = skip_pii
+        self.phrase_intents = {}
+        for intent, rule in self.rules.items():
+            for phrase, weight in rule['phrases'].items():
+                self.phrase_intents.setdefault(phrase.lower(), []).append((intent, float(weight)))
+        self.matcher = AhoCorasick(self.phrase_intents)
+        self.stats = {'fast_path': 0, 'bedrock': 0}
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        with open(path) as f:
+            return cls(json.load(f), **kwargs)
+
+    def score(self, text):
+        text = text.lower()
+        seen = set()
+        scores = {}
+        for start, phrase in self.matcher.iter_matches(text):
+            end = start + len(phrase)
+            # Only count whole-word matches, and each phrase once
+            if phrase in seen or (start > 0 and text[start - 1].isalnum()) or (end < len(text) and text[end].isalnum()):
+                continue
+            seen.add(phrase)
+            for intent, weight in self.phrase_intents[phrase]:
+                scores[intent] = scores.get(intent, 0.0) + weight
+        return scores
+
+    def classify(self, text):
+        """
+        Returns:
+            dict: Bedrock-shaped analysis result, or None when the email should go to Bedrock
+        """
+        result = None
+        if not (self.skip_pii and PII_HINT.search(text)):
+            scores = self.score(text)
+            if scores:
+                intent, top = max(scores.items(), key=lambda item: item[1])
+                confidence = top / sum(scores.values())
+                if top >= self.min_score and confidence >= self.threshold:
+                    label = self.rules[intent]['label']
+                    result = {
+                        "intents": [label],
+                        "pii_detected": False,
+                        "extracted_info": {},
+                        "user_intent": label,
+                        "confidence": round(confidence, 3)
+                    }
+
+        self.stats['fast_path' if result else 'bedrock'] += 1
+        return result
@@ -1,69 +1,519 @@
 import json
-import boto3
 import os
 import re
-import datetime
-import urllib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-from email import encoders
-from urllib.request import urlopen
-
-# Enable logging if environment variable is set to 'true'
+import signal
+import sys
+import time
+from collections import namedtuple
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from aws_clients import LazyClient
+from analysis_cache import AnalysisCache, LRUTier, DynamoDBBackend, make_cache_key, only_fields
+from intent_rules import IntentRuleClassifier, PII_HINT
+from pii_extractor import ACCOUNT_FORMATS, FIELDS as LOCAL_PII_FIELDS, PiiExtractor, extracted_info
+from language_id import LanguageIdentifier
+from html_normalizer import HtmlTextNormalizer, normalize_html
+from email_fetch import make_pool, fetch_email_content
+from incremental_json import IncrementalObjectParser, parse_model_json
+from thread_trimmer import trim_email
+from structured_log import StructuredLogger
+from emf_metrics import InvocationMetrics, BYTES, COUNT, MILLISECONDS
+from deadline import Deadline, BudgetedClients
+from resilience import CircuitBreaker, CircuitOpenError, Guard, RetryPolicy
+from admission import AdmissionController, AdmissionDenied, DynamoDBTokenBuckets, LocalTokenBuckets
+from chunked_analysis import analyze_chunks, estimate_tokens, split_chunks
+from result_store import BatchWriter, LocalStore, S3Store, WriteBehindBuffer, date_partition
+from near_duplicate import Fingerprinter, NearDuplicateIndex, scope_keys
+
+# Enable logging if environment variable is set to 'true'; errors are always logged, without
+# the debug trail that otherwise precedes them.
+# LOG_SAMPLE_RATE is the share of invocations logged in full at DEBUG level. Records are
+# only serialized when written, and email bodies, PII, email addresses and URLs are redacted unless
+# LOG_BODIES is 'true'.
 enable_logging = os.environ.get('ENABLE_LOGGING', 'true') == 'true'
+log = StructuredLogger(
+    level=os.environ.get('LOG_LEVEL', 'INFO') if enable_logging else 'ERROR',
+    sample_rate=float(os.environ.get('LOG_SAMPLE_RATE', '0.01')) if enable_logging else 0.0,
+    max_field_chars=int(os.environ.get('LOG_MAX_FIELD_CHARS', '1000')),
+    log_bodies=os.environ.get('LOG_BODIES', 'false') == 'true',
+    buffer_size=200 if enable_logging else 0
+)
+
+# Per-stage durations and payload sizes, written as one CloudWatch Embedded Metric Format line per invocation
+metrics = InvocationMetrics(
+    namespace=os.environ.get('METRICS_NAMESPACE', 'EmailAutomation'),
+    dimensions={'function_name': os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'local')},
+    enabled=os.environ.get('ENABLE_METRICS', 'true') == 'true'
+)
 
 # Define the Bedrock model ID
 model_id = "anthropic.claude-3-haiku-20240307-v1:0"
-connectClient = boto3.client('connect')
-s3Client = boto3.client('s3')
-bedrock = boto3.client('bedrock-runtime')
+# AWS clients are created on first use and kept for warm invocations. Clients an email does not
+# need (Comprehend when the language is identified locally, S3 outside the backfill) are never built.
+connectClient = LazyClient('connect')
+s3Client = LazyClient('s3')
+# botocore's own retries are off for Bedrock and Comprehend: their guards (below) retry within the time budget.
+# Their timeouts are the stages' own limits, so an abandoned call does not hold a stage worker for
+# botocore's default 60 seconds; shorter budgets get copies with tighter timeouts (BudgetedClients).
+language_stage_timeout = float(os.environ.get('LANGUAGE_STAGE_TIMEOUT', '2'))
+bedrock_stage_timeout = float(os.environ.get('BEDROCK_STAGE_TIMEOUT', '7'))
+bedrock = LazyClient('bedrock-runtime', config={'retries': {'total_max_attempts': 1},
+                                                'connect_timeout': bedrock_stage_timeout,
+                                                'read_timeout': bedrock_stage_timeout})
+comprehend = LazyClient('comprehend', config={'retries': {'total_max_attempts': 1},
+                                              'connect_timeout': language_stage_timeout,
+                                              'read_timeout': language_stage_timeout})
+
+# Stream the Bedrock response and parse it as it arrives. Once the routing fields are known,
+# the remaining fields get at most BEDROCK_STREAM_FILL_TIMEOUT seconds before a partial analysis is returned.
+bedrock_streaming = os.environ.get('BEDROCK_STREAMING', 'false') == 'true'
+bedrock_fill_timeout = float(os.environ.get('BEDROCK_STREAM_FILL_TIMEOUT', '1'))
+# Upper bound on generated tokens; the compact analysis of a typical email is well under 100
+bedrock_max_tokens = int(os.environ.get('BEDROCK_MAX_TOKENS', '300'))
+# Fields the contact flow routes on; an analysis without them counts as failed
+ROUTING_FIELDS = ('user_intent', 'pii_detected')
+# PII fields of the response for Amazon Connect
+PII_RESPONSE_FIELDS = ('phone_number', 'email_address', 'name', 'address', 'account_number')
+
+# Run independent stages (language detection, Bedrock analysis) in parallel when set to 'true'
+concurrent_stages = os.environ.get('CONCURRENT_STAGES', 'true') == 'true'
+# Per-stage time limits in seconds (LANGUAGE_STAGE_TIMEOUT, BEDROCK_STAGE_TIMEOUT, read with the clients
+# above); the contact flow allows the whole invocation 8 seconds
+# Language code returned when language detection fails or times out
+default_language = os.environ.get('DEFAULT_LANGUAGE', 'en')
+
+# The contact flow waits FLOW_TIME_BUDGET seconds for the Lambda, much less than the Lambda timeout.
+# Stage time limits are cut to what is left of it, keeping DEADLINE_MARGIN seconds to return the response.
+# A flow that invokes the Lambda asynchronously passes its own, longer, limit as the flow_time_budget
+# invocation attribute (see invocation_budget).
+flow_time_budget = float(os.environ.get('FLOW_TIME_BUDGET', '8'))
+# An asynchronous flow routes on contact attributes the Lambda sets itself (see set_flow_attributes):
+# contact attribute name -> response field
+FLOW_ATTRIBUTES = {'pii': 'pii_detected', 'intent': 'user_intent', 'phone_number': 'phone_number',
+                   'account_number': 'account_number', 'language': 'language'}
+deadline_margin = float(os.environ.get('DEADLINE_MARGIN', '0.5'))
+# With less time left, Comprehend is skipped (the local language result or the default is used)
+# and Bedrock is not called at all
+min_comprehend_budget = float(os.environ.get('MIN_COMPREHEND_BUDGET', '2'))
+min_bedrock_budget = float(os.environ.get('MIN_BEDROCK_BUDGET', '1'))
+# When Bedrock is skipped, times out or fails, answer with this intent instead of an error
+# so the contact is routed to the Unknown queue
+degraded_fallback = os.environ.get('DEGRADED_FALLBACK', 'true') == 'true'
+fallback_intent = os.environ.get('FALLBACK_INTENT', 'Unknown')
+# Client copies with timeouts that fit a short remaining budget, reused across warm invocations
+budgeted_clients = BudgetedClients()
+
+# Throttled, failed and timed-out Bedrock and Comprehend calls are retried with jittered exponential
+# backoff, as long as the backoff and another attempt fit in the remaining budget
+retry_policy = RetryPolicy(
+    max_attempts=int(os.environ.get('RETRY_MAX_ATTEMPTS', '3')),
+    base_delay=float(os.environ.get('RETRY_BASE_DELAY', '0.1')),
+    max_delay=float(os.environ.get('RETRY_MAX_DELAY', '1'))
+)
+# A circuit breaker per service fails calls fast, to the local fallback, while its error rate is high.
+# Each execution environment has its own breakers, kept across warm invocations.
+enable_circuit_breaker = os.environ.get('CIRCUIT_BREAKER', 'true') == 'true'
+
+def new_circuit_breaker():
+    if not enable_circuit_breaker:
+        return None
+    return CircuitBreaker(
+        error_rate=float(os.environ.get('CIRCUIT_ERROR_RATE', '0.5')),
+        min_calls=int(os.environ.get('CIRCUIT_MIN_CALLS', '5')),
+        window=int(os.environ.get('CIRCUIT_WINDOW', '20')),
+        open_seconds=float(os.environ.get('CIRCUIT_OPEN_SECONDS', '30'))
+    )
+
+# Admission control keeps Bedrock calls under the model's requests and tokens per minute quotas.
+# With ADMISSION_TABLE the token buckets are shared by all Lambda instances through DynamoDB;
+# otherwise each execution environment keeps its own (divide the quotas by the expected concurrency).
+bedrock_rpm = int(os.environ.get('BEDROCK_RPM', '0'))
+bedrock_tpm = int(os.environ.get('BEDROCK_TPM', '0'))
+admission = None
+if bedrock_rpm or bedrock_tpm:
+    admission_limits = {name: limit for name, limit in (('requests', bedrock_rpm), ('tokens', bedrock_tpm)) if limit}
+    admission_burst = float(os.environ.get('ADMISSION_BURST_SECONDS', '10'))
+    if os.environ.get('ADMISSION_TABLE'):
+        admission_buckets = DynamoDBTokenBuckets(LazyClient('dynamodb'), os.environ['ADMISSION_TABLE'], model_id,
+                                                 admission_limits, admission_burst)
+    else:
+        admission_buckets = LocalTokenBuckets(admission_limits, admission_burst)
+    admission = AdmissionController(admission_buckets, max_wait=float(os.environ.get('ADMISSION_MAX_WAIT', '0.5')))
+
+bedrock_guard = Guard('bedrock', retry_policy, new_circuit_breaker(), admission,
+                      min_attempt=min_bedrock_budget, put_metric=metrics.put_metric)
+comprehend_guard = Guard('comprehend', retry_policy, new_circuit_breaker(),
+                         min_attempt=min_comprehend_budget, put_metric=metrics.put_metric)
 
+# Language detection backend: 'local' (n-gram profiles bundled with this code), 'comprehend',
+# 'auto' (local, falling back to Comprehend when the local confidence is below the threshold),
+# or 'bedrock' (the Bedrock analysis also returns the language, so no separate call is made;
+# the local profiles are used for emails that are not sent to Bedrock)
+language_detector = os.environ.get('LANGUAGE_DETECTOR', 'auto')
+language_confidence_threshold = float(os.environ.get('LANGUAGE_CONFIDENCE_THRESHOLD', '0.75'))
+language_identifier = LanguageIdentifier.load() if language_detector != 'comprehend' else None
+
+# Language codes accepted from the model, e.g. 'en' or 'zh-TW'
+LANGUAGE_CODE = re.compile(r'[a-z]{2,3}(-[A-Za-z]{2,4})?$')
+
+# Hard cap on the number of characters of normalized email text sent for analysis
+max_body_chars = int(os.environ.get('MAX_BODY_CHARS', '20000'))
+# The email file is streamed from its presigned URL over pooled connections that warm invocations
+# reuse; only the message field is decoded, and downloads over the size or time limit are abandoned
+max_email_bytes = int(os.environ.get('MAX_EMAIL_BYTES', str(10 * 1024 * 1024)))
+download_timeout = float(os.environ.get('DOWNLOAD_TIMEOUT', '3'))
+download_pool = make_pool(connect_timeout=float(os.environ.get('DOWNLOAD_CONNECT_TIMEOUT', '1')),
+                          read_timeout=float(os.environ.get('DOWNLOAD_READ_TIMEOUT', '2')))
+# Drop quoted replies, forwarded history, signatures and disclaimers before analysis,
+# then keep at most the first/last number of tokens of what remains
+enable_thread_trim = os.environ.get('THREAD_TRIM', 'true') == 'true'
+trim_head_tokens = int(os.environ.get('TRIM_HEAD_TOKENS', '1500'))
+trim_tail_tokens = int(os.environ.get('TRIM_TAIL_TOKENS', '500'))
+
+# Shared executor, created once per execution environment and reused across warm invocations
+stage_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('STAGE_MAX_WORKERS', '4')),
+                                    thread_name_prefix='stage')
+
+# Long-input mode: emails over LONG_INPUT_THRESHOLD_TOKENS are split into chunks of at most
+# CHUNK_TOKENS that are analyzed CHUNK_PARALLELISM at a time and merged into one analysis.
+# The trim budget grows to MAX_CHUNKS chunks so more of a long email reaches the model.
+long_input_mode = os.environ.get('LONG_INPUT_MODE', 'false') == 'true'
+long_input_threshold_tokens = int(os.environ.get('LONG_INPUT_THRESHOLD_TOKENS', '2000'))
+chunk_tokens = int(os.environ.get('CHUNK_TOKENS', '1000'))
+max_chunks = int(os.environ.get('MAX_CHUNKS', '5'))
+# Separate from stage_executor: the chunk calls are made from within the Bedrock stage
+chunk_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('CHUNK_PARALLELISM', '4')),
+                                    thread_name_prefix='chunk')
+
+# A unit of work for run_stages. A fallback of None means errors and timeouts are raised.
+Stage = namedtuple('Stage', ['fn', 'args', 'timeout', 'fallback'])
+
+# Cache of analysis results keyed on the cleaned body, model ID and instruction.
+# The LRU tier persists across warm invocations; ANALYSIS_CACHE_TABLE adds a shared DynamoDB tier.
+enable_analysis_cache = os.environ.get('ANALYSIS_CACHE', 'true') == 'true'
+analysis_cache_ttl = int(os.environ.get('ANALYSIS_CACHE_TTL', '86400'))
+analysis_cache_table = os.environ.get('ANALYSIS_CACHE_TABLE')
+# The shared table only holds the routing fields; the PII of a shared hit is found again (see with_pii_fields).
+SHARED_FIELDS = ('user_intent', 'intent1', 'pii_detected', 'language')
+analysis_cache = AnalysisCache(
+    LRUTier(max_entries=int(os.environ.get('ANALYSIS_CACHE_SIZE', '256')), ttl_seconds=analysis_cache_ttl),
+    DynamoDBBackend(LazyClient('dynamodb'), analysis_cache_table, analysis_cache_ttl) if analysis_cache_table else None,
+    shared_fields=SHARED_FIELDS
+)
+
+# Write-behind log of analysis results (intent, PII flag, language, stage timings, model; no PII values)
+# for analytics. Results are held in memory and written in the background as gzipped JSON-lines objects
+# under <RESULT_LOG_PREFIX>/dt=<date>/ in connectBucket, RESULT_LOG_BATCH_SIZE results or RESULT_LOG_MAX_AGE
+# seconds at a time. RESULT_LOG_DIR writes them below a local directory instead.
+# Writes never delay the response by default. Lambda only sends a shutdown signal to functions with an
+# extension, so records still held when an environment without one is removed are lost; RESULT_LOG_FLUSH_WAIT
+# has each invocation wait up to that many seconds for its record to be written instead, one object per contact.
+result_log = None
+result_log_flush_wait = float(os.environ.get('RESULT_LOG_FLUSH_WAIT', '0'))
+if os.environ.get('RESULT_LOG', 'false') == 'true':
+    if os.environ.get('RESULT_LOG_DIR'):
+        result_store = LocalStore(os.environ['RESULT_LOG_DIR'])
+    else:
+        result_store = S3Store(s3Client, os.environ.get('connectBucket'))
+    result_log = WriteBehindBuffer(
+        BatchWriter(result_store, os.environ.get('RESULT_LOG_PREFIX', 'results'), compress=True,
+                    partition=date_partition),
+        batch_size=int(os.environ.get('RESULT_LOG_BATCH_SIZE', '100')),
+        max_age=float(os.environ.get('RESULT_LOG_MAX_AGE', '300')),
+        max_records=int(os.environ.get('RESULT_LOG_MAX_RECORDS', '5000'))
+    )
+
+def flush_result_log(signum, frame):
+    """Write the held results before the execution environment shuts down"""
+    try:
+        result_log.flush()
+    except Exception as e:
+        log.error("Could not write the result log", error=str(e), records=len(result_log))
+    sys.exit(0)
+
+# Lambda sends SIGTERM before shutting down an execution environment that has an extension registered
+if result_log is not None and os.environ.get('AWS_LAMBDA_FUNCTION_NAME'):
+    signal.signal(signal.SIGTERM, flush_result_log)
+
+# Phone numbers, email addresses and account numbers found with local patterns instead of by the model.
+# The model is then only asked for the intent and the LOCAL_PII_MODEL_FIELDS patterns cannot find
+# (short keys: name, address, other); leave it empty to keep PII out of the prompt altogether.
+# PII_ACCOUNT_FORMATS selects the built-in account number formats (card, iban, labelled) and
+# PII_ACCOUNT_FORMATS_FILE points to a JSON file (bundled with the Lambda code) that adds formats.
+pii_extractor = None
+local_pii_model_fields = [name.strip() for name in os.environ.get('LOCAL_PII_MODEL_FIELDS', 'name,address').split(',')
+                          if name.strip()]
+if os.environ.get('LOCAL_PII', 'false') == 'true':
+    pii_options = {'account_formats': [name.strip() for name in
+                                       os.environ.get('PII_ACCOUNT_FORMATS', ','.join(ACCOUNT_FORMATS)).split(',')
+                                       if name.strip()]}
+    if os.environ.get('PII_ACCOUNT_FORMATS_FILE'):
+        pii_extractor = PiiExtractor.from_file(os.environ['PII_ACCOUNT_FORMATS_FILE'], **pii_options)
+    else:
+        pii_extractor = PiiExtractor(**pii_options)
+
+# Keyword pre-classifier that answers obvious emails without calling Bedrock.
+# INTENT_RULES_FILE points to a JSON file (bundled with the Lambda code) that replaces the default rules.
+intent_classifier = None
+if os.environ.get('FAST_PATH_CLASSIFIER', 'true') == 'true':
+    classifier_options = {
+        'threshold': float(os.environ.get('FAST_PATH_THRESHOLD', '0.8')),
+        'min_score': float(os.environ.get('FAST_PATH_MIN_SCORE', '2')),
+        # Emails that look like they contain PII go to Bedrock, unless the extractor finds all of it
+        'skip_pii': pii_extractor is None or bool(local_pii_model_fields)
+    }
+    if os.environ.get('INTENT_RULES_FILE'):
+        intent_classifier = IntentRuleClassifier.from_file(os.environ['INTENT_RULES_FILE'], **classifier_options)
+    else:
+        intent_classifier = IntentRuleClassifier(**classifier_options)
+
+# Nearest-neighbour index of labelled, already-routed emails (see intent_index.py), asked when the keyword
+# rules do not settle an email. INTENT_INDEX_DIR is the index directory, relative to the Lambda code.
+# It needs numpy in the layer (ENABLE_INTENT_INDEX in .env); without numpy the index is left out.
+intent_index = None
+if os.environ.get('INTENT_INDEX_DIR'):
+    try:
+        from intent_index import IntentIndex
+        intent_index = IntentIndex.load(
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), os.environ['INTENT_INDEX_DIR']),
+            k=int(os.environ.get('INTENT_INDEX_K', '7')),
+            margin=float(os.environ.get('INTENT_INDEX_MARGIN', '0.5')),
+            min_similarity=float(os.environ.get('INTENT_INDEX_MIN_SIMILARITY', '0.3')),
+            skip_pii=pii_extractor is None or bool(local_pii_model_fields)
+        )
+    except ImportError as e:
+        log.warning("Intent index disabled, numpy is not available", error=str(e))
+
+# Reuse the analysis of a recent near-duplicate (a resent or lightly edited email) from the same sender or
+# thread. Emails are compared by SimHash Hamming distance and MinHash Jaccard similarity of their word
+# shingles, and must match the same intent rules. Fingerprints are kept in memory for NEAR_DUPLICATE_TTL
+# seconds; with ANALYSIS_CACHE_TABLE they are also shared by all Lambda instances. Only the routing fields
+# are kept: a follow-up may carry other phone or account numbers, so its PII is found again (see with_pii_fields).
+enable_near_duplicate = os.environ.get('NEAR_DUPLICATE', 'false') == 'true'
+key_term_rules = intent_classifier or IntentRuleClassifier()
+fingerprinter = Fingerprinter(min_shingles=int(os.environ.get('NEAR_DUPLICATE_MIN_SHINGLES', '8')),
+                              key_terms=lambda text: key_term_rules.score(text).keys())
+near_duplicate_ttl = int(os.environ.get('NEAR_DUPLICATE_TTL', '3600'))
+near_duplicates = NearDuplicateIndex(
+    max_hamming=int(os.environ.get('NEAR_DUPLICATE_MAX_HAMMING', '12')),
+    min_jaccard=float(os.environ.get('NEAR_DUPLICATE_MIN_JACCARD', '0.85')),
+    max_scopes=int(os.environ.get('NEAR_DUPLICATE_MAX_SCOPES', '1000')),
+    per_scope=int(os.environ.get('NEAR_DUPLICATE_PER_SCOPE', '5')),
+    ttl_seconds=near_duplicate_ttl,
+    shared=DynamoDBBackend(LazyClient('dynamodb'), analysis_cache_table, near_duplicate_ttl)
+    if analysis_cache_table else None,
+    shared_fields=SHARED_FIELDS
+)
+
+# Values of the example analysis in the instruction
+EXAMPLE_INFO = {'phone': '555 0100', 'email': 'sam@example.com', 'name': 'Sam Lee', 'address': '1 Main St',
+                'account': '12345678', 'other': ['AB123456']}
+
+def build_instruction(with_language=False, pii_fields=None):
+    """
+    Build the instruction for Bedrock. Output tokens dominate the model latency, so the model is
+    asked for short keys and to leave out empty fields; expand_analysis maps them back.
+    Args:
+        with_language (bool): Also ask for the language of the email ("lang")
+        pii_fields (list): Short keys of the only PII the model is asked for, when the rest is
+            extracted locally (see LOCAL_PII); None asks for all PII and the "pii" flag
+    """
+    keys = [
+        '"intent": the primary reason for contact, used for routing.',
+        '"intents": all reasons the person is reaching out. Leave out if there is only the primary one.'
+    ]
+    example = {"intent": "Car loan request"}
+    if pii_fields is None:
+        keys.insert(1, '"pii": true if any Personally Identifiable Information is present, otherwise false.')
+        keys.append('"info": only if "pii" is true, the PII found, with the keys "phone", "email", "name", '
+                    '"address", "account" and "other" (a list of any other PII). Leave out keys that were not found.')
+        example["pii"] = True
+    elif pii_fields:
+        unknown = set(pii_fields) - set(INFO_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown PII fields: {', '.join(sorted(unknown))}")
+        names = ', '.join(f'"{name}"' for name in pii_fields)
+        keys.append(f'"info": the PII found, with the keys {names}. Leave out keys that were not found, '
+                    'and "info" if none were.')
+    if with_language:
+        keys.insert(2 if pii_fields is None else 1,
+                    '"lang": the ISO 639-1 code of the language the email is written in, e.g. "en".')
+        example["lang"] = "en"
+    if pii_fields is None:
+        example["info"] = {name: EXAMPLE_INFO[name] for name in ('phone', 'name')}
+    elif pii_fields:
+        example["info"] = {name: EXAMPLE_INFO[name] for name in pii_fields[:2]}
+    return ("\nAnalyze the following email message and reply with a JSON object with these keys:\n"
+            + "\n".join(keys)
+            + "\n\nExample: " + json.dumps(example, separators=(',', ':'))
+            + "\n\nReply with the JSON object only, no additional text or explanations.\n")
+
+# Short output keys mapped to the analysis fields used by the rest of the code
+OUTPUT_FIELDS = {'intent': 'user_intent', 'pii': 'pii_detected', 'lang': 'language', 'intents': 'intents',
+                 'info': 'extracted_info'}
+INFO_FIELDS = {'phone': 'phone_number', 'email': 'email_address', 'name': 'name', 'address': 'address',
+               'account': 'account_number', 'other': 'other_pii'}
+
+# Define the instruction for Bedrock
+instruction = build_instruction(with_language=language_detector == 'bedrock',
+                                pii_fields=local_pii_model_fields if pii_extractor else None)
+
+@lru_cache(maxsize=8)
+def request_template(instruction):
+    """
+    Serialize the Bedrock request once per instruction
+    Returns:
+        tuple: JSON text before and after the email content
+    """
+    marker = "\ue000email\ue000"
+    body = json.dumps({
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": bedrock_max_tokens,
+        "system": instruction,
+        "messages": [
+            {
+                "role": "user",
+                "content": marker
+            }
+        ],
+        "temperature": 0
+    })
+    prefix, suffix = body.split(json.dumps(marker))
+    return prefix, suffix
+
+# Built at import so invocations only encode the email content
+request_template(instruction)
+
+@metrics.handler
 def lambda_handler(event, context):
     # Define trigger event
     myevent = event["Details"]["ContactData"]
+    log.start_invocation(request_id=getattr(context, 'aws_request_id', None), contact_id=myevent.get("ContactId"))
+    metrics.set_property('contact_id', myevent.get("ContactId"))
+    budget = invocation_budget(event)
+    deadline = Deadline.from_context(context, budget, deadline_margin)
+    # Results of earlier invocations are written while this one works
+    if result_log is not None:
+        result_log.flush_due()
+        metrics.put_metric('result_log_held', len(result_log))
     # Define required values: 
     instName = os.environ['instName']
     emailBucket = os.environ['connectBucket']
     
     # Extract email content from the Amazon Connect event
-    email_content = extract_email_content(myevent)
-    # Define the instruction for Bedrock
-    instruction = """
-    Analyze the following email message and provide the following information in a JSON format:
-    1. Intents: Detect all intentions of why the person is reaching out.
-    2. PII: Detect if any Personally Identifiable Information is present, and if so, extract:
-       - Phone number
-       - Email address
-       - Name
-       - Address
-       - Account number
-       - Any other PII found
-    3. User intent: Determine the primary reason for contact to assist with routing.
-
-    Output format:
-    {
-        "intents": ["intent1", "intent2", ...],
-        "pii_detected": true|false,
-        "extracted_info": {
-            "phone_number": "...",
-            "email_address": "...",
-            "name": "...",
-            "address": "...",
-            "account_number": "...",
-            "other_pii": [...]
-        },
-        "user_intent": "primary_intent_for_routing"
-    }
+    with metrics.stage('extract'):
+        email_content = extract_email_content(myevent, deadline)
+    metrics.put_metric('body_chars', len(email_content))
+    # Reduce the email to the newly written message. PII is looked for in the whole body, as the
+    # sender's phone or account number is often only in the signature.
+    full_content = email_content
+    with metrics.stage('trim'):
+        email_content, trim_stats = trim_body(email_content)
+    metrics.put_metric('trimmed_chars', len(email_content))
+    # Identical emails produce identical analyses, so a cache hit skips Comprehend and Bedrock
+    cache_key = None
+    if enable_analysis_cache:
+        with metrics.stage('cache_lookup'):
+            cache_key = make_cache_key(email_content, model_id, instruction)
+            cached_response = analysis_cache.get(cache_key)
+        metrics.put_metric('cache_hit', 1 if cached_response is not None else 0)
+        log.debug("Analysis cache lookup", hit=cached_response is not None, stats=dict(analysis_cache.stats))
+        if cached_response is not None:
+            cached_response = with_pii_fields(cached_response, full_content)
+            record_result(myevent, cached_response, 'cache')
+            set_flow_attributes(event, cached_response)
+            return dict(cached_response)
+
+    # A follow-up that repeats an email of the same sender or thread gets that email's analysis
+    fingerprint = None
+    if enable_near_duplicate:
+        scopes = scope_keys(myevent)
+        with metrics.stage('near_duplicate'):
+            fingerprint = fingerprinter.fingerprint(email_content)
+            reused_response = near_duplicates.find(scopes, fingerprint) if fingerprint and scopes else None
+        metrics.put_metric('near_duplicate_hit', 1 if reused_response is not None else 0)
+        log.debug("Near-duplicate lookup", hit=reused_response is not None, stats=dict(near_duplicates.stats))
+        if reused_response is not None:
+            reused_response = with_pii_fields(reused_response, full_content)
+            record_result(myevent, reused_response, 'near_duplicate')
+            set_flow_attributes(event, reused_response)
+            return reused_response
+
+    # Structured PII is found locally, so the model is only asked for the intent (and names and addresses)
+    found_pii = None
+    if pii_extractor is not None:
+        with metrics.stage('pii'):
+            found_pii = pii_extractor.extract(full_content)
+        metrics.put_metric('pii_found', sum(len(values) for values in found_pii.values()))
+
+    # Obvious emails are routed from keyword rules; everything else falls through to Bedrock
+    fast_path_source = 'fast_path'
+    with metrics.stage('fast_path'):
+        fast_path_result = intent_classifier.classify(email_content) if intent_classifier else None
+    if intent_classifier:
+        metrics.put_metric('fast_path_hit', 1 if fast_path_result is not None else 0)
+        log.debug("Intent pre-classifier", matched=fast_path_result is not None, stats=dict(intent_classifier.stats))
+    # Then the labelled examples most like this email, if their vote is clear
+    if fast_path_result is None and intent_index is not None:
+        with metrics.stage('intent_index'):
+            fast_path_result = intent_index.classify(email_content)
+        fast_path_source = 'intent_index'
+        metrics.put_metric('intent_index_hit', 1 if fast_path_result is not None else 0)
+        log.debug("Intent index", matched=fast_path_result is not None, stats=dict(intent_index.stats))
+
+    # Detect the language and call Bedrock to analyze the email content. Both only
+    # depend on the email content, so they run side by side when concurrency is enabled.
+    # Their time limits are cut to the remaining budget.
+    stages = {}
+    use_bedrock = fast_path_result is None and deadline.allows(min_bedrock_budget)
+    # In single-call mode (LANGUAGE_DETECTOR=bedrock) the analysis returns the language as well
+    if not (use_bedrock and language_detector == 'bedrock'):
+        stages['language'] = Stage(detect_language, (email_content, deadline),
+                                   deadline.timeout(language_stage_timeout), default_language)
+    if use_bedrock:
+        # Time an asynchronous flow waits beyond the synchronous budget goes to the analysis
+        bedrock_limit = bedrock_stage_timeout + max(0.0, budget - flow_time_budget)
+        bedrock_timeout = deadline.timeout(bedrock_limit)
+        bedrock_client = budgeted_clients.get(bedrock, bedrock_timeout, bedrock_limit)
+        analyze = call_bedrock
+        if long_input_mode and estimate_tokens(email_content) > long_input_threshold_tokens:
+            analyze = call_bedrock_chunked
+        stages['bedrock'] = Stage(analyze, (bedrock_client, model_id, instruction, email_content, bedrock_timeout),
+                                  bedrock_timeout, {"success": False, "data": "Bedrock analysis timed out"})
+    stage_results = run_stages(stages, deadline)
+    language_code = stage_results.get('language')
+    source = 'bedrock'
+    if fast_path_result is not None:
+        source = fast_path_source
+        bedrock_result = {"success": True, "data": fast_path_result}
+    elif 'bedrock' in stages:
+        bedrock_result = stage_results['bedrock']
+        if not bedrock_result['success'] and 'bedrock_timeout' not in deadline.degradations:
+            deadline.degrade(bedrock_result.get('degradation', 'bedrock_error'))
+        elif bedrock_result['success'] and bedrock_result.get('degradation'):
+            # Some chunks of a long email were not analyzed, or the stream was cut short
+            deadline.degrade(bedrock_result['degradation'])
+    else:
+        deadline.degrade('bedrock_skipped')
+        bedrock_result = {"success": False, "data": "Not enough time left for Bedrock analysis"}
+
+    if not bedrock_result['success'] and degraded_fallback:
+        log.warning("Bedrock analysis unavailable, using fallback", error=bedrock_result['data'])
+        source = 'fallback'
+        bedrock_result = {"success": True, "data": fallback_analysis(full_content)}
+
+    metrics.put_metric('degraded', 1 if deadline.degradations else 0)
+    if deadline.degradations:
+        metrics.set_property('degradations', deadline.degradations)
+        log.warning("Degraded response", degradations=deadline.degradations, remaining=round(deadline.remaining(), 3))
 
-    Provide only the JSON output, no additional text or explanations.
-    """
-    language_code = detect_language(email_content)
-    # Call Bedrock to analyze the email content
-    bedrock_result = call_bedrock(bedrock, model_id, instruction, email_content)
-    
     if bedrock_result['success']:
         result_data = bedrock_result['data']
+        if found_pii is not None:
+            result_data = merge_local_pii(result_data, found_pii)
+        if language_code is None:
+            # Single-call mode; the local profiles stand in if the model left the language out
+            language_code = valid_language(result_data.get('language')) or detect_language(email_content, deadline)
         
         # Prepare the response for Amazon Connect
         connect_response = {
@@ -82,19 +532,158 @@ def lambda_handler(event, context):
         # Add other_pii as a comma-separated string if it exists
         if result_data['extracted_info'].get('other_pii'):
             connect_response['other_pii'] = ','.join(result_data['extracted_info']['other_pii'])
-        
+        # Comma-separated names of the stages that were skipped, cut short or replaced by a fallback
+        if deadline.degradations:
+            connect_response['degraded'] = ','.join(deadline.degradations)
+
+        # Only complete analyses are cached so degraded results and transient failures are retried next time
+        if cache_key is not None and not deadline.degradations:
+            analysis_cache.put(cache_key, dict(connect_response))
+        if fingerprint is not None and source == 'bedrock' and not deadline.degradations:
+            near_duplicates.add(scope_keys(myevent, own_thread=True), fingerprint,
+                                only_fields(connect_response, SHARED_FIELDS))
+
+        record_result(myevent, connect_response, source)
+        set_flow_attributes(event, connect_response)
         return connect_response
     else:
         # In case of an error, return an error response
+        log.error("Email analysis failed", error=bedrock_result['data'])
+        record_result(myevent, {'degraded': ','.join(deadline.degradations)}, 'error')
         return {
             'error': 'An error occurred while processing the email'
         }
         
-def extract_email_content(myevent):
+def record_result(myevent, response, source):
+    """
+    Add the outcome of the invocation to the result log; the PII values themselves are left out
+    Args:
+        response (dict): The response for Amazon Connect
+        source (str): What produced it: 'cache', 'near_duplicate', 'fast_path', 'intent_index',
+            'bedrock', 'fallback' or 'error'
+    """
+    if result_log is None:
+        return
+    result_log.add({
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'contact_id': myevent.get('ContactId'),
+        'instance_arn': myevent.get('InstanceARN'),
+        'source': source,
+        'model_id': model_id,
+        'user_intent': response.get('user_intent'),
+        'intent1': response.get('intent1'),
+        'pii_detected': response.get('pii_detected') == 'true',
+        'language': response.get('language'),
+        'degraded': [name for name in response.get('degraded', '').split(',') if name],
+        'stages_ms': {name[:-3]: value for name, value in metrics.values().items() if name.endswith('_ms')},
+    })
+    if result_log_flush_wait <= 0:
+        # A full batch starts writing now, in the background
+        result_log.flush_due()
+    elif not result_log.flush_and_wait(result_log_flush_wait):
+        log.warning("Result log write not finished before the response", records=len(result_log),
+                    errors=result_log.stats['errors'])
+
+def set_flow_attributes(event, response):
+    """
+    Set the routing fields as attributes of the contact when the flow invoked the Lambda
+    asynchronously, so its routing steps read $.Attributes rather than the invocation result.
+    Failures are logged; the flow then routes the email as Unknown.
+    Args:
+        event (dict): The Amazon Connect event
+        response (dict): The response for Amazon Connect
+    """
+    if 'flow_time_budget' not in (event["Details"].get("Parameters") or {}):
+        return
+    myevent = event["Details"]["ContactData"]
+    attributes = {name: str(response[field]) for name, field in FLOW_ATTRIBUTES.items()
+                  if response.get(field) is not None}
+    try:
+        with metrics.stage('flow_attributes'):
+            connectClient.update_contact_attributes(
+                InitialContactId=myevent.get('InitialContactId') or myevent['ContactId'],
+                InstanceId=myevent['InstanceARN'].split('/')[-1],
+                Attributes=attributes
+            )
+    except Exception as e:
+        log.error("Could not set the contact attributes", error=str(e))
+
+def invocation_budget(event):
+    """
+    Seconds the contact flow waits for the response
+    Returns:
+        float: The flow_time_budget invocation attribute of an asynchronous flow, otherwise FLOW_TIME_BUDGET
+    """
+    parameters = event["Details"].get("Parameters") or {}
+    try:
+        return float(parameters['flow_time_budget'])
+    except (KeyError, TypeError, ValueError):
+        return flow_time_budget
+
+def run_stages(stages, deadline=None):
+    """
+    Run independent stages and join their results
+    Args:
+        stages (dict): Stage name mapped to a Stage tuple
+        deadline (Deadline): Records `<stage>_timeout` and `<stage>_error` when a fallback is used
+    Returns:
+        dict: Stage name mapped to the stage result, or its fallback on error or timeout
+    """
+    if not concurrent_stages:
+        # Sequential mode runs each stage inline, in order, without time limits
+        results = {}
+        for name, stage in stages.items():
+            try:
+                results[name] = stage.fn(*stage.args)
+            except Exception as e:
+                if stage.fallback is None:
+                    raise
+                log.warning("Stage failed, using fallback", stage=name, error=str(e))
+                metrics.put_metric(f"{name}_fallback", 1)
+                if deadline is not None:
+                    deadline.degrade(f"{name}_error")
+                results[name] = stage.fallback
+        return results
+
+    # Submit everything first so the wall time is the slowest stage rather than the sum
+    started = time.monotonic()
+    futures = {name: stage_executor.submit(stage.fn, *stage.args) for name, stage in stages.items()}
+
+    results = {}
+    for name, future in futures.items():
+        stage = stages[name]
+        remaining = None
+        if stage.timeout is not None:
+            remaining = max(0.0, started + stage.timeout - time.monotonic())
+        try:
+            results[name] = future.result(timeout=remaining)
+        except FutureTimeoutError:
+            # Drops the stage if it has not started yet. A stage that is already running
+            # cannot be interrupted; its result is discarded when it eventually finishes.
+            future.cancel()
+            if stage.fallback is None:
+                raise
+            log.warning("Stage timed out, using fallback", stage=name, timeout=stage.timeout)
+            metrics.put_metric(f"{name}_fallback", 1)
+            if deadline is not None:
+                deadline.degrade(f"{name}_timeout")
+            results[name] = stage.fallback
+        except Exception as e:
+            if stage.fallback is None:
+                raise
+            log.warning("Stage failed, using fallback", stage=name, error=str(e))
+            metrics.put_metric(f"{name}_fallback", 1)
+            if deadline is not None:
+                deadline.degrade(f"{name}_error")
+            results[name] = stage.fallback
+
+    log.debug("Stages completed", stages=list(stages), seconds=round(time.monotonic() - started, 3))
+    return results
+
+def extract_email_content(myevent, deadline=None):
     try:
         # Log the incoming event for debugging
-        if enable_logging:
-            print(f"Incoming event: {json.dumps(myevent, indent=2)}")
+        log.debug("Incoming event", event=myevent)
 
         # Grab data from the event message
         instId = myevent["InstanceARN"].split('/')[1]
@@ -103,17 +692,10 @@ def extract_email_content(myevent):
 
         # First, try to get the email reference directly from the event
         if "References" in myevent:
-            if enable_logging:
-                print(f"References found in event: {json.dumps(myevent['References'], indent=2)}")
-            
             # Look for email reference in the event
             for ref_key, ref_value in myevent["References"].items():
-                if enable_logging:
-                    print(f"Checking reference: {ref_key} = {json.dumps(ref_value, indent=2)}")
-                
                 if isinstance(ref_value, dict) and ref_value.get("Type") == "EMAIL_MESSAGE":
-                    if enable_logging:
-                        print(f"Found EMAIL_MESSAGE reference: {json.dumps(ref_value, indent=2)}")
+                    log.debug("Found EMAIL_MESSAGE reference", reference_key=ref_key, reference=ref_value)
                     
                     # Try different possible value fields
                     file_id = (ref_value.get("Value") or 
@@ -122,70 +704,63 @@ def extract_email_content(myevent):
                              ref_key)  # Use the reference key itself as a last resort
                     
                     if file_id:
-                        if enable_logging:
-                            print(f"Using file_id: {file_id}")
+                        log.debug("Using file_id", file_id=file_id)
                         break
             else:
-                if enable_logging:
-                    print("No valid EMAIL_MESSAGE reference found in References")
+                log.debug("No valid EMAIL_MESSAGE reference found in References")
                 file_id = None
         else:
-            if enable_logging:
-                print("No References found in event")
+            log.debug("No References found in event")
             file_id = None
 
         # If we didn't find a file_id in References, try list_contact_references
         if not file_id:
-            if enable_logging:
-                print("Attempting to get references using list_contact_references")
+            log.debug("Attempting to get references using list_contact_references")
 
-            response = connectClient.list_contact_references(
-                InstanceId=instId,
-                ContactId=contactId,
-                ReferenceTypes=['EMAIL_MESSAGE']
-            )
+            with metrics.stage('list_contact_references'):
+                response = connectClient.list_contact_references(
+                    InstanceId=instId,
+                    ContactId=contactId,
+                    ReferenceTypes=['EMAIL_MESSAGE']
+                )
 
-            if enable_logging:
-                print(f"list_contact_references response: {json.dumps(response, indent=2)}")
+            log.debug("list_contact_references response", response=response)
 
             if response.get('ReferenceSummaryList'):
                 email_ref = response['ReferenceSummaryList'][0]
-                if enable_logging:
-                    print(f"Found reference summary: {json.dumps(email_ref, indent=2)}")
                 
                 # Try all possible fields for the file ID
                 file_id = (email_ref.get('Value') or 
                           email_ref.get('Reference') or 
                           email_ref.get('Name') or 
                           email_ref.get('Id'))
+                # ListContactReferences returns {"EmailMessage": {"Name": ..., "Arn": ".../file/<file id>"}}
+                if not file_id and email_ref.get('EmailMessage', {}).get('Arn'):
+                    file_id = email_ref['EmailMessage']['Arn'].split('/')[-1]
 
         if not file_id:
             # Try to get the message directly from the event
             if 'Attributes' in myevent and 'body' in myevent['Attributes']:
-                return clean_string(process_body(myevent['Attributes']['body']))
+                return process_body(myevent['Attributes']['body'])
             
-            if enable_logging:
-                print("Available event data:")
-                print(f"Event keys: {list(myevent.keys())}")
-                if 'References' in myevent:
-                    print(f"References keys: {list(myevent['References'].keys())}")
-                if 'Attributes' in myevent:
-                    print(f"Attributes keys: {list(myevent['Attributes'].keys())}")
+            log.debug("Available event data",
+                      event_keys=lambda: list(myevent.keys()),
+                      reference_keys=lambda: list(myevent.get('References', {}).keys()),
+                      attribute_keys=lambda: list(myevent.get('Attributes', {}).keys()))
             
             raise ValueError("Could not find file ID in email reference")
 
         # Get the attached file using the correct parameters
-        if enable_logging:
-            print(f"Getting attached file with ID: {file_id}")
+        log.debug("Getting attached file", file_id=file_id)
 
-        file_response = connectClient.get_attached_file(
-            InstanceId=instId,
-            FileId=file_id,
-            AssociatedResourceArn=contactArn
-        )
+        with metrics.stage('get_attached_file'):
+            file_response = connectClient.get_attached_file(
+                InstanceId=instId,
+                FileId=file_id,
+                AssociatedResourceArn=contactArn
+            )
 
-        if enable_logging:
-            print(f"get_attached_file response: {json.dumps(file_response, indent=2)}")
+        log.debug("get_attached_file response", response=file_response)
 
         if ('DownloadUrlMetadata' not in file_response or 
             'Url' not in file_response['DownloadUrlMetadata']):
@@ -193,33 +768,34 @@ def extract_email_content(myevent):
 
         download_url = file_response['DownloadUrlMetadata']['Url']
 
-        # Fetch and process the email content
-        with urllib.request.urlopen(download_url) as url:
-            email_json = json.load(url)
-            
-            if enable_logging:
-                print(f"Email JSON content keys: {list(email_json.keys())}")
-
-            # Try multiple possible field names for the content
-            content = (email_json.get('messageContent') or 
-                      email_json.get('content') or 
-                      email_json.get('body') or 
-                      email_json.get('text') or 
-                      email_json.get('message'))
-            
-            if not content:
-                if enable_logging:
-                    print(f"Available fields in email_json: {list(email_json.keys())}")
-                raise ValueError("No message content found in email file")
-
-            return clean_string(process_body(content))
+        # Fetch the email file and normalize its message content while it downloads
+        time_limit = deadline.timeout(download_timeout) if deadline is not None else download_timeout
+        with metrics.stage('download') as put_metric:
+            content, received = fetch_email_content(download_pool, download_url, new_normalizer, max_email_bytes,
+                                                    deadline=time.monotonic() + time_limit)
+            put_metric('download_bytes', received, BYTES)
+        return content
 
     except Exception as e:
-        if enable_logging:
-            print(f"Error in extract_email_content: {str(e)}")
-            print(f"Full event data: {json.dumps(myevent, indent=2)}")
+        # The event itself is in the debug trail ("Incoming event"), when logging is enabled
+        log.error("Error in extract_email_content", error=str(e))
         raise
 
+def get_message_content(email_json):
+    # Try multiple possible field names for the content
+    content = (email_json.get('messageContent') or 
+              email_json.get('content') or 
+              email_json.get('body') or 
+              email_json.get('text') or 
+              email_json.get('message'))
+    
+    if not content:
+        raise ValueError("No message content found in email file")
+    return content
+
+def new_normalizer():
+    return HtmlTextNormalizer(max_body_chars, keep_lines=enable_thread_trim)
+
 def process_body(bodyContent):
     try:
         if not bodyContent:
@@ -228,68 +804,315 @@ def process_body(bodyContent):
         if not isinstance(bodyContent, str):
             bodyContent = str(bodyContent)
 
-        # Remove any HTML tags
-        clean_content = re.sub(r'<[^>]+>', '', bodyContent)
-        # Remove any leading/trailing whitespace
-        clean_content = clean_content.strip()
-        
-        return clean_content
+        # Strip tags, comments and script/style blocks, decode entities and collapse
+        # whitespace in a single pass, capped at max_body_chars. Line breaks are kept
+        # when trimming is enabled so trim_body can find reply chains.
+        return normalize_html(bodyContent, max_body_chars, keep_lines=enable_thread_trim)
 
     except Exception as e:
-        if enable_logging:
-            print(f"Error in process_body: {str(e)}")
+        log.warning("Error in process_body", error=str(e))
         return bodyContent
 
-def detect_language(email_content):
+def trim_body(email_content):
+    """
+    Remove quoted history, forwarded blocks, signatures and disclaimers. Without the local
+    extractor (LOCAL_PII) the model finds the PII, so the signature block is kept for it.
+    Returns:
+        tuple: (trimmed single-line text, dict of characters removed per reason)
+    """
+    if not enable_thread_trim:
+        return email_content, {}
+
+    head_tokens = trim_head_tokens
+    if long_input_mode:
+        # Keep as much as the chunks can hold
+        head_tokens = max(trim_head_tokens, chunk_tokens * max_chunks - trim_tail_tokens)
+    trimmed, removed = trim_email(email_content, head_tokens, trim_tail_tokens,
+                                  keep_signature=pii_extractor is None)
+    log.debug("Trimmed email", chars_in=len(email_content), chars_out=len(trimmed), removed=removed)
+    return trimmed, removed
+
+@metrics.timed('language')
+def detect_language(email_content, deadline=None):
+    # Comprehend is optional; when time is short the local result, or the default, is used instead
+    use_comprehend = deadline is None or deadline.allows(min_comprehend_budget)
+    local_code = None
+    # Identify the language locally first; only uncertain texts pay for the Comprehend round trip
+    if language_identifier is not None:
+        language_code, confidence = language_identifier.detect(email_content)
+        local_code = language_code
+        if language_detector in ('local', 'bedrock') or confidence >= language_confidence_threshold:
+            return language_code or default_language
+        if not use_comprehend:
+            deadline.degrade('comprehend_skipped')
+            return language_code or default_language
+        log.debug("Local language detection uncertain, using Comprehend",
+                  language=language_code, confidence=round(confidence, 3))
+    elif not use_comprehend:
+        deadline.degrade('language_skipped')
+        return default_language
+
     # Detect the language of the text
-    comprehend = boto3.client('comprehend')
-    response = comprehend.detect_dominant_language(Text=email_content)
+    client = comprehend
+    if deadline is not None:
+        client = budgeted_clients.get(comprehend, deadline.timeout(language_stage_timeout), language_stage_timeout)
+    budget = Deadline(deadline.timeout(language_stage_timeout)) if deadline is not None else None
+    try:
+        response = comprehend_guard.call(lambda: client.detect_dominant_language(Text=email_content), budget)
+    except CircuitOpenError:
+        # Comprehend is failing; the uncertain local result beats waiting for another failure
+        if deadline is not None:
+            deadline.degrade('comprehend_circuit_open')
+        return local_code or default_language
     language_code = response['Languages'][0]['LanguageCode']
     return language_code
 
-def call_bedrock(bedrock, model_id, instruction, email_content):
-    request_body = json.dumps({
-        "anthropic_version": "bedrock-2023-05-31",
-        "max_tokens": 1000,
-        "system": instruction,
-        "messages": [
-            {
-                "role": "user",
-                "content": email_content
-            }
-        ],
-        "temperature": 0
-    })
+def valid_language(language_code):
+    """The language code if it looks like one (e.g. 'en', 'pt-BR'), otherwise None"""
+    if isinstance(language_code, str) and LANGUAGE_CODE.match(language_code.strip()):
+        return language_code.strip()
+    return None
+
+def call_bedrock(bedrock, model_id, instruction, email_content, timeout=None, guard=None):
+    """
+    Analyze the email with the model
+    Args:
+        guard (Guard): Retries, circuit breaker and admission control of the call; bedrock_guard by default
+    Returns:
+        dict: {"success", "data", "usage"}, with a "degradation" for results that are partial or were not tried
+    """
+    guard = guard or bedrock_guard
+    prefix, suffix = request_template(instruction)
+    request_body = prefix + json.dumps(email_content) + suffix
     
-    if enable_logging:
-        print(f"Request body: {request_body}")
+    log.debug("Bedrock request", model_id=model_id, request_bytes=len(request_body), body=request_body)
     
     try:
-        response = bedrock.invoke_model(
-            body=request_body,
-            modelId=model_id,
-            accept='application/json',
-            contentType='application/json'
-        )
-        
-        response_body = json.loads(response['body'].read())
+        if bedrock_streaming:
+            result, usage, partial = call_bedrock_streaming(bedrock, model_id, request_body,
+                                                            timeout if timeout is not None else bedrock_stage_timeout,
+                                                            guard)
+            log.debug("Parsed result", result=result, usage=usage, partial=partial)
+            if partial:
+                # Routed on, but not cached or reused: the fields after the decision may be missing
+                return {"success": True, "data": result, "usage": usage, "degradation": "bedrock_partial"}
+            return {"success": True, "data": result, "usage": usage}
+
+        def invoke():
+            response = bedrock.invoke_model(
+                body=request_body,
+                modelId=model_id,
+                accept='application/json',
+                contentType='application/json'
+            )
+            return response['body'].read()
+
+        with metrics.stage('bedrock') as put_metric:
+            put_metric('bedrock_request_bytes', len(request_body.encode('utf-8')), BYTES)
+            raw_response = guard.call(invoke, Deadline(timeout) if timeout is not None else None,
+                                      admission_cost(request_body))
+            put_metric('bedrock_response_bytes', len(raw_response), BYTES)
+            response_body = json.loads(raw_response)
+            usage = record_usage(put_metric, response_body.get('usage'))
         
-        if enable_logging:
-            print("Response body:", response_body)
+        log.debug("Bedrock response", response=response_body)
         
-        result = json.loads(clean_string(response_body["content"][0]["text"]))
+        result = complete_analysis(parse_model_json(response_body["content"][0]["text"]))
         
-        if enable_logging:
-            print("Parsed result:", result)
+        log.debug("Parsed result", result=result)
         
-        return {"success": True, "data": result}
+        return {"success": True, "data": result, "usage": usage}
         
+    except CircuitOpenError as e:
+        log.warning("Bedrock circuit open, not calling Bedrock", error=str(e))
+        return {"success": False, "data": str(e), "degradation": "bedrock_circuit_open"}
+    except AdmissionDenied as e:
+        log.warning("Bedrock quota reached, not calling Bedrock", error=str(e))
+        return {"success": False, "data": str(e), "degradation": "bedrock_admission_denied"}
     except Exception as e:
-        print(f"Error: {str(e)}")
+        log.error("Error calling Bedrock", error=str(e))
         return {"success": False, "data": str(e)}
 
-def clean_string(s):
-    # Remove excess whitespace while preserving single spaces between words
-    s = re.sub(r'\s+', ' ', s)
-    # Trim leading and trailing spaces
-    return s.strip()
\ No newline at end of file
+def call_bedrock_chunked(bedrock, model_id, instruction, email_content, timeout=None):
+    """
+    Analyze a long email in chunks, concurrently, and merge the analyses (see merge_analyses)
+    Returns:
+        dict: As call_bedrock; a partial merge carries the degradation "bedrock_chunks_failed"
+    """
+    chunks, dropped = split_chunks(email_content, chunk_tokens, max_chunks)
+    log.debug("Analyzing email in chunks", chunks=len(chunks), dropped_chars=dropped)
+    with metrics.stage('bedrock_chunked') as put_metric:
+        put_metric('bedrock_chunks', len(chunks))
+        result = analyze_chunks(
+            lambda chunk, remaining: call_bedrock(bedrock, model_id, instruction, chunk, remaining),
+            chunks, chunk_executor, timeout, min_bedrock_budget
+        )
+        put_metric('bedrock_chunks_failed', result['failed'])
+    return result
+
+def call_bedrock_streaming(bedrock, model_id, request_body, timeout, guard=None):
+    """
+    Invoke the model with a streamed response and parse the JSON as it arrives
+    Args:
+        timeout (float): Seconds the stage has; the stream is cut short just before
+        guard (Guard): As for call_bedrock
+    Returns:
+        tuple: The analysis, with fields not generated in time left at their defaults, the token usage,
+            and whether the stream was cut short after the routing fields
+    """
+    parser = IncrementalObjectParser()
+    with metrics.stage('bedrock') as put_metric:
+        put_metric('bedrock_request_bytes', len(request_body.encode('utf-8')), BYTES)
+        started = time.monotonic()
+        # Leave the stage a little time to return the partial analysis before its timeout
+        deadline = started + timeout - 0.25
+        # Retries cover the request; once the stream has started it is read as it comes
+        response = (guard or bedrock_guard).call(lambda: bedrock.invoke_model_with_response_stream(
+            body=request_body,
+            modelId=model_id,
+            accept='application/json',
+            contentType='application/json'
+        ), Deadline(timeout), admission_cost(request_body))
+        stream = response['body']
+        usage = {}
+        received = 0
+        first_token = True
+        decided_at = None
+        partial = False
+        try:
+            for event in stream:
+                chunk = event.get('chunk')
+                if not chunk:
+                    continue
+                received += len(chunk['bytes'])
+                message = json.loads(chunk['bytes'])
+                if message.get('type') == 'message_stop':
+                    break
+                if message.get('type') == 'message_start':
+                    usage.update(message['message'].get('usage') or {})
+                elif message.get('type') == 'message_delta':
+                    usage.update(message.get('usage') or {})
+                if message.get('type') != 'content_block_delta':
+                    continue
+                if first_token:
+                    first_token = False
+                    put_metric('bedrock_first_token_ms', round((time.monotonic() - started) * 1000, 3), MILLISECONDS)
+                parser.feed(message['delta'].get('text', ''))
+                if parser.complete:
+                    break
+
+                now = time.monotonic()
+                if decided_at is None and has_routing_fields(parser.fields):
+                    decided_at = now
+                    put_metric('bedrock_decision_ms', round((now - started) * 1000, 3), MILLISECONDS)
+                if decided_at is not None and (now - decided_at > bedrock_fill_timeout or now > deadline):
+                    partial = True
+                    break
+        finally:
+            stream.close()
+        put_metric('bedrock_response_bytes', received, BYTES)
+        put_metric('bedrock_partial', 1 if partial else 0)
+        # A stream read to the end reports the output tokens; a cut-short one only the input tokens
+        usage = record_usage(put_metric, usage)
+    return complete_analysis(parser.fields), usage, partial
+
+def admission_cost(request_body):
+    """Quota the call takes: one request, and its input tokens (about four characters each) plus the output limit"""
+    return {'requests': 1, 'tokens': len(request_body) // 4 + bedrock_max_tokens}
+
+def record_usage(put_metric, usage):
+    """Record the token counts reported by the model and return them"""
+    usage = {name: usage[name] for name in ('input_tokens', 'output_tokens') if usage and name in usage}
+    for name, value in usage.items():
+        put_metric(f"bedrock_{name}", value, COUNT)
+    return usage
+
+def fallback_analysis(email_content):
+    """
+    Cheap local stand-in for the Bedrock analysis when there is no time or Bedrock failed
+    Returns:
+        dict: Analysis that routes to the fallback intent; PII is flagged from a pattern match only,
+            or left to the local extractor when it runs
+    """
+    return {
+        "intents": [],
+        "pii_detected": pii_extractor is None and bool(PII_HINT.search(email_content)),
+        "extracted_info": {},
+        "user_intent": fallback_intent
+    }
+
+def expand_analysis(fields):
+    """Map the short output keys to the analysis field names; full names are kept as they are"""
+    analysis = {OUTPUT_FIELDS.get(name, name): value for name, value in fields.items()}
+    if isinstance(analysis.get('extracted_info'), dict):
+        analysis['extracted_info'] = {INFO_FIELDS.get(name, name): value
+                                      for name, value in analysis['extracted_info'].items()}
+    return analysis
+
+def routing_fields():
+    """ROUTING_FIELDS the model has to return; with local PII extraction pii_detected is not asked for"""
+    if pii_extractor is not None:
+        return tuple(name for name in ROUTING_FIELDS if name != 'pii_detected')
+    return ROUTING_FIELDS
+
+def has_routing_fields(fields):
+    required = routing_fields()
+    return all(name in fields or short in fields
+               for short, name in OUTPUT_FIELDS.items() if name in required)
+
+def complete_analysis(fields):
+    """Check that the routing fields are present, expand short keys and default the rest"""
+    analysis = expand_analysis(fields)
+    missing = [name for name in routing_fields() if name not in analysis]
+    if missing:
+        raise ValueError(f"Model output is missing {', '.join(missing)}")
+    # Only secondary intents are listed, so the primary intent stands in when there are none
+    return dict({'intents': [analysis['user_intent']], 'extracted_info': {}, 'pii_detected': False}, **analysis)
+
+def with_pii_fields(response, email_content):
+    """
+    Complete a response reused for this email. One that holds no PII (a shared table hit, or a
+    near-duplicate's analysis, which may have been written with other PII) gets its PII fields from the
+    local extractor (LOCAL_PII), or empty ones. pii_detected stays set if the earlier email had PII, since
+    names and addresses are only found by the model. The local extractor reads the untrimmed body, which
+    the cache key leaves out, so its fields are always those of this email.
+    Args:
+        response (dict): The response for Amazon Connect, possibly with SHARED_FIELDS only
+        email_content (str): The untrimmed email the response is reused for
+    Returns:
+        dict: The response with all of the PII fields
+    """
+    if pii_extractor is None and all(field in response for field in PII_RESPONSE_FIELDS):
+        return response
+    found = extracted_info(pii_extractor.extract(email_content)) if pii_extractor is not None else {}
+    response = dict(response)
+    for field in PII_RESPONSE_FIELDS:
+        if field in LOCAL_PII_FIELDS and pii_extractor is not None:
+            response[field] = found.get(field, '')
+        else:
+            response.setdefault(field, found.get(field, ''))
+    if found.get('other_pii'):
+        response.setdefault('other_pii', ','.join(found['other_pii']))
+    if any(found.values()):
+        response['pii_detected'] = 'true'
+    return response
+
+def merge_local_pii(analysis, found):
+    """
+    Add the PII found by the extractor to an analysis
+    Args:
+        analysis (dict): Analysis from Bedrock, the fast path or the fallback
+        found (dict): Result of PiiExtractor.extract
+    Returns:
+        dict: Copy of the analysis; extracted values replace the model's for the same field,
+            and pii_detected is set if either found PII
+    """
+    info = dict(analysis.get('extracted_info') or {})
+    local = extracted_info(found)
+    others = list(info.get('other_pii') or [])
+    others += [value for value in local.pop('other_pii', []) if value not in others]
+    info.update(local)
+    if others:
+        info['other_pii'] = others
+    pii_detected = bool(analysis.get('pii_detected')) or any(value for value in info.values())
+    return dict(analysis, extracted_info=info, pii_detected=pii_detected)
\ No newline at end of file
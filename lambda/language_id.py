@@ -0,0 +1,125 @@
+import argparse
+import json
+import math
+import os
+import re
+from collections import Counter
+from itertools import repeat
+from operator import mul
+
+# Precomputed profiles shipped alongside the Lambda code
+PROFILE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'language_profiles.json')
+
+MAX_NGRAM = 3
+# Only the start of the email is scored; a few hundred characters are enough to identify the language
+MAX_CHARS = 400
+NON_LETTERS = re.compile(r"[\W\d_]+")
+
+
+def extract_ngrams(text, max_chars=MAX_CHARS):
+    """
+    Character 1- to 3-grams within words, padded with spaces so word starts and
+    ends are captured (' th', 'he '). Works on the whole string at once rather
+    than word by word, dropping grams that span two words.
+    """
+    padded = ' ' + NON_LETTERS.sub(' ', text[:max_chars].lower()).strip() + ' '
+    length = len(padded)
+    if length < 3:
+        return []
+    grams = [char for char in padded if char != ' ']
+    grams += [padded[i:i + 2] for i in range(length - 1)]
+    grams += [gram for gram in [padded[i:i + 3] for i in range(length - 2)] if gram[1] != ' ']
+    return grams
+
+
+def build_profiles(corpus, profile_size=1500):
+    """
+    Build log-probability profiles from training text
+    Args:
+        corpus (dict): Language code mapped to training text
+        profile_size (int): Number of most frequent n-grams kept per language
+    Returns:
+        dict: Serializable profiles for LanguageIdentifier
+    """
+    languages = {}
+    for language, text in sorted(corpus.items()):
+        counts = Counter(extract_ngrams(text, max_chars=None))
+        total = sum(counts.values()) + len(counts)
+        languages[language] = {
+            # Add-one smoothing; n-grams outside the profile score as if unseen
+            "floor": round(math.log(1 / total), 3),
+            "ngrams": {gram: round(math.log((count + 1) / total), 3)
+                       for gram, count in counts.most_common(profile_size)}
+        }
+    return {"max_ngram": MAX_NGRAM, "languages": languages}
+
+
+class LanguageIdentifier:
+    """
+    Naive Bayes language identifier over character n-grams. Confidence is the
+    lower of two signals, so short, mixed or unsupported-language texts score
+    low and can be sent to Comprehend:
+    - coverage: share of the text's n-grams found in the winning profile
+    - margin: average per-n-gram log-likelihood lead over the runner-up,
+      scaled so that MARGIN_SCALE or more counts as certain
+    Texts with fewer than MIN_NGRAMS n-grams (a word or two) are scaled down further.
+    """
+
+    MARGIN_SCALE = 0.04
+    MIN_NGRAMS = 30
+
+    def __init__(self, profiles):
+        self.languages = {language: (profile["ngrams"], profile["floor"])
+                          for language, profile in profiles["languages"].items()}
+
+    @classmethod
+    def load(cls, path=PROFILE_PATH):
+        with open(path, encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def detect(self, text):
+        """
+        Returns:
+            tuple: (language code, confidence), or ('', 0.0) when the text has no letters
+        """
+        grams = extract_ngrams(text)
+        if not grams:
+            return '', 0.0
+
+        # Score each distinct n-gram once, weighted by how often it occurs
+        counts = Counter(grams)
+        unique = list(counts)
+        weights = list(counts.values())
+        scores = sorted(
+            ((sum(map(mul, weights, map(ngrams.get, unique, repeat(floor)))), language)
+             for language, (ngrams, floor) in self.languages.items()),
+            reverse=True
+        )
+        best_score, best_language = scores[0]
+        margin = (best_score - scores[1][0]) / len(grams) if len(scores) > 1 else 1.0
+        best_ngrams = self.languages[best_language][0]
+        coverage = sum(weight for gram, weight in zip(unique, weights) if gram in best_ngrams) / len(grams)
+        confidence = min(coverage, margin / self.MARGIN_SCALE, 1.0) * min(1.0, len(grams) / self.MIN_NGRAMS)
+        return best_language, confidence
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build language profiles from a directory of <language>.txt files")
+    parser.add_argument('--corpus-dir', required=True)
+    parser.add_argument('--output', default=PROFILE_PATH)
+    parser.add_argument('--profile-size', type=int, default=1500)
+    args = parser.parse_args()
+
+    corpus = {}
+    for name in sorted(os.listdir(args.corpus_dir)):
+        if name.endswith('.txt'):
+            with open(os.path.join(args.corpus_dir, name), encoding='utf-8') as f:
+                corpus[name[:-4]] = f.read()
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(build_profiles(corpus, args.profile_size), f, ensure_ascii=False, separators=(',', ':'), sort_keys=True)
+    print(f"Wrote profiles for {sorted(corpus)} to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+"""
+Near-duplicate detection, so a resent or lightly edited email from the same
+sender or thread reuses the analysis of the earlier one.
+
+Each trimmed email gets a fingerprint of its word shingles: a 64-bit SimHash,
+compared by Hamming distance, and a MinHash signature, which estimates the
+Jaccard similarity of the shingle sets. An earlier analysis is only reused
+when both are within their thresholds, the emails name the same key terms
+(e.g. the intent rules' phrases, so "car loan" edited to "home loan" is never
+reused), and only within the same scope (sender address or thread), so a
+template shared by many customers never routes one customer from another's
+email.
+"""
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict, deque, namedtuple
+
+from analysis_cache import only_fields
+
+WORD = re.compile(r'\w+')
+# Modulus of the MinHash permutations (a Mersenne prime above the 32-bit shingle hashes)
+MERSENNE_PRIME = (1 << 61) - 1
+
+Fingerprint = namedtuple('Fingerprint', ['simhash', 'minhash', 'terms', 'shingles'])
+
+
+def shingle_hashes(text, size=3):
+    """64-bit hashes of the distinct runs of `size` words, lower-cased"""
+    words = WORD.findall(text.lower())
+    grams = {' '.join(words[start:start + size]) for start in range(max(1, len(words) - size + 1))}
+    return [int.from_bytes(hashlib.blake2b(gram.encode('utf-8'), digest_size=8).digest(), 'big')
+            for gram in grams if gram]
+
+
+def _permutations(count):
+    """Fixed (a, b) pairs of the MinHash permutations (a * x + b) mod p, the same in every process"""
+    pairs = []
+    for index in range(count):
+        digest = hashlib.blake2b(f'minhash-{index}'.encode(), digest_size=16).digest()
+        pairs.append((int.from_bytes(digest[:8], 'big') % (MERSENNE_PRIME - 1) + 1,
+                      int.from_bytes(digest[8:], 'big') % MERSENNE_PRIME))
+    return pairs
+
+
+class Fingerprinter:
+    """
+    Fingerprints of word shingles. Texts with fewer than min_shingles distinct
+    shingles get no fingerprint: in short emails a single changed word is a
+    large part of the text. key_terms, a function from the text to the terms
+    that decide its routing, adds a digest of those terms to the fingerprint.
+    """
+
+    def __init__(self, shingle_size=3, num_perm=64, min_shingles=8, key_terms=None):
+        self.shingle_size = shingle_size
+        self.min_shingles = min_shingles
+        self.key_terms = key_terms
+        self.permutations = _permutations(num_perm)
+
+    def fingerprint(self, text):
+        """
+        Returns:
+            Fingerprint: or None when the text is too short to compare safely
+        """
+        hashes = shingle_hashes(text, self.shingle_size)
+        if len(hashes) < self.min_shingles:
+            return None
+        simhash = 0
+        half = len(hashes) / 2
+        for bit in range(64):
+            if sum((value >> bit) & 1 for value in hashes) > half:
+                simhash |= 1 << bit
+        minhash = tuple(min((a * (value & 0xFFFFFFFF) + b) % MERSENNE_PRIME for value in hashes)
+                        for a, b in self.permutations)
+        terms = ''
+        if self.key_terms is not None:
+            terms = hashlib.blake2b('\0'.join(sorted(set(self.key_terms(text)))).encode('utf-8'),
+                                    digest_size=8).hexdigest()
+        return Fingerprint(simhash, minhash, terms, len(hashes))
+
+
+def hamming(first, second):
+    return bin(first ^ second).count('1')
+
+
+def jaccard(first, second):
+    """Jaccard similarity of the shingle sets, estimated from two MinHash signatures"""
+    return sum(a == b for a, b in zip(first, second)) / len(first)
+
+
+def scope_keys(contact_data, own_thread=False):
+    """
+    The scopes an email can be matched in: its thread (the contact it relates to) and its sender.
+    Addresses are hashed so the index and the shared table hold no email addresses.
+    Args:
+        contact_data (dict): Details.ContactData of the Amazon Connect event
+        own_thread (bool): Also the thread the contact itself starts, to store its analysis
+            where replies to it (RelatedContactId = its ContactId) look
+    Returns:
+        list: e.g. ['thread:<contact id>', 'sender:<sha-256 of the address>']
+    """
+    scopes = []
+    related = contact_data.get('RelatedContactId') or contact_data.get('PreviousContactId')
+    if related:
+        scopes.append(f"thread:{related}")
+    if own_thread and contact_data.get('ContactId') and contact_data['ContactId'] != related:
+        scopes.append(f"thread:{contact_data['ContactId']}")
+    endpoint = contact_data.get('CustomerEndpoint') or {}
+    if endpoint.get('Address'):
+        scopes.append(f"sender:{hashlib.sha256(endpoint['Address'].strip().lower().encode('utf-8')).hexdigest()}")
+    return scopes
+
+
+class NearDuplicateIndex:
+    """
+    The most recent per_scope fingerprints and analyses of at most max_scopes
+    scopes, least recently used scopes evicted first. Lives at module level so
+    it survives warm invocations. With a shared backend (get/put of a JSON
+    value by key, see analysis_cache), each scope's entries are also kept
+    there so all Lambda instances see them; concurrent writers to one scope
+    can lose each other's entries, which only costs a reuse. Shared-tier
+    errors are counted and treated as misses. With shared_fields, only those
+    fields of an analysis are written to the shared tier.
+    """
+
+    def __init__(self, max_hamming=12, min_jaccard=0.85, max_scopes=1000, per_scope=5, ttl_seconds=3600,
+                 shared=None, shared_fields=None, clock=time.time):
+        self.max_hamming = max_hamming
+        self.min_jaccard = min_jaccard
+        self.max_scopes = max_scopes
+        self.per_scope = per_scope
+        self.ttl_seconds = ttl_seconds
+        self.shared = shared
+        self.shared_fields = shared_fields
+        self.clock = clock
+        self.stats = {'hits': 0, 'shared_hits': 0, 'misses': 0, 'rejected': 0, 'errors': 0}
+        self._scopes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _match(self, entries, fingerprint, now):
+        for entry in reversed(entries):
+            simhash, minhash, terms, expires_at, analysis = entry
+            if expires_at <= now or hamming(simhash, fingerprint.simhash) > self.max_hamming:
+                continue
+            if terms == fingerprint.terms and jaccard(minhash, fingerprint.minhash) >= self.min_jaccard:
+                return analysis
+            # Close SimHash, but the key terms or too many shingles differ
+            self.stats['rejected'] += 1
+        return None
+
+    def find(self, scopes, fingerprint):
+        """
+        Returns:
+            dict: The analysis of a recent near-duplicate in one of the scopes, or None
+        """
+        now = self.clock()
+        with self._lock:
+            for scope in scopes:
+                entries = self._scopes.get(scope)
+                analysis = self._match(entries, fingerprint, now) if entries else None
+                if analysis is not None:
+                    self._scopes.move_to_end(scope)
+                    self.stats['hits'] += 1
+                    return dict(analysis)
+        if self.shared is not None:
+            for scope in scopes:
+                try:
+                    stored = self.shared.get(f"near-duplicate:{scope}")
+                except Exception:
+                    self.stats['errors'] += 1
+                    continue
+                entries = [(simhash, tuple(minhash), terms, expires_at, analysis)
+                           for simhash, minhash, terms, expires_at, analysis in stored or []]
+                with self._lock:
+                    analysis = self._match(entries, fingerprint, now)
+                    # Add the entries of other instances; local copies of the same entries keep all fields
+                    local = list(self._scopes.get(scope, ()))
+                    known = {entry[:4] for entry in local}
+                    entries = [entry for entry in entries if entry[:4] not in known]
+                    if entries:
+                        self._store(scope, sorted(entries + local, key=lambda entry: entry[3]))
+                if analysis is not None:
+                    self.stats['shared_hits'] += 1
+                    return dict(analysis)
+        self.stats['misses'] += 1
+        return None
+
+    def add(self, scopes, fingerprint, analysis):
+        entry = (fingerprint.simhash, fingerprint.minhash, fingerprint.terms, self.clock() + self.ttl_seconds,
+                 dict(analysis))
+        for scope in scopes:
+            with self._lock:
+                entries = list(self._scopes.get(scope, ())) + [entry]
+                self._store(scope, entries)
+                entries = list(self._scopes[scope])
+            if self.shared is not None:
+                try:
+                    self.shared.put(f"near-duplicate:{scope}",
+                                    [entry[:4] + (only_fields(entry[4], self.shared_fields),) for entry in entries])
+                except Exception:
+                    self.stats['errors'] += 1
+
+    def _store(self, scope, entries):
+        now = self.clock()
+        self._scopes[scope] = deque((entry for entry in entries if entry[3] > now), maxlen=self.per_scope)
+        self._scopes.move_to_end(scope)
+        while len(self._scopes) > self.max_scopes:
+            self._scopes.popitem(last=False)
+
+    def __len__(self):
+        return len(self._scopes)
@@ -0,0 +1,151 @@
+"""
+Extraction of structured PII (phone numbers, email addresses, account numbers)
+from the normalized email text with precompiled patterns, in one scan, so the
+model does not have to generate it.
+"""
+import json
+import re
+
+EMAIL_PATTERN = r'[A-Za-z0-9][A-Za-z0-9._%+-]*@[A-Za-z0-9-]+(?:\.[A-Za-z0-9-]+)*\.[A-Za-z]{2,}'
+IBAN_PATTERN = r'\b[A-Z]{2}\d{2}(?: ?[A-Z0-9]{4}){2,7}(?: ?[A-Z0-9]{1,3})?\b'
+# Runs of digits with the separators phone and account numbers are written with
+DIGITS_PATTERN = r'\+?\(?\d[\d ().-]{4,24}\d'
+
+# Words shortly before a number that say what it is
+PHONE_LABEL = re.compile(r'(?:phone|call|tel|telephone|mobile|cell|ring|text|whatsapp|fax|contact|reach)\b'
+                         r'[^.!?\d]{0,25}$', re.I)
+ACCOUNT_LABEL = re.compile(r'(?:account|acct|a/c|iban|sort code|card|policy|member(?:ship)?|customer)\b'
+                           r'[^.!?\d]{0,25}$', re.I)
+# Dates and times are digit runs too
+DATE_LIKE = re.compile(r'^\d{1,4}[-./]\d{1,2}[-./]\d{1,4}$|^\d{1,2}[.:]\d{2}$')
+# Characters before a match that are looked at for a label
+LABEL_WINDOW = 40
+
+# Account number formats that can be enabled (PII_ACCOUNT_FORMATS), checked in this order:
+#   card      13 to 19 digits with a valid Luhn check digit
+#   iban      IBAN with valid mod-97 check digits
+#   labelled  6 to 18 digits right after a word like "account", "acct" or "policy"
+ACCOUNT_FORMATS = ('card', 'iban', 'labelled')
+# Fields of extracted_info the extractor fills
+FIELDS = ('phone_number', 'email_address', 'account_number')
+
+
+def luhn_valid(digits):
+    total = 0
+    for index, digit in enumerate(reversed(digits)):
+        value = int(digit)
+        if index % 2:
+            value = value * 2 - 9 if value > 4 else value * 2
+        total += value
+    return total % 10 == 0
+
+
+def mod97_valid(value):
+    """IBAN check (ISO 13616): move the first four characters to the end, letters to numbers, mod 97 is 1"""
+    value = value.replace(' ', '').upper()
+    if not value.isalnum():
+        return False
+    rearranged = value[4:] + value[:4]
+    return int(''.join(str(int(char, 36)) for char in rearranged)) % 97 == 1
+
+
+CHECKSUMS = {'luhn': luhn_valid, 'mod97': mod97_valid, 'none': lambda value: True}
+
+
+class PiiExtractor:
+    """
+    Finds phone numbers, email addresses and account numbers in one pass of a
+    combined regular expression. Matches are then validated: account numbers
+    by their check digits or a label, phone numbers as E.164 (+ and 8 to 15
+    digits), as NANP (10 digits, or 11 starting with 1), or, for other
+    national formats of 7 to 12 digits, only after a word like "call" or
+    "phone". Dates, amounts and reference numbers without a label are left out.
+
+    custom_formats adds account number formats, e.g.
+    [{"name": "member_id", "pattern": "M\\\\d{8}", "checksum": "luhn"}];
+    checksum is 'luhn' (over the digits), 'mod97' or 'none'.
+    """
+
+    def __init__(self, account_formats=ACCOUNT_FORMATS, custom_formats=None):
+        unknown = set(account_formats) - set(ACCOUNT_FORMATS)
+        if unknown:
+            raise ValueError(f"Unknown account number formats: {', '.join(sorted(unknown))}")
+        self.account_formats = tuple(account_formats)
+        self.custom_checks = {}
+        alternatives = [f'(?P<email>{EMAIL_PATTERN})']
+        if 'iban' in self.account_formats:
+            alternatives.append(f'(?P<iban>{IBAN_PATTERN})')
+        for index, custom in enumerate(custom_formats or []):
+            checksum = custom.get('checksum', 'none')
+            if checksum not in CHECKSUMS:
+                raise ValueError(f"Unknown checksum {checksum} of account number format {custom.get('name')}")
+            group = f'custom{index}'
+            self.custom_checks[group] = CHECKSUMS[checksum]
+            alternatives.append(f"(?P<{group}>\\b(?:{custom['pattern']})\\b)")
+        alternatives.append(f'(?P<digits>{DIGITS_PATTERN})')
+        self.pattern = re.compile('|'.join(alternatives))
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        """Extractor with the custom account number formats of a JSON file (a list, see the class)"""
+        with open(path) as f:
+            return cls(custom_formats=json.load(f), **kwargs)
+
+    def extract(self, text):
+        """
+        Args:
+            text (str): Normalized email text
+        Returns:
+            dict: Field name (see FIELDS) mapped to the values found, in order, without duplicates
+        """
+        found = {field: [] for field in FIELDS}
+        for match in self.pattern.finditer(text):
+            group = match.lastgroup
+            value = match.group().rstrip(' .-(')
+            if value.startswith('(') and ')' not in value:
+                value = value[1:]
+            field = None
+            if group == 'email':
+                field = 'email_address'
+            elif group == 'iban':
+                field = 'account_number' if mod97_valid(value) else None
+            elif group in self.custom_checks:
+                digits = re.sub(r'\D', '', value)
+                check = self.custom_checks[group]
+                field = 'account_number' if check(digits if check is luhn_valid else value) else None
+            else:
+                field = self._classify_digits(value, text[max(0, match.start() - LABEL_WINDOW):match.start()])
+            if field and value not in found[field]:
+                found[field].append(value)
+        return found
+
+    def _classify_digits(self, value, before):
+        if DATE_LIKE.match(value):
+            return None
+        digits = re.sub(r'\D', '', value)
+        if value.startswith('+'):
+            return 'phone_number' if 8 <= len(digits) <= 15 and digits[0] != '0' else None
+        if 'card' in self.account_formats and 13 <= len(digits) <= 19 and luhn_valid(digits):
+            return 'account_number'
+        if 'labelled' in self.account_formats and 6 <= len(digits) <= 18 and ACCOUNT_LABEL.search(before):
+            return 'account_number'
+        if len(digits) == 11 and digits[0] == '1':
+            digits = digits[1:]
+        if len(digits) == 10 and digits[0] in '23456789' and re.search(r'[ ().-]', value):
+            return 'phone_number'
+        if 7 <= len(digits) <= 12 and PHONE_LABEL.search(before):
+            return 'phone_number'
+        return None
+
+
+def extracted_info(found):
+    """
+    The first value of each field, in the extracted_info shape; further values go to other_pii
+    Returns:
+        dict: e.g. {'phone_number': '+44 20 7946 0958', 'other_pii': ['555 0100']}
+    """
+    info = {field: values[0] for field, values in found.items() if values}
+    others = [value for values in found.values() for value in values[1:]]
+    if others:
+        info['other_pii'] = others
+    return info
@@ -0,0 +1,213 @@
+import random
+import threading
+import time
+from collections import deque
+
+# Error codes that mean the service is overloaded or briefly unavailable, so the same call may succeed later
+RETRYABLE_ERRORS = frozenset((
+    'ThrottlingException', 'TooManyRequestsException', 'ServiceUnavailableException', 'ModelNotReadyException',
+    'ModelTimeoutException', 'InternalServerException', 'InternalFailure', 'ServiceUnavailable'
+))
+# The retryable errors that only mean "slow down": they do not count towards the circuit breaker,
+# which is for a failing service rather than one at its quota (see admission.py for that)
+THROTTLE_ERRORS = frozenset(('ThrottlingException', 'TooManyRequestsException'))
+# Connection failures and timeouts (botocore's and the built-in ones), matched by class name so
+# botocore is not imported here
+RETRYABLE_EXCEPTIONS = frozenset((
+    'ConnectionError', 'EndpointConnectionError', 'ConnectTimeoutError', 'ReadTimeoutError',
+    'ConnectionClosedError', 'TimeoutError'
+))
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling a service whose circuit breaker is open"""
+
+
+def error_code(error):
+    """The AWS error code of a botocore ClientError, otherwise None"""
+    response = getattr(error, 'response', None)
+    if isinstance(response, dict):
+        return response.get('Error', {}).get('Code')
+    return None
+
+
+def is_retryable(error):
+    """True for throttling, server-side and connection errors; False for errors in the request itself"""
+    if error_code(error) in RETRYABLE_ERRORS:
+        return True
+    return any(cls.__name__ in RETRYABLE_EXCEPTIONS for cls in type(error).__mro__)
+
+
+class RetryPolicy:
+    """
+    Up to max_attempts calls, with "full jitter" exponential backoff between them:
+    before retry n the delay is random between 0 and base_delay * 2 ** (n - 1),
+    capped at max_delay. The jitter spreads the retries of concurrent Lambdas
+    that were throttled at the same moment.
+    """
+
+    def __init__(self, max_attempts=3, base_delay=0.1, max_delay=1.0, rng=random.random):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rng = rng
+
+    def delay(self, retry):
+        return self.rng() * min(self.max_delay, self.base_delay * 2 ** (retry - 1))
+
+
+class CircuitBreaker:
+    """
+    Fails fast while a service is failing, instead of every invocation waiting for
+    its own timeout.
+
+    Closed, the outcomes of the last `window` calls are kept. Once at least
+    `min_calls` are recorded and the share of failures reaches `error_rate`, the
+    breaker opens: calls raise CircuitOpenError for `open_seconds`. It is then
+    half-open and lets one trial call through; its success closes the breaker,
+    its failure opens it again.
+
+    before_call returns the breaker's generation, which changes whenever it opens
+    or closes. Outcomes passed with an older generation are ignored, so calls
+    that were already in flight when it closed cannot reopen it.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, error_rate=0.5, min_calls=5, window=20, open_seconds=30.0, clock=time.monotonic):
+        self.error_rate = error_rate
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.clock = clock
+        self.state = self.CLOSED
+        self.opened = 0
+        self._outcomes = deque(maxlen=window)
+        self._opened_at = 0.0
+        self._trial = False
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Raise CircuitOpenError if the call must not go to the service; returns the generation"""
+        with self._lock:
+            if self.state == self.OPEN:
+                remaining = self._opened_at + self.open_seconds - self.clock()
+                if remaining > 0:
+                    raise CircuitOpenError(f"CircuitOpen: calls fail fast for another {remaining:.1f}s")
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN:
+                if self._trial:
+                    raise CircuitOpenError("CircuitOpen: a trial call is in progress")
+                self._trial = True
+            return self._generation
+
+    def on_success(self, generation=None):
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            if self.state == self.HALF_OPEN:
+                self.state = self.CLOSED
+                self._generation += 1
+                self._outcomes.clear()
+                self._trial = False
+            self._outcomes.append(True)
+
+    def on_failure(self, generation=None):
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            if self.state == self.HALF_OPEN:
+                self._open()
+                return
+            self._outcomes.append(False)
+            failures = self._outcomes.count(False)
+            if len(self._outcomes) >= self.min_calls and failures >= self.error_rate * len(self._outcomes):
+                self._open()
+
+    def release(self):
+        """The call was not made after all (e.g. not admitted); a trial call may be made again"""
+        with self._lock:
+            self._trial = False
+
+    def _open(self):
+        self.state = self.OPEN
+        self._generation += 1
+        self.opened += 1
+        self._opened_at = self.clock()
+        self._trial = False
+        self._outcomes.clear()
+
+
+class Guard:
+    """
+    Calls one AWS service through optional admission control, a circuit breaker
+    and retries. Retries only happen while the time budget leaves room for the
+    backoff delay and another attempt of at least `min_attempt` seconds.
+
+    put_metric(name, value) receives '<name>_retries' and '<name>_circuit_open'.
+    """
+
+    def __init__(self, name, retry=None, breaker=None, admission=None, min_attempt=0.0,
+                 put_metric=None, sleep=time.sleep):
+        self.name = name
+        self.retry = retry
+        self.breaker = breaker
+        self.admission = admission
+        self.min_attempt = min_attempt
+        self.put_metric = put_metric or (lambda name, value: None)
+        self.sleep = sleep
+
+    def call(self, fn, deadline=None, cost=None):
+        """
+        Args:
+            fn: Makes the call; takes no arguments
+            deadline (Deadline): Time budget of the call, retries included; None for no limit
+            cost (dict): Admission cost, e.g. {'requests': 1, 'tokens': 900}
+        Returns:
+            What fn returns
+        Raises:
+            CircuitOpenError, AdmissionDenied, or the last error of fn
+        """
+        max_attempts = self.retry.max_attempts if self.retry is not None else 1
+        attempt = 1
+        while True:
+            generation = None
+            if self.breaker is not None:
+                try:
+                    generation = self.breaker.before_call()
+                except CircuitOpenError:
+                    self.put_metric(f"{self.name}_circuit_open", 1)
+                    raise
+            if self.admission is not None and cost:
+                try:
+                    self.admission.admit(cost, deadline)
+                except Exception:
+                    if self.breaker is not None:
+                        self.breaker.release()
+                    raise
+            try:
+                result = fn()
+            except Exception as e:
+                retryable = is_retryable(e)
+                if self.breaker is not None:
+                    if error_code(e) in THROTTLE_ERRORS:
+                        self.breaker.release()
+                    elif retryable:
+                        self.breaker.on_failure(generation)
+                    else:
+                        # An error in the request itself still means the service answered
+                        self.breaker.on_success(generation)
+                if not retryable or attempt >= max_attempts:
+                    raise
+                delay = self.retry.delay(attempt)
+                if deadline is not None and not deadline.allows(delay + self.min_attempt):
+                    raise
+                self.put_metric(f"{self.name}_retries", attempt)
+                self.sleep(delay)
+                attempt += 1
+                continue
+            if self.breaker is not None:
+                self.breaker.on_success(generation)
+            return result
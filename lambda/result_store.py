@@ -0,0 +1,210 @@
+"""
+Analysis results written as JSON-lines objects, to S3 or to a local directory.
+
+BatchWriter groups records into objects; the backfill uses it directly.
+WriteBehindBuffer keeps the Lambda's per-contact results in memory and hands
+them to a BatchWriter on a background thread, so recording a result never
+waits for S3.
+"""
+import gzip
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+
+class S3Store:
+    """Writes objects to an S3 bucket."""
+
+    def __init__(self, client, bucket):
+        self.client = client
+        self.bucket = bucket
+
+    def put(self, key, data, content_type='application/x-ndjson'):
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=data, ContentType=content_type)
+        return f"s3://{self.bucket}/{key}"
+
+
+class LocalStore:
+    """Writes objects as files below a local directory, for dry runs and tests."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def put(self, key, data, content_type=None):
+        path = os.path.join(self.directory, *key.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+
+def date_partition(record):
+    """Hive-style partition of a record by the UTC date of its 'timestamp', e.g. 'dt=2024-05-01'"""
+    return f"dt={record['timestamp'][:10]}"
+
+
+class BatchWriter:
+    """
+    Collects result records and writes them as one JSON-lines object per
+    batch_size records, under <prefix>/part-<writer id>-<sequence>.jsonl so
+    resumed runs never overwrite earlier parts.
+
+    With compress, objects are gzipped (.jsonl.gz). With partition, a function
+    of the record, records go below <prefix>/<partition>/ and each flush writes
+    one object per partition.
+    """
+
+    def __init__(self, store, prefix, batch_size=500, compress=False, partition=None):
+        self.store = store
+        self.prefix = prefix.strip('/')
+        self.batch_size = batch_size
+        self.compress = compress
+        self.partition = partition
+        self.objects = []
+        self._writer_id = f"{int(time.time())}-{uuid.uuid4().hex[:6]}"
+        self._records = []
+        self._lock = threading.Lock()
+
+    def add(self, record):
+        """Buffer a record; returns the records written if this completed a batch."""
+        self._records.append(record)
+        if len(self._records) >= self.batch_size:
+            return self.flush()
+        return []
+
+    def flush(self):
+        if not self._records:
+            return []
+        records, self._records = self._records, []
+        self.write(records)
+        return records
+
+    def write(self, records):
+        """Write the records now, one object per partition; returns the object locations"""
+        groups = {}
+        for record in records:
+            groups.setdefault(self.partition(record) if self.partition else None, []).append(record)
+        written = []
+        for partition, group in groups.items():
+            data = ''.join(json.dumps(record, default=str) + '\n' for record in group).encode('utf-8')
+            with self._lock:
+                sequence = len(self.objects) + len(written) + 1
+            key = f"{self.prefix}/{partition + '/' if partition else ''}part-{self._writer_id}-{sequence:05d}.jsonl"
+            if self.compress:
+                # mtime=0 keeps the bytes a function of the records alone
+                written.append(self.store.put(key + '.gz', gzip.compress(data, mtime=0), 'application/gzip'))
+            else:
+                written.append(self.store.put(key, data))
+        with self._lock:
+            self.objects.extend(written)
+        return written
+
+
+class WriteBehindBuffer:
+    """
+    Holds records in memory and writes them with a BatchWriter in the
+    background. flush_due() starts a write on the buffer's own thread once
+    batch_size records are waiting or the oldest has waited max_age seconds.
+    The Lambda calls it at the start of an invocation, so the write overlaps
+    that invocation's Bedrock call instead of delaying a response; Lambda
+    freezes threads between invocations, and a write still running then
+    resumes with the next one. flush_and_wait() writes everything held,
+    waiting a bounded time, e.g. from a shutdown or extension hook.
+
+    A failed write puts its records back for the next attempt. At most
+    max_records are held; beyond that the oldest are dropped and counted,
+    so an S3 outage costs records rather than memory.
+    """
+
+    def __init__(self, writer, batch_size=100, max_age=300, max_records=5000, clock=time.monotonic):
+        self.writer = writer
+        self.batch_size = batch_size
+        self.max_age = max_age
+        self.max_records = max_records
+        self.clock = clock
+        self.stats = {'added': 0, 'written': 0, 'dropped': 0, 'errors': 0, 'objects': 0}
+        self._records = []
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='write-behind')
+        self._pending = None
+
+    def __len__(self):
+        return len(self._records)
+
+    def add(self, record):
+        with self._lock:
+            if not self._records:
+                self._oldest = self.clock()
+            self._records.append(record)
+            self.stats['added'] += 1
+            self._drop_oldest()
+
+    def _drop_oldest(self):
+        excess = len(self._records) - self.max_records
+        if excess > 0:
+            del self._records[:excess]
+            self.stats['dropped'] += excess
+
+    def due(self):
+        with self._lock:
+            return bool(self._records) and (len(self._records) >= self.batch_size
+                                            or self.clock() - self._oldest >= self.max_age)
+
+    def flush_due(self):
+        """Start a background write if one is due and none is running; returns the Future or None"""
+        if (self._pending is not None and not self._pending.done()) or not self.due():
+            return None
+        self._pending = self._executor.submit(self.flush)
+        return self._pending
+
+    def flush_and_wait(self, timeout):
+        """
+        Start a background write of everything held and wait at most timeout seconds for it,
+        so an execution environment that is removed while frozen holds nothing. A write still
+        running then resumes with the next invocation; a failed one is retried by flush_due().
+        Returns:
+            bool: True if no records are left held
+        """
+        ends = time.monotonic() + timeout
+        while True:
+            if self._pending is None or self._pending.done():
+                if not self._records:
+                    return True
+                self._pending = self._executor.submit(self.flush)
+            remaining = ends - time.monotonic()
+            if remaining <= 0:
+                return False
+            try:
+                self._pending.result(timeout=remaining)
+            except FutureTimeout:
+                return False
+            except Exception:
+                # The records are back in the buffer
+                return False
+
+    def flush(self):
+        """Write everything held now, e.g. when the execution environment shuts down"""
+        with self._lock:
+            records, self._records = self._records, []
+        if not records:
+            return 0
+        try:
+            objects = self.writer.write(records)
+        except Exception:
+            with self._lock:
+                self.stats['errors'] += 1
+                self._records = records + self._records
+                self._oldest = self.clock()
+                self._drop_oldest()
+            raise
+        with self._lock:
+            self.stats['written'] += len(records)
+            self.stats['objects'] += len(objects)
+            if self._records:
+                self._oldest = self.clock()
+        return len(records)
@@ -0,0 +1,100 @@
+import json
+import random
+import re
+import threading
+import time
+from collections import deque
+
+LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40}
+
+# Fields that carry email text, PII extracted from it, the customer's email address (CustomerEndpoint.Address)
+# or download URLs of the email and its attachments; redacted unless bodies are explicitly allowed in logs
+BODY_FIELDS = {'body', 'content', 'messageContent', 'text', 'message_text', 'email_content', 'system',
+               'extracted_info', 'Address', 'email_address', 'Url', 'url', 'download_url'}
+# URLs under any other field name, e.g. the Value of an attachment reference
+URL_VALUE = re.compile(r'^https?://', re.I)
+
+
+class StructuredLogger:
+    """
+    JSON-lines logger for the Lambda. Nothing is serialized unless a record is
+    actually written, and field values may be callables that are only invoked
+    at that point, so disabled debug logging costs almost nothing.
+
+    Each invocation is sampled once: a sampled invocation writes everything
+    down to DEBUG. Debug records of an unsampled invocation are kept
+    (unserialized) in a bounded buffer and written out if an ERROR is logged,
+    so every failure comes with its full debug trail.
+    """
+
+    def __init__(self, level='INFO', sample_rate=0.0, max_field_chars=1000, log_bodies=False,
+                 buffer_size=200, writer=print):
+        self.level = LEVELS[level.upper()]
+        self.sample_rate = sample_rate
+        self.max_field_chars = max_field_chars
+        self.log_bodies = log_bodies
+        self.writer = writer
+        self.sampled = False
+        self.context = {}
+        self._buffer = deque(maxlen=buffer_size)
+        self._lock = threading.Lock()
+
+    def start_invocation(self, **context):
+        """Reset per-invocation state and decide whether this invocation is sampled."""
+        with self._lock:
+            self._buffer.clear()
+            self.context = {key: value for key, value in context.items() if value is not None}
+            self.sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def is_enabled(self, level):
+        return LEVELS[level] >= self.level or self.sampled
+
+    def debug(self, message, **fields):
+        self._log('DEBUG', message, fields)
+
+    def info(self, message, **fields):
+        self._log('INFO', message, fields)
+
+    def warning(self, message, **fields):
+        self._log('WARNING', message, fields)
+
+    def error(self, message, **fields):
+        # Write the buffered debug trail of this invocation before the error itself
+        with self._lock:
+            buffered = list(self._buffer)
+            self._buffer.clear()
+        for record in buffered:
+            self._write(*record)
+        self._log('ERROR', message, fields)
+
+    def _log(self, level, message, fields):
+        if self.is_enabled(level):
+            self._write(level, message, fields, time.time())
+        elif self._buffer.maxlen:
+            with self._lock:
+                self._buffer.append((level, message, fields, time.time()))
+
+    def _write(self, level, message, fields, timestamp):
+        record = {'timestamp': round(timestamp, 3), 'level': level, 'message': message}
+        record.update(self.context)
+        if self.sampled:
+            record['sampled'] = True
+        for key, value in fields.items():
+            if callable(value):
+                value = value()
+            record[key] = self._sanitize(key, value)
+        self.writer(json.dumps(record, default=str))
+
+    def _sanitize(self, key, value):
+        if not self.log_bodies and value and (key in BODY_FIELDS
+                                              or isinstance(value, str) and URL_VALUE.match(value)):
+            return f"[redacted {len(value)} chars]" if isinstance(value, str) else "[redacted]"
+        if isinstance(value, dict):
+            return {k: self._sanitize(k, v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [self._sanitize(key, item) for item in value]
+        if isinstance(value, (bytes, bytearray)):
+            value = value.decode('utf-8', 'replace')
+        if isinstance(value, str) and len(value) > self.max_field_chars:
+            return value[:self.max_field_chars] + f"...[+{len(value) - self.max_field_chars} chars]"
+        return value
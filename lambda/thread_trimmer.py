@@ -0,0 +1,104 @@
+import re
+
+# Lines that start the quoted history of a reply or a forwarded message; everything from here on is old
+HISTORY_MARKERS = [
+    ('quoted', re.compile(r'^On\s.{0,300}\swrote:$', re.I)),
+    ('quoted', re.compile(r'^-{2,}\s*Original Message\s*-{2,}$', re.I)),
+    ('quoted', re.compile(r'^_{10,}$')),
+    ('forwarded', re.compile(r'^-{2,}\s*Forwarded message\s*-{2,}$', re.I)),
+    ('forwarded', re.compile(r'^Begin forwarded message:?$', re.I)),
+]
+# Outlook puts a From/Sent/To/Subject block in front of the previous message instead of "On ... wrote:"
+HEADER_FIELD = re.compile(r'^(From|Sent|Date|To|Cc|Subject):\s', re.I)
+SIGNATURE_DELIMITER = re.compile(r'^--\s?$')
+MOBILE_SIGNATURE = re.compile(r'^(Sent from my \w+|Get Outlook for \w+)', re.I)
+DISCLAIMER_TERMS = re.compile(
+    r'confidential|privileged|intended recipient|unauthori[sz]ed|disclaimer|'
+    r'notify the sender|delete (?:this|the) (?:e-?mail|message)|destroy all copies',
+    re.I
+)
+
+# Rough size of a model token, used to turn the token budget into characters
+CHARS_PER_TOKEN = 4
+
+
+def _history_start(lines):
+    """Index and kind of the first line of quoted or forwarded history, or (None, None)."""
+    for index, line in enumerate(lines):
+        for kind, marker in HISTORY_MARKERS:
+            if marker.match(line):
+                return index, kind
+        # "On <date>, <name> <address>" is often wrapped before "wrote:"
+        if index + 1 < len(lines) and lines[index + 1].lower() == 'wrote:' and line.lower().startswith('on '):
+            return index, 'quoted'
+        if line.lower().startswith('from:'):
+            fields = {HEADER_FIELD.match(following).group(1).lower()
+                      for following in lines[index + 1:index + 5] if HEADER_FIELD.match(following)}
+            if ('sent' in fields or 'date' in fields) and ('to' in fields or 'subject' in fields):
+                return index, 'quoted' if 'forward' not in ' '.join(lines[index:index + 5]).lower() else 'forwarded'
+    return None, None
+
+
+def _is_disclaimer(line):
+    return len(line) >= 100 and len(DISCLAIMER_TERMS.findall(line)) >= 2
+
+
+def trim_email(text, head_tokens=1500, tail_tokens=500, min_chars=10, keep_signature=False):
+    """
+    Reduce an email to the newly written message
+    Args:
+        text (str): Normalized email text with line breaks kept
+        head_tokens (int): Tokens kept from the start of the message when it is over budget
+        tail_tokens (int): Tokens kept from the end of the message when it is over budget
+        min_chars (int): If less than this is left, quoted and forwarded history is kept
+            (e.g. a bare "FYI" on top of a forwarded customer request)
+        keep_signature (bool): Keep the lines after a "--" signature delimiter, e.g. when the phone
+            or account number in them is to be found by the model
+    Returns:
+        tuple: (single-line trimmed text, dict of characters removed per reason)
+    """
+    lines = [line.strip() for line in text.split('\n')]
+    removed = {'quoted': 0, 'forwarded': 0, 'signature': 0, 'disclaimer': 0, 'budget': 0}
+
+    history, kind = _history_start(lines)
+    if history is not None:
+        new_lines = lines[:history]
+        if sum(len(line) for line in new_lines if not line.startswith('>')) >= min_chars:
+            removed[kind] += sum(len(line) + 1 for line in lines[history:])
+            lines = new_lines
+
+    kept = []
+    inline_quoted = 0
+    for index, line in enumerate(lines):
+        if not line:
+            continue
+        if line.startswith('>'):
+            inline_quoted += len(line) + 1
+        elif SIGNATURE_DELIMITER.match(line):
+            if keep_signature:
+                removed['signature'] += len(line) + 1
+                continue
+            removed['signature'] += sum(len(rest) + 1 for rest in lines[index:])
+            break
+        elif MOBILE_SIGNATURE.match(line):
+            removed['signature'] += len(line) + 1
+        elif _is_disclaimer(line):
+            removed['disclaimer'] += len(line) + 1
+        else:
+            kept.append(line)
+
+    # Quoted lines interleaved with the reply: keep them if nothing else is left
+    if sum(len(line) for line in kept) < min_chars and inline_quoted:
+        kept = [line.lstrip('> ') for line in lines if line and not SIGNATURE_DELIMITER.match(line)]
+    else:
+        removed['quoted'] += inline_quoted
+
+    trimmed = ' '.join(kept)
+
+    head = head_tokens * CHARS_PER_TOKEN
+    tail = tail_tokens * CHARS_PER_TOKEN
+    if len(trimmed) > head + tail:
+        removed['budget'] = len(trimmed) - head - tail
+        trimmed = trimmed[:head].rstrip() + ' ... ' + trimmed[len(trimmed) - tail:].lstrip()
+
+    return trimmed, removed
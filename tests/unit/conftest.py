@@ -0,0 +1,63 @@
+import copy
+import os
+import sys
+
+import pytest
+
+# The Lambda source lives in ./lambda, which is not an importable package name
+LAMBDA_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'lambda')
+sys.path.insert(0, os.path.abspath(LAMBDA_DIR))
+
+# Values the Lambda module expects from its deployment environment
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('instName', 'test-instance')
+os.environ.setdefault('connectBucket', 'test-connect-bucket')
+os.environ.setdefault('ENABLE_LOGGING', 'false')
+
+# Amazon Connect event of an email contact, as the contact flow passes it to the Lambda
+EVENT = {"Details": {"ContactData": {"InstanceARN": "arn:aws:connect:us-east-1:111122223333:instance/abc",
+                                     "ContactId": "contact-1"}}}
+
+
+class LambdaContext:
+    aws_request_id = 'request-1'
+
+    def __init__(self, remaining_ms=30000):
+        self.remaining_ms = remaining_ms
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_ms
+
+
+class FakeClock:
+    """Time that only moves when a test moves it, or sleeps"""
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def event():
+    return copy.deepcopy(EVENT)
+
+
+@pytest.fixture
+def make_context():
+    """Lambda contexts with the given milliseconds left"""
+    return LambdaContext
+
+
+@pytest.fixture
+def context():
+    return LambdaContext()
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
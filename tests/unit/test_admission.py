@@ -0,0 +1,106 @@
+import threading
+
+import pytest
+from botocore.exceptions import ClientError
+
+from admission import AdmissionController, AdmissionDenied, DynamoDBTokenBuckets, LocalTokenBuckets
+from deadline import Deadline
+
+# 60 requests and 6000 tokens per minute: 1 request and 100 tokens per second, 10 seconds of burst
+LIMITS = {'requests': 60, 'tokens': 6000}
+
+
+class FakeDynamoDB:
+    """get_item and put_item of one table, with the condition expressions DynamoDBTokenBuckets uses"""
+
+    def __init__(self):
+        self.items = {}
+        self.lock = threading.Lock()
+        self.before_put = None
+
+    def get_item(self, TableName, Key, ConsistentRead=False):
+        item = self.items.get(Key['bucket']['S'])
+        return {'Item': dict(item)} if item else {}
+
+    def put_item(self, TableName, Item, ConditionExpression, ExpressionAttributeValues=None,
+                 ExpressionAttributeNames=None):
+        if self.before_put:
+            self.before_put()
+        with self.lock:
+            current = self.items.get(Item['bucket']['S'])
+            if ConditionExpression.startswith('attribute_not_exists'):
+                ok = current is None
+            else:
+                ok = current is not None and current['updated_at'] == ExpressionAttributeValues[':previous']
+            if not ok:
+                raise ClientError({'Error': {'Code': 'ConditionalCheckFailedException'}}, 'PutItem')
+            self.items[Item['bucket']['S']] = Item
+
+
+def test_bucket_allows_a_burst_then_the_refill_rate(clock):
+    buckets = LocalTokenBuckets(LIMITS, burst_seconds=10, clock=clock)
+
+    assert [buckets.try_take({'requests': 1}) for _ in range(10)] == [0.0] * 10
+    assert buckets.try_take({'requests': 1}) == pytest.approx(1.0)
+    clock.now += 1
+    assert buckets.try_take({'requests': 1}) == 0.0
+
+
+def test_tokens_per_minute_limit_takes_nothing_when_any_bucket_is_short(clock):
+    buckets = LocalTokenBuckets(LIMITS, burst_seconds=10, clock=clock)
+
+    assert buckets.try_take({'requests': 1, 'tokens': 900}) == 0.0
+    assert buckets.try_take({'requests': 1, 'tokens': 200}) == pytest.approx(1.0)
+    # The request was not taken either
+    assert buckets.try_take({'requests': 1, 'tokens': 100}) == 0.0
+
+
+def test_controller_waits_briefly_then_denies(clock):
+    controller = AdmissionController(LocalTokenBuckets({'requests': 60}, burst_seconds=1, clock=clock),
+                                     max_wait=0.5, sleep=clock.sleep)
+    controller.admit({'requests': 1})
+    clock.now += 0.6
+    controller.admit({'requests': 1})
+    assert clock.now == pytest.approx(101.0)
+
+    with pytest.raises(AdmissionDenied):
+        controller.admit({'requests': 1}, Deadline(0.2, clock))
+    assert controller.stats['admitted'] == 2 and controller.stats['denied'] == 1
+
+
+def test_table_outage_admits_the_call():
+    class Broken:
+        def try_take(self, costs):
+            raise ClientError({'Error': {'Code': 'ResourceNotFoundException'}}, 'GetItem')
+
+    controller = AdmissionController(Broken())
+    controller.admit({'requests': 1})
+    assert controller.stats == {'admitted': 1, 'denied': 0, 'errors': 1, 'waited_seconds': 0.0}
+
+
+def test_shared_buckets_count_every_instance(clock):
+    table = FakeDynamoDB()
+    instances = [DynamoDBTokenBuckets(table, 'admission', 'model', {'requests': 60}, burst_seconds=3, clock=clock)
+                 for _ in range(3)]
+
+    assert [instance.try_take({'requests': 1}) for instance in instances] == [0.0, 0.0, 0.0]
+    assert instances[0].try_take({'requests': 1}) == pytest.approx(1.0)
+    clock.now += 1
+    assert instances[2].try_take({'requests': 1}) == 0.0
+
+
+def test_concurrent_write_is_retried_with_the_new_levels(clock):
+    table = FakeDynamoDB()
+    first = DynamoDBTokenBuckets(table, 'admission', 'model', {'requests': 60}, burst_seconds=2, clock=clock)
+    second = DynamoDBTokenBuckets(table, 'admission', 'model', {'requests': 60}, burst_seconds=2, clock=clock)
+    assert first.try_take({'requests': 1}) == 0.0
+
+    # Another instance takes the last token between this instance's read and write
+    def interfere():
+        table.before_put = None
+        clock.now += 0.001
+        assert second.try_take({'requests': 1}) == 0.0
+    table.before_put = interfere
+
+    assert first.try_take({'requests': 1}) > 0
+    assert first.conflicts == 1
@@ -0,0 +1,104 @@
+import json
+import time
+
+import lambda_function
+from analysis_cache import AnalysisCache, InMemoryBackend, LRUTier, make_cache_key
+from pii_extractor import PiiExtractor
+
+
+def test_cache_key_depends_on_all_inputs():
+    key = make_cache_key("body", "model", "instruction")
+    assert key == make_cache_key("body", "model", "instruction")
+    assert key != make_cache_key("body2", "model", "instruction")
+    assert key != make_cache_key("body", "model2", "instruction")
+    assert key != make_cache_key("body", "model", "instruction2")
+
+
+def test_lru_tier_evicts_least_recently_used():
+    tier = LRUTier(max_entries=2)
+    tier.put("a", 1)
+    tier.put("b", 2)
+    tier.get("a")
+    tier.put("c", 3)
+    assert tier.get("a") == 1
+    assert tier.get("b") is None
+    assert len(tier) == 2
+
+
+def test_shared_tier_hit_populates_local_tier():
+    shared = InMemoryBackend()
+    shared.put("k", {"intent1": "x"})
+    cache = AnalysisCache(LRUTier(), shared)
+
+    assert cache.get("k") == {"intent1": "x"}
+    assert cache.get("k") == {"intent1": "x"}
+    assert cache.get("missing") is None
+    assert cache.stats == {'local_hits': 1, 'shared_hits': 1, 'misses': 1, 'errors': 0}
+
+
+def test_shared_tier_expiry():
+    shared = InMemoryBackend(ttl_seconds=0)
+    shared.put("k", {"a": 1})
+    time.sleep(0.01)
+    assert shared.get("k") is None
+
+
+def test_handler_hit_skips_comprehend_and_bedrock(monkeypatch, event):
+    calls = []
+
+    def fake_bedrock(*args):
+        calls.append('bedrock')
+        return {"success": True, "data": {"intents": ["HomeLoan"], "pii_detected": False,
+                                          "extracted_info": {}, "user_intent": "HomeLoan"}}
+
+    def fake_language(text, deadline=None):
+        calls.append('language')
+        return 'en'
+
+    monkeypatch.setattr(lambda_function, 'analysis_cache', AnalysisCache(LRUTier(), InMemoryBackend()))
+    monkeypatch.setattr(lambda_function, 'intent_classifier', None)
+    monkeypatch.setattr(lambda_function, 'extract_email_content', lambda event, deadline=None: "I want a home loan")
+    monkeypatch.setattr(lambda_function, 'call_bedrock', fake_bedrock)
+    monkeypatch.setattr(lambda_function, 'detect_language', fake_language)
+
+    first = lambda_function.lambda_handler(event, None)
+    second = lambda_function.lambda_handler(event, None)
+
+    assert first == second
+    assert first['user_intent'] == 'HomeLoan'
+    assert sorted(calls) == ['bedrock', 'language']
+    assert lambda_function.analysis_cache.stats['local_hits'] == 1
+
+
+def test_shared_table_holds_no_pii(monkeypatch, event):
+    shared = InMemoryBackend()
+    body = "Please call me on +1 202 555 0147 about a car loan"
+    analysis = {"intents": ["Car loan request"], "pii_detected": True, "user_intent": "Car loan request",
+                "extracted_info": {"phone_number": "+1 202 555 0147", "name": "Sam Lee"}}
+    monkeypatch.setattr(lambda_function, 'analysis_cache',
+                        AnalysisCache(LRUTier(), shared, shared_fields=lambda_function.SHARED_FIELDS))
+    monkeypatch.setattr(lambda_function, 'intent_classifier', None)
+    monkeypatch.setattr(lambda_function, 'pii_extractor', None)
+    monkeypatch.setattr(lambda_function, 'extract_email_content', lambda event, deadline=None: body)
+    monkeypatch.setattr(lambda_function, 'call_bedrock', lambda *args: {"success": True, "data": analysis})
+    monkeypatch.setattr(lambda_function, 'detect_language', lambda text, deadline=None: 'en')
+
+    first = lambda_function.lambda_handler(event, None)
+    [(stored, _)] = shared.items.values()
+    assert '202 555' not in stored and 'Sam Lee' not in stored
+    assert set(json.loads(stored)) == set(lambda_function.SHARED_FIELDS)
+
+    # Another instance: a shared hit has the routing fields and empty PII fields
+    monkeypatch.setattr(lambda_function, 'analysis_cache',
+                        AnalysisCache(LRUTier(), shared, shared_fields=lambda_function.SHARED_FIELDS))
+    second = lambda_function.lambda_handler(event, None)
+    assert second['user_intent'] == first['user_intent'] and second['pii_detected'] == 'true'
+    assert second['phone_number'] == '' and second['name'] == ''
+    assert set(second) >= set(lambda_function.PII_RESPONSE_FIELDS)
+
+    # With LOCAL_PII the structured PII is found again
+    monkeypatch.setattr(lambda_function, 'analysis_cache',
+                        AnalysisCache(LRUTier(), shared, shared_fields=lambda_function.SHARED_FIELDS))
+    monkeypatch.setattr(lambda_function, 'pii_extractor', PiiExtractor())
+    third = lambda_function.lambda_handler(event, None)
+    assert third['phone_number'] == '+1 202 555 0147'
@@ -0,0 +1,121 @@
+import io
+import json
+
+from botocore.exceptions import ClientError
+
+import lambda_function
+from backfill import (AdaptiveRateLimiter, BatchWriter, Checkpoint, LocalStore, analyze_item, file_item,
+                      run_backfill, sqs_handler)
+
+ANALYSIS = {"intents": ["Car loan request"], "pii_detected": False, "extracted_info": {},
+            "user_intent": "Car loan request"}
+
+
+def write_emails(tmp_path, count):
+    paths = []
+    for index in range(count):
+        path = tmp_path / f"email-{index}.json"
+        path.write_text(json.dumps({"messageContent": f"<p>Car loan question number {index}</p>"}))
+        paths.append(str(path))
+    return paths
+
+
+def test_rate_limiter_backs_off_on_throttle_and_recovers(clock):
+    limiter = AdaptiveRateLimiter(rate=4.0, max_rate=5.0, clock=clock, sleep=clock.sleep)
+    for _ in range(4):
+        limiter.acquire()
+    assert clock.now == 100.75
+
+    limiter.on_throttle()
+    assert limiter.rate == 2.0
+    for _ in range(20):
+        limiter.on_success()
+    assert 2.0 < limiter.rate <= 5.0
+
+
+def test_backfill_retries_throttles_batches_and_resumes(tmp_path, monkeypatch, clock):
+    calls = []
+
+    def fake_bedrock(client, model_id, instruction, email_content, guard=None):
+        calls.append(email_content)
+        if len(calls) == 1:
+            return {"success": False, "data": "An error occurred (ThrottlingException) when calling InvokeModel"}
+        if "number 3" in email_content:
+            return {"success": False, "data": "An error occurred (ValidationException)"}
+        return {"success": True, "data": ANALYSIS}
+
+    monkeypatch.setattr(lambda_function, 'call_bedrock', fake_bedrock)
+    items = [file_item(path) for path in write_emails(tmp_path, 5)]
+    limiter = AdaptiveRateLimiter(rate=100.0, clock=clock, sleep=clock.sleep)
+    checkpoint = Checkpoint(str(tmp_path / "run.ckpt"))
+    writer = BatchWriter(LocalStore(str(tmp_path / "out")), "backfill/run-1", batch_size=2)
+
+    stats = run_backfill(items, writer, limiter, checkpoint, concurrency=1)
+
+    assert (stats['ok'], stats['error'], stats['skipped']) == (4, 1, 0)
+    assert stats['failed_ids'] == ['email-3.json']
+    assert stats['throttles'] == 1
+    assert len(stats['objects']) == 3
+    records = [json.loads(line) for path in stats['objects'] for line in open(path)]
+    assert [record['id'] for record in records] == [f"email-{index}.json" for index in range(5)]
+    assert records[0]['attempts'] == 2 and records[0]['analysis'] == ANALYSIS
+
+    # A rerun with the same checkpoint only retries the failure
+    calls.clear()
+    resumed = run_backfill(items, BatchWriter(LocalStore(str(tmp_path / "out")), "backfill/run-1"), limiter,
+                           Checkpoint(str(tmp_path / "run.ckpt")), concurrency=2)
+    assert (resumed['ok'], resumed['error'], resumed['skipped']) == (0, 1, 4)
+
+
+def test_sqs_handler_reports_failed_messages(monkeypatch):
+    puts = []
+
+    class FakeS3:
+        def put_object(self, **kwargs):
+            puts.append(kwargs)
+
+    def fake_extract(contact_event):
+        if contact_event['ContactId'] == 'missing':
+            raise ValueError("Could not find file ID in email reference")
+        return "I need a car loan"
+
+    monkeypatch.setattr(lambda_function, 's3Client', FakeS3())
+    monkeypatch.setattr(lambda_function, 'extract_email_content', fake_extract)
+    monkeypatch.setattr(lambda_function, 'call_bedrock', lambda *args, **kwargs: {"success": True, "data": ANALYSIS})
+    arn = "arn:aws:connect:us-east-1:111122223333:instance/abc"
+    event = {"Records": [
+        {"messageId": "m1", "body": json.dumps({"contact_id": "c1", "instance_arn": arn})},
+        {"messageId": "m2", "body": json.dumps({"contact_id": "missing", "instance_arn": arn})},
+    ]}
+
+    response = sqs_handler(event, None)
+
+    assert response == {'batchItemFailures': [{'itemIdentifier': 'm2'}]}
+    assert len(puts) == 1 and puts[0]['Bucket'] == 'test-connect-bucket'
+    assert puts[0]['Body'].decode().count('\n') == 2
+
+
+def test_every_throttle_reaches_the_rate_limiter(tmp_path, monkeypatch, clock):
+    class ThrottlingBedrock:
+        calls = 0
+
+        def invoke_model(self, **kwargs):
+            self.calls += 1
+            if self.calls <= 2:
+                raise ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}},
+                                  'InvokeModel')
+            return {'body': io.BytesIO(json.dumps({'content': [{'text': json.dumps(ANALYSIS)}]}).encode())}
+
+    bedrock = ThrottlingBedrock()
+    monkeypatch.setattr(lambda_function, 'bedrock', bedrock)
+    monkeypatch.setattr(lambda_function, 'bedrock_streaming', False)
+    outcomes = list(lambda_function.bedrock_guard.breaker._outcomes)
+    limiter = AdaptiveRateLimiter(rate=100.0, clock=clock, sleep=clock.sleep)
+
+    record = analyze_item(file_item(write_emails(tmp_path, 1)[0]), limiter, lambda_function.instruction)
+
+    # One model call per attempt: the handler's retries do not hide the throttles
+    assert record['status'] == 'ok' and record['attempts'] == 3
+    assert bedrock.calls == 3 and limiter.throttles == 2
+    # The contact flow's circuit breaker does not count the backfill's calls
+    assert list(lambda_function.bedrock_guard.breaker._outcomes) == outcomes
@@ -0,0 +1,67 @@
+import io
+import json
+
+import lambda_function
+
+
+def test_request_template_matches_full_serialization():
+    email = 'Café "loan" \\ \U0001F600\n<b>hi</b>'
+    prefix, suffix = lambda_function.request_template(lambda_function.instruction)
+
+    assert prefix + json.dumps(email) + suffix == json.dumps({
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": lambda_function.bedrock_max_tokens,
+        "system": lambda_function.instruction,
+        "messages": [{"role": "user", "content": email}],
+        "temperature": 0
+    })
+    assert lambda_function.request_template(lambda_function.instruction)[0] is prefix
+
+
+class FakeBedrock:
+    def __init__(self, analysis):
+        self.analysis = analysis
+        self.requests = []
+
+    def invoke_model(self, body, **kwargs):
+        self.requests.append(json.loads(body))
+        response = {"content": [{"text": json.dumps(self.analysis)}],
+                    "usage": {"input_tokens": 412, "output_tokens": 23}}
+        return {'body': io.BytesIO(json.dumps(response).encode())}
+
+
+def test_compact_output_maps_to_connect_attributes_and_records_tokens(monkeypatch, event):
+    records = []
+    fake = FakeBedrock({"intent": "Car loan request", "pii": True,
+                        "info": {"phone": "555 0100", "account": "12345", "other": ["DOB 1980-01-01", "SSN"]}})
+    monkeypatch.setattr(lambda_function.metrics, 'writer', records.append)
+    monkeypatch.setattr(lambda_function, 'enable_analysis_cache', False)
+    monkeypatch.setattr(lambda_function, 'intent_classifier', None)
+    monkeypatch.setattr(lambda_function, 'bedrock', fake)
+    monkeypatch.setattr(lambda_function, 'extract_email_content', lambda event, deadline=None: "Car loan, call 555 0100")
+    monkeypatch.setattr(lambda_function, 'detect_language', lambda text, deadline=None: 'en')
+
+    response = lambda_function.lambda_handler(event, None)
+
+    assert response == {
+        'intent1': 'Car loan request',
+        'pii_detected': 'true',
+        'user_intent': 'Car loan request',
+        'phone_number': '555 0100',
+        'email_address': '',
+        'name': '',
+        'address': '',
+        'account_number': '12345',
+        'language': 'en',
+        'other_pii': 'DOB 1980-01-01,SSN'
+    }
+    assert fake.requests[0]['max_tokens'] == lambda_function.bedrock_max_tokens
+    assert records[-1]['bedrock_input_tokens'] == 412
+    assert records[-1]['bedrock_output_tokens'] == 23
+
+
+def test_full_field_names_are_still_accepted():
+    analysis = lambda_function.complete_analysis({"user_intent": "Home loan request", "pii_detected": False,
+                                                  "intents": ["Home loan request", "Rates"]})
+    assert analysis == {"user_intent": "Home loan request", "pii_detected": False,
+                        "intents": ["Home loan request", "Rates"], "extracted_info": {}}
@@ -0,0 +1,154 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import lambda_function
+from chunked_analysis import analyze_chunks, merge_analyses, split_chunks
+
+
+def analysis(intent, intents=None, pii=False, **info):
+    return {'user_intent': intent, 'intents': intents or [intent], 'pii_detected': pii, 'extracted_info': info}
+
+
+def test_chunks_end_at_sentences_and_fit_the_token_limit():
+    text = ' '.join(f"Sentence number {n} of the statement." for n in range(100))
+    chunks, dropped = split_chunks(text, chunk_tokens=50, max_chunks=100)
+
+    assert dropped == 0
+    assert all(len(chunk) <= 200 for chunk in chunks)
+    assert all(chunk.endswith('statement.') for chunk in chunks)
+    assert ' '.join(chunks) == text
+
+
+def test_text_without_sentences_is_cut_between_words_or_hard():
+    chunks, _ = split_chunks('word ' * 100, chunk_tokens=10, max_chunks=100)
+    assert all(len(chunk) <= 40 and not chunk.endswith('wor') for chunk in chunks)
+    chunks, _ = split_chunks('x' * 100, chunk_tokens=10, max_chunks=100)
+    assert [len(chunk) for chunk in chunks] == [40, 40, 20]
+
+
+def test_chunks_over_the_maximum_keep_the_opening_and_the_end():
+    text = ' '.join(f"Part {n}" + ' filler' * 5 + '.' for n in range(10))
+    chunks, dropped = split_chunks(text, chunk_tokens=12, max_chunks=3)
+
+    assert len(chunks) == 3
+    assert chunks[0].startswith('Part 0 ') and chunks[-1].startswith('Part 9 ')
+    assert dropped == 7 * len('Part 1' + ' filler' * 5 + '.')
+
+
+def test_primary_intent_is_the_opening_one_and_the_others_rank_by_chunk_count():
+    merged = merge_analyses([
+        analysis('Card dispute', ['Card dispute', 'Address change']),
+        analysis('Statement query'),
+        analysis('Statement query', ['Statement query', 'address change']),
+    ])
+    assert merged['user_intent'] == 'Card dispute'
+    # Both are named by two chunks; the address change comes first in the email
+    assert merged['intents'] == ['Card dispute', 'Address change', 'Statement query']
+
+    merged = merge_analyses([analysis('Card dispute'), analysis('Statement query'), analysis('Fees'),
+                             analysis('Statement query')])
+    assert merged['intents'] == ['Card dispute', 'Statement query', 'Fees']
+
+
+def test_pii_is_merged_in_email_order():
+    merged = merge_analyses([
+        analysis('Card dispute', pii=False),
+        analysis('Card dispute', pii=True, name='Sam Lee', other_pii=['DOB 1 May']),
+        analysis('Card dispute', pii=True, name='S. Lee', phone_number='555 0100', other_pii=['dob 1 may', 'IBAN']),
+    ])
+    assert merged['pii_detected'] is True
+    assert merged['extracted_info'] == {'name': 'Sam Lee', 'phone_number': '555 0100',
+                                        'other_pii': ['DOB 1 May', 'IBAN']}
+
+
+def test_merge_does_not_depend_on_which_chunk_finishes_first():
+    intents = ['Statement query', 'Card dispute', 'Card dispute', 'Address change']
+
+    def analyze(chunk, timeout):
+        index = int(chunk)
+        # Later chunks finish first
+        time.sleep(0.02 * (len(intents) - index))
+        return {"success": True, "data": analysis(intents[index], name=f"name {index}"),
+                "usage": {'input_tokens': 10}}
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        result = analyze_chunks(analyze, ['0', '1', '2', '3'], executor, timeout=5)
+
+    assert result['data']['user_intent'] == 'Statement query'
+    assert result['data']['intents'] == ['Statement query', 'Card dispute', 'Address change']
+    assert result['data']['extracted_info'] == {'name': 'name 0'}
+    assert result['usage'] == {'input_tokens': 40}
+    assert 'degradation' not in result
+
+
+def test_failed_chunks_degrade_the_merge_or_the_whole_analysis():
+    def analyze(chunk, timeout):
+        if chunk == 'bad':
+            return {"success": False, "data": "CircuitOpen: bedrock", "degradation": "bedrock_circuit_open"}
+        return {"success": True, "data": analysis('Card dispute')}
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        partial = analyze_chunks(analyze, ['good', 'bad'], executor)
+        failed = analyze_chunks(analyze, ['bad', 'bad'], executor)
+
+    assert partial['success'] and partial['degradation'] == 'bedrock_chunks_failed' and partial['failed'] == 1
+    assert not failed['success'] and failed['degradation'] == 'bedrock_circuit_open'
+
+
+def test_chunk_cut_short_degrades_the_merge():
+    def analyze(chunk, timeout):
+        result = {"success": True, "data": analysis('Card dispute')}
+        if chunk == 'cut':
+            result['degradation'] = 'bedrock_partial'
+        return result
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        merged = analyze_chunks(analyze, ['good', 'cut'], executor)
+
+    assert merged['success'] and merged['degradation'] == 'bedrock_partial' and merged['failed'] == 0
+
+
+def test_long_email_is_analyzed_in_concurrent_chunks(monkeypatch, event, context):
+    calls = []
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def call_bedrock(client, model_id, instruction, email_content, timeout=None):
+        with lock:
+            calls.append(email_content)
+            running.append(1)
+            peak.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.pop()
+        intent = 'Card dispute' if 'dispute' in email_content else 'Statement query'
+        return {"success": True, "data": analysis(intent, pii='555' in email_content,
+                                                  **({'phone_number': '555 0100'} if '555' in email_content else {}))}
+
+    monkeypatch.setattr(lambda_function, 'long_input_mode', True)
+    monkeypatch.setattr(lambda_function, 'long_input_threshold_tokens', 100)
+    monkeypatch.setattr(lambda_function, 'chunk_tokens', 100)
+    monkeypatch.setattr(lambda_function, 'chunk_executor', ThreadPoolExecutor(max_workers=4))
+    monkeypatch.setattr(lambda_function, 'call_bedrock', call_bedrock)
+    monkeypatch.setattr(lambda_function, 'enable_analysis_cache', False)
+    monkeypatch.setattr(lambda_function, 'intent_classifier', None)
+    monkeypatch.setattr(lambda_function, 'detect_language', lambda text, deadline=None: 'en')
+
+    email = ("I want to dispute a card payment. " * 12 + "Call me on 555 0100. " +
+             "The statement lists these lines. " * 30 + "Please look into the dispute soon.")
+    monkeypatch.setattr(lambda_function, 'extract_email_content', lambda event, deadline=None: email)
+    response = lambda_function.lambda_handler(event, context)
+
+    assert len(calls) == 4 and max(peak) > 1
+    assert response['user_intent'] == 'Card dispute'
+    assert response['intent1'] == 'Card dispute'
+    assert response['pii_detected'] == 'true' and response['phone_number'] == '555 0100'
+    assert 'degraded' not in response
+
+    calls.clear()
+    monkeypatch.setattr(lambda_function, 'extract_email_content',
+                        lambda event, deadline=None: "I want to dispute a card payment.")
+    lambda_function.lambda_handler(event, context)
+    assert calls == ["I want to dispute a card payment."]
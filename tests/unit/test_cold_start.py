@@ -0,0 +1,38 @@
+import json
+import os
+import subprocess
+import sys
+
+from aws_clients import LazyClient
+
+LAMBDA_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'lambda')
+
+PROBE = """
+import json, sys
+import lambda_function
+print(json.dumps({
+    'modules': sorted(name for name in ('boto3', 'botocore', 'email.mime', 's3transfer') if name in sys.modules),
+    'clients': [name for name in ('connectClient', 's3Client', 'bedrock', 'comprehend')
+                if getattr(lambda_function, name).created],
+}))
+"""
+
+
+def run_python(*args):
+    env = dict(os.environ, AWS_DEFAULT_REGION='us-east-1', PYTHONDONTWRITEBYTECODE='1')
+    return subprocess.run([sys.executable, *args], cwd=os.path.abspath(LAMBDA_DIR), env=env,
+                          capture_output=True, text=True, check=True)
+
+
+def test_import_creates_no_clients_and_skips_unused_modules():
+    result = json.loads(run_python('-c', PROBE).stdout)
+    assert result == {'modules': [], 'clients': []}
+
+
+def test_lazy_client_is_created_once_on_first_use():
+    client = LazyClient('comprehend', region_name='us-east-1')
+    assert not client.created
+
+    assert client.meta.service_model.service_name == 'comprehend'
+    assert client.created
+    assert client.get() is client.get()
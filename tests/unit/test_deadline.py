@@ -0,0 +1,144 @@
+import time
+
+import boto3
+from botocore.config import Config
+
+import lambda_function
+from aws_clients import LazyClient
+from deadline import BudgetedClients, Deadline
+
+
+def test_budget_is_the_shorter_of_flow_and_lambda_time(make_context, clock):
+    deadline = Deadline.from_context(make_context(30000), flow_budget=8, margin=0.5, clock=clock)
+    assert deadline.remaining() == 7.5
+    assert Deadline.from_context(make_context(3000), 8, 0.5, clock).remaining() == 2.5
+    assert Deadline.from_context(None, 8, 0.5, clock).remaining() == 7.5
+
+    clock.now += 6
+    assert deadline.timeout(7) == 1.5 and deadline.timeout(1) == 1
+    assert deadline.allows(1) and not deadline.allows(2)
+    clock.now += 10
+    assert deadline.remaining() == 0
+
+    deadline.degrade('language_skipped')
+    deadline.degrade('language_skipped')
+    assert deadline.degradations == ['language_skipped']
+
+
+def test_client_copies_get_tighter_timeouts_and_are_reused():
+    clients = BudgetedClients(step=0.5)
+    client = boto3.client('comprehend', region_name='us-east-1')
+    assert clients.get(client, 5, 2) is client
+
+    copy = clients.get(client, 1.7, 2)
+    assert copy is not client
+    assert copy.meta.config.read_timeout == 1.5
+    assert copy.meta.config.retries['total_max_attempts'] == 1
+    assert copy.meta.region_name == client.meta.region_name
+    assert clients.get(client, 1.9, 2) is copy
+    assert clients.get(client, 0.1, 2).meta.config.read_timeout == 0.5
+
+
+def test_stage_clients_time_out_at_the_stage_limits(monkeypatch):
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    for client, limit in ((lambda_function.bedrock, lambda_function.bedrock_stage_timeout),
+                          (lambda_function.comprehend, lambda_function.language_stage_timeout)):
+        config = LazyClient(client.service_name, **client._kwargs).meta.config
+        assert config.read_timeout == limit and config.connect_timeout == limit
+        assert config.retries['total_max_attempts'] == 1
+
+
+def test_longer_asynchronous_limit_gets_a_copy_with_a_longer_timeout():
+    clients = BudgetedClients(step=0.5)
+    client = boto3.client('bedrock-runtime', region_name='us-east-1',
+                          config=Config(read_timeout=7, connect_timeout=7))
+
+    assert clients.get(client, 30, 7) is client
+    copy = clients.get(client, 59, 59)
+    assert copy.meta.config.read_timeout == 59 and copy.meta.config.connect_timeout == 7
+
+
+def use_handler_fakes(monkeypatch, call_bedrock):
+    monkeypatch.setattr(lambda_function, 'enable_analysis_cache', False)
+    monkeypatch.setattr(lambda_function, 'intent_classifier', None)
+    monkeypatch.setattr(lambda_function, 'language_detector', 'comprehend')
+    monkeypatch.setattr(lambda_function, 'language_identifier', None)
+    monkeypatch.setattr(lambda_function, 'extract_email_content',
+                        lambda event, deadline=None: "Call me on 555 010 3000 about my account")
+    monkeypatch.setattr(lambda_function, 'call_bedrock', call_bedrock)
+
+
+def test_short_budget_skips_optional_stages_and_routes_to_unknown(monkeypatch, event, make_context):
+    def fail_bedrock(*args):
+        raise AssertionError("Bedrock should not be called")
+    use_handler_fakes(monkeypatch, fail_bedrock)
+
+    response = lambda_function.lambda_handler(event, make_context(1200))
+
+    assert response['user_intent'] == 'Unknown'
+    assert response['pii_detected'] == 'true'
+    assert response['language'] == lambda_function.default_language
+    assert response['degraded'] == 'language_skipped,bedrock_skipped'
+
+
+def test_slow_bedrock_is_cut_to_the_remaining_budget(monkeypatch, event, make_context):
+    timeouts = []
+
+    def slow_bedrock(client, model_id, instruction, email_content, timeout=None):
+        timeouts.append(timeout)
+        time.sleep(2)
+        return {"success": True, "data": {}}
+    use_handler_fakes(monkeypatch, slow_bedrock)
+    monkeypatch.setattr(lambda_function, 'flow_time_budget', 1.5)
+    monkeypatch.setattr(lambda_function, 'min_bedrock_budget', 0.5)
+    monkeypatch.setattr(lambda_function, 'detect_language', lambda text, deadline=None: 'fr')
+
+    started = time.monotonic()
+    response = lambda_function.lambda_handler(event, make_context(30000))
+
+    assert time.monotonic() - started < 1.5
+    assert timeouts[0] <= 1.0
+    assert response['user_intent'] == 'Unknown'
+    assert response['language'] == 'fr'
+    assert response['degraded'] == 'bedrock_timeout'
+
+
+def test_failed_analysis_returns_error_without_fallback(monkeypatch, event, make_context):
+    use_handler_fakes(monkeypatch, lambda *args: {"success": False, "data": "AccessDenied"})
+    monkeypatch.setattr(lambda_function, 'detect_language', lambda text, deadline=None: 'en')
+    monkeypatch.setattr(lambda_function, 'degraded_fallback', False)
+
+    assert 'error' in lambda_function.lambda_handler(event, make_context(30000))
+
+
+def test_asynchronous_flow_budget_goes_to_the_analysis(monkeypatch, event, make_context):
+    timeouts = []
+
+    def slow_bedrock(client, model_id, instruction, email_content, timeout=None):
+        timeouts.append(timeout)
+        time.sleep(0.2)
+        return {"success": True, "data": {'user_intent': 'Account query', 'intents': [], 'pii_detected': True,
+                                          'extracted_info': {'phone_number': '555 010 3000'}}}
+    class FakeConnect:
+        def update_contact_attributes(self, **request):
+            updates.append(request)
+    updates = []
+    use_handler_fakes(monkeypatch, slow_bedrock)
+    monkeypatch.setattr(lambda_function, 'detect_language', lambda text, deadline=None: 'en')
+    monkeypatch.setattr(lambda_function, 'connectClient', FakeConnect())
+    async_event = {"Details": dict(event["Details"], Parameters={"flow_time_budget": "60"})}
+
+    response = lambda_function.lambda_handler(async_event, make_context(65000))
+
+    # 7 seconds of the stage's own limit, plus the 52 the asynchronous flow waits beyond 8
+    assert timeouts[0] == lambda_function.bedrock_stage_timeout + 52
+    assert response['user_intent'] == 'Account query' and 'degraded' not in response
+    # The flow validates the response as a STRING_MAP
+    assert all(isinstance(value, str) for value in response.values())
+    assert lambda_function.invocation_budget(event) == lambda_function.flow_time_budget
+    # The asynchronous flow routes on the contact attributes the Lambda sets
+    assert updates == [{'InitialContactId': 'contact-1', 'InstanceId': 'abc', 'Attributes': {
+        'pii': 'true', 'intent': 'Account query', 'phone_number': '555 010 3000', 'account_number': '',
+        'language': 'en'}}]
+    lambda_function.lambda_handler(event, make_context(30000))
+    assert len(updates) == 1
@@ -1,15 +1,330 @@
+import json
+import os
+import shutil
+
 import aws_cdk as core
 import aws_cdk.assertions as assertions
+import pytest
+from dotenv import dotenv_values
+
+from email_automation import contact_flow
+from email_automation.email_automation_stack import INTENT_INDEX_REQUIREMENTS, LAYER_REQUIREMENTS, EmailAutomationStack
+
+ROOT_DIR = os.path.join(os.path.dirname(__file__), '..', '..')
+
+
+@pytest.fixture(autouse=True)
+def stack_environment(monkeypatch, tmp_path):
+    # Asset paths in the stack are relative to the project root
+    monkeypatch.chdir(ROOT_DIR)
+    for name, value in {
+        'CONNECT_BUCKET': 'connect-bucket',
+        'INSTANCE_NAME': 'instance',
+        'CONNECT_INSTANCE_ARN': 'arn:aws:connect:us-east-1:111122223333:instance/test',
+        'HOURS_OF_OPERATION_ARN': 'arn:aws:connect:us-east-1:111122223333:instance/test/operating-hours/hours',
+    }.items():
+        monkeypatch.setenv(name, value)
+    # No pip install in unit tests: the layer is an empty directory, and the platform it was asked for is kept
+    platforms = []
+
+    def build_layer(self, platform='manylinux2014_x86_64', requirements=LAYER_REQUIREMENTS):
+        platforms.append(platform)
+        return str(tmp_path)
+
+    monkeypatch.setattr(EmailAutomationStack, 'build_layer', build_layer)
+    return platforms
+
+
+def make_stack(**context):
+    # Context takes precedence over the .env file, so the tests do not depend on it
+    defaults = {
+        'LAMBDA_ARCHITECTURE': 'x86_64',
+        'LAMBDA_MEMORY_SIZE': '256',
+        'LAMBDA_RESERVED_CONCURRENCY': '',
+        'PROVISIONED_CONCURRENCY': '0',
+        'PROVISIONED_CONCURRENCY_MAX': '',
+        'PROVISIONED_UTILIZATION_TARGET': '',
+        'PROVISIONED_SURGE_START': '',
+        'PROVISIONED_SURGE_END': '',
+        'PROVISIONED_SURGE_CONCURRENCY': '',
+        'BEDROCK_RPM': '',
+        'BEDROCK_TPM': '',
+        'FLOW_INVOCATION_MODE': 'sync',
+        'FLOW_ASYNC_TIME_LIMIT': '',
+        'ENABLE_RESULT_LOG': 'false',
+        'ENABLE_INTENT_INDEX': 'false',
+        'LANGUAGE_DETECTOR': 'auto',
+        'ENABLE_SHARED_ANALYSIS_CACHE': 'false',
+        'ENABLE_BACKFILL': 'false',
+        'BACKFILL_MAX_CONCURRENCY': '',
+    }
+    app = core.App(context=dict(defaults, **context))
+    return EmailAutomationStack(app, "EmailAutomation")
+
+
+def synth(**context):
+    return assertions.Template.from_stack(make_stack(**context))
+
+
+def flow_lambda_arn(template):
+    flow = next(iter(template.find_resources("AWS::Connect::ContactFlow").values()))
+    # The content is a Fn::Join of the flow JSON around the CloudFormation references
+    parts = flow['Properties']['Content']['Fn::Join'][1]
+    marker = '"LambdaFunctionARN": "'
+    index = next(i for i, part in enumerate(parts) if isinstance(part, str) and part.endswith(marker))
+    return parts[index + 1]
+
+
+def flow_content(template):
+    """The flow, with each CloudFormation reference replaced by its logical ID"""
+    flow = next(iter(template.find_resources("AWS::Connect::ContactFlow").values()))
+    parts = flow['Properties']['Content']['Fn::Join'][1]
+    return json.loads(''.join(part if isinstance(part, str) else (part.get('Ref') or part['Fn::GetAtt'][0])
+                              for part in parts))
+
+
+def flow_actions(template):
+    """The flow's actions by type, with each CloudFormation reference replaced by its logical ID"""
+    actions = {}
+    for action in flow_content(template)['Actions']:
+        actions.setdefault(action['Type'], []).append(action)
+    return actions
 
-from email_automation.email_automation_stack import EmailAutomationStack
 
-# example tests. To run these tests, uncomment this file along with the example
-# resource in email_automation/email_automation_stack.py
 def test_sqs_queue_created():
-    app = core.App()
-    stack = EmailAutomationStack(app, "email_automation")
-    template = assertions.Template.from_stack(stack)
+    template = synth()
+    template.resource_count_is("AWS::SQS::Queue", 0)
+
+
+def test_default_capacity_keeps_x86_and_256_mb(stack_environment):
+    template = synth()
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "Handler": "lambda_function.lambda_handler",
+        "Architectures": ["x86_64"],
+        "MemorySize": 256,
+        "ReservedConcurrentExecutions": assertions.Match.absent(),
+    })
+    template.has_resource_properties("AWS::Lambda::Alias", {
+        "Name": "live",
+        "ProvisionedConcurrencyConfig": assertions.Match.absent(),
+    })
+    template.resource_count_is("AWS::ApplicationAutoScaling::ScalableTarget", 0)
+    assert stack_environment == ['manylinux2014_x86_64']
+
+
+def test_env_file_keeps_the_default_capacity():
+    settings = dotenv_values(os.path.join(ROOT_DIR, '.env'))
+    assert settings.get('LAMBDA_ARCHITECTURE') in (None, '', 'x86_64')
+    assert settings.get('LAMBDA_MEMORY_SIZE') in (None, '', '256')
+
+
+def test_env_file_leaves_the_result_log_off():
+    assert dotenv_values(os.path.join(ROOT_DIR, '.env')).get('ENABLE_RESULT_LOG') in (None, '', 'false')
+
+
+def test_arm64_memory_and_reserved_concurrency(stack_environment):
+    template = synth(LAMBDA_ARCHITECTURE='arm64', LAMBDA_MEMORY_SIZE='1024', LAMBDA_RESERVED_CONCURRENCY='20')
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "Handler": "lambda_function.lambda_handler",
+        "Architectures": ["arm64"],
+        "MemorySize": 1024,
+        "ReservedConcurrentExecutions": 20,
+    })
+    template.has_resource_properties("AWS::Lambda::LayerVersion", {"CompatibleArchitectures": ["arm64"]})
+    assert stack_environment == ['manylinux2014_aarch64']
+
+
+def test_backfill_function_uses_the_layer_architecture(stack_environment):
+    template = synth(LAMBDA_ARCHITECTURE='arm64', ENABLE_BACKFILL='true')
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "Handler": "backfill.sqs_handler",
+        "Architectures": ["arm64"],
+    })
+    template.has_resource_properties("AWS::Lambda::LayerVersion", {"CompatibleArchitectures": ["arm64"]})
+    assert stack_environment == ['manylinux2014_aarch64']
+
+
+def test_feature_switches_can_be_set_as_context():
+    template = synth(LANGUAGE_DETECTOR='bedrock', ENABLE_SHARED_ANALYSIS_CACHE='true', ENABLE_BACKFILL='true',
+                     BACKFILL_MAX_CONCURRENCY='5')
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "Environment": {"Variables": assertions.Match.object_like({
+            "LANGUAGE_DETECTOR": "bedrock",
+            "ANALYSIS_CACHE_TABLE": {"Ref": assertions.Match.any_value()},
+        })},
+    })
+    template.has_resource_properties("AWS::Lambda::EventSourceMapping", {
+        "ScalingConfig": {"MaximumConcurrency": 5},
+    })
+
+
+def test_provisioned_concurrency_with_utilization_and_schedule_scaling():
+    template = synth(
+        PROVISIONED_CONCURRENCY='2',
+        PROVISIONED_CONCURRENCY_MAX='10',
+        PROVISIONED_SURGE_START='cron(45 7 ? * MON-FRI *)',
+        PROVISIONED_SURGE_END='cron(0 11 ? * MON-FRI *)',
+        PROVISIONED_SURGE_CONCURRENCY='8',
+        PROVISIONED_SURGE_TIME_ZONE='Europe/London',
+    )
+    template.has_resource_properties("AWS::Lambda::Alias", {
+        "Name": "live",
+        "ProvisionedConcurrencyConfig": {"ProvisionedConcurrentExecutions": 2},
+    })
+    template.has_resource_properties("AWS::ApplicationAutoScaling::ScalableTarget", {
+        "MinCapacity": 2,
+        "MaxCapacity": 10,
+        "ScalableDimension": "lambda:function:ProvisionedConcurrency",
+        "ScheduledActions": [
+            {"ScheduledActionName": "SurgeStart", "Schedule": "cron(45 7 ? * MON-FRI *)",
+             "ScalableTargetAction": {"MinCapacity": 8}, "Timezone": "Europe/London"},
+            {"ScheduledActionName": "SurgeEnd", "Schedule": "cron(0 11 ? * MON-FRI *)",
+             "ScalableTargetAction": {"MinCapacity": 2}, "Timezone": "Europe/London"},
+        ],
+    })
+    template.has_resource_properties("AWS::ApplicationAutoScaling::ScalingPolicy", {
+        "PolicyType": "TargetTrackingScaling",
+        "TargetTrackingScalingPolicyConfiguration": assertions.Match.object_like({
+            "TargetValue": 0.7,
+            "PredefinedMetricSpecification": {"PredefinedMetricType": "LambdaProvisionedConcurrencyUtilization"},
+        }),
+    })
+
+
+def test_schedule_only_scaling_has_no_utilization_policy():
+    template = synth(PROVISIONED_CONCURRENCY='1', PROVISIONED_CONCURRENCY_MAX='5',
+                     PROVISIONED_UTILIZATION_TARGET='0', PROVISIONED_SURGE_START='cron(45 7 ? * MON-FRI *)')
+    template.resource_count_is("AWS::ApplicationAutoScaling::ScalableTarget", 1)
+    template.resource_count_is("AWS::ApplicationAutoScaling::ScalingPolicy", 0)
+
+
+def test_flow_invokes_and_connect_is_associated_with_the_alias():
+    template = synth(PROVISIONED_CONCURRENCY='2')
+    alias_id = next(iter(template.find_resources("AWS::Lambda::Alias")))
+    assert flow_lambda_arn(template) == {"Ref": alias_id}
+    template.has_resource_properties("AWS::Connect::IntegrationAssociation", {
+        "IntegrationType": "LAMBDA_FUNCTION",
+        "IntegrationArn": {"Ref": alias_id},
+    })
+
+
+def test_bedrock_quotas_add_a_shared_admission_table():
+    synth().resource_count_is("AWS::DynamoDB::Table", 0)
+
+    template = synth(BEDROCK_RPM='400', BEDROCK_TPM='300000')
+    template.has_resource_properties("AWS::DynamoDB::Table", {
+        "KeySchema": [{"AttributeName": "bucket", "KeyType": "HASH"}],
+    })
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "Handler": "lambda_function.lambda_handler",
+        "Environment": {"Variables": assertions.Match.object_like({
+            "BEDROCK_RPM": "400",
+            "BEDROCK_TPM": "300000",
+            "ADMISSION_TABLE": {"Ref": assertions.Match.any_value()},
+        })},
+    })
+
+
+def test_synchronous_flow_routes_on_the_lambda_response():
+    template = synth()
+    actions = flow_actions(template)
+    invoke = actions['InvokeLambdaFunction'][0]
+    assert invoke['Parameters']['InvocationTimeLimitSeconds'] == '8'
+    assert 'InvocationType' not in invoke['Parameters']
+    assert 'Wait' not in actions
+    assert invoke['Transitions']['NextAction'] == actions['UpdateContactAttributes'][-1]['Identifier']
+    assert {action['Parameters']['QueueId'] for action in actions['UpdateContactTargetQueue']} == {
+        'QueueHomeEquity', 'QueueCarLoan', 'QueueHomeLoan', 'QueueUnknown'}
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "Handler": "lambda_function.lambda_handler",
+        "Timeout": 30,
+    })
+
+
+def test_asynchronous_mode_is_flagged_as_experimental():
+    warning = assertions.Match.string_like_regexp("FLOW_INVOCATION_MODE=async is experimental")
+    assertions.Annotations.from_stack(make_stack(FLOW_INVOCATION_MODE='async')).has_warning('*', warning)
+    assertions.Annotations.from_stack(make_stack()).has_no_warning('*', warning)
+
+
+def test_asynchronous_flow_waits_for_the_lambda_result():
+    template = synth(FLOW_INVOCATION_MODE='async', FLOW_ASYNC_TIME_LIMIT='45')
+    actions = flow_actions(template)
+    invoke = actions['InvokeLambdaFunction'][0]
+    assert invoke['Parameters']['InvocationType'] == 'ASYNCHRONOUS'
+    assert invoke['Parameters']['InvocationTimeLimitSeconds'] == '45'
+    assert invoke['Parameters']['LambdaInvocationAttributes'] == {'flow_time_budget': '45'}
+    wait = actions['Wait'][0]
+    assert invoke['Transitions']['NextAction'] == wait['Identifier']
+    assert wait['Parameters']['TimeoutSeconds'] == '45'
+    # Routing continues from the attributes the Lambda sets; a failed or timed-out invocation goes to the
+    # error message
+    routing = next(action for action in actions['Compare'] if action['Identifier'] == wait['Transitions']['NextAction'])
+    assert routing['Parameters']['ComparisonValue'] == '$.Attributes.pii'
+    assert '$.External' not in json.dumps(actions)
+    assert {error['NextAction'] for error in wait['Transitions']['Errors']} == {
+        actions['MessageParticipant'][0]['Identifier']}
+    # The stack changes nothing else of the flow file
+    expected = contact_flow.set_async_time_limit(contact_flow.load_flow(contact_flow.ASYNC_FLOW_PATH), 45)
+    contact_flow.resolve_references(expected, {name: f"Queue{name}" for name in
+                                               ('HomeEquity', 'CarLoan', 'HomeLoan', 'Unknown')},
+                                    invoke['Parameters']['LambdaFunctionARN'])
+    assert flow_content(template) == expected
+    assert {action['Parameters']['QueueId'] for action in actions['UpdateContactTargetQueue']} == {
+        'QueueHomeEquity', 'QueueCarLoan', 'QueueHomeLoan', 'QueueUnknown'}
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "Handler": "lambda_function.lambda_handler",
+        "Timeout": 50,
+    })
+
+
+def test_result_log_can_write_to_the_results_prefix_only():
+    def result_log_policy(template):
+        return [statement for policy in template.find_resources("AWS::IAM::Policy").values()
+                for statement in policy['Properties']['PolicyDocument']['Statement']
+                if statement['Resource'] == "arn:aws:s3:::connect-bucket/results/*"]
+
+    assert result_log_policy(synth()) == []
+    template = synth(ENABLE_RESULT_LOG='true')
+    assert [statement['Action'] for statement in result_log_policy(template)] == ['s3:PutObject']
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "Handler": "lambda_function.lambda_handler",
+        "Environment": {"Variables": assertions.Match.object_like({"RESULT_LOG": "true"})},
+    })
+
+
+def test_intent_index_adds_numpy_to_the_layer(monkeypatch, tmp_path):
+    requirements = []
+
+    def build_layer(self, platform='manylinux2014_x86_64', layer_requirements=LAYER_REQUIREMENTS):
+        requirements.append(layer_requirements)
+        return str(tmp_path)
+
+    monkeypatch.setattr(EmailAutomationStack, 'build_layer', build_layer)
+    index_dir = os.path.join('lambda', 'test_intent_index')
+    os.makedirs(index_dir)
+    try:
+        with open(os.path.join(index_dir, 'index.json'), 'w') as f:
+            f.write('{}')
+        template = synth(ENABLE_INTENT_INDEX='true', INTENT_INDEX_DIR='test_intent_index')
+    finally:
+        shutil.rmtree(index_dir)
+
+    assert requirements == [LAYER_REQUIREMENTS + INTENT_INDEX_REQUIREMENTS]
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "Handler": "lambda_function.lambda_handler",
+        "Environment": {"Variables": assertions.Match.object_like({"INTENT_INDEX_DIR": "test_intent_index"})},
+    })
+
 
-#     template.has_resource_properties("AWS::SQS::Queue", {
-#         "VisibilityTimeout": 300
-#     })
+@pytest.mark.parametrize('context', [
+    {'ENABLE_INTENT_INDEX': 'true', 'INTENT_INDEX_DIR': 'no_such_index'},
+    {'LAMBDA_ARCHITECTURE': 'sparc'},
+    {'FLOW_INVOCATION_MODE': 'callback'},
+    {'FLOW_INVOCATION_MODE': 'async', 'FLOW_ASYNC_TIME_LIMIT': '90'},
+    {'PROVISIONED_CONCURRENCY': '5', 'PROVISIONED_CONCURRENCY_MAX': '2'},
+    {'PROVISIONED_CONCURRENCY': '5', 'LAMBDA_RESERVED_CONCURRENCY': '4'},
+])
+def test_invalid_capacity_settings_are_rejected(context):
+    with pytest.raises(ValueError):
+        synth(**context)
@@ -0,0 +1,88 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from email_fetch import JsonContentExtractor, fetch_email_content, make_pool
+from html_normalizer import HtmlTextNormalizer
+
+
+def extract(document, chunk_size, max_chars=None):
+    extractor = JsonContentExtractor(lambda: HtmlTextNormalizer(max_chars))
+    for start in range(0, len(document), chunk_size):
+        if not extractor.feed(document[start:start + chunk_size]):
+            break
+    return extractor.close()
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 7, 4096])
+def test_extracts_content_field_across_chunk_boundaries(chunk_size):
+    document = json.dumps({
+        "id": "x\\\"y",
+        "attachments": [{"name": "a\"}]", "size": 3}],
+        "messageContent": "<p>Café \"loan\" \U0001F600 &amp; more</p>"
+    })
+    assert extract(document, chunk_size) == 'Café "loan" \U0001F600 & more'
+
+
+def test_field_priority_matches_legacy_or_chain():
+    assert extract(json.dumps({"body": "from body", "messageContent": ""}), 5) == "from body"
+    assert extract(json.dumps({"text": "from text", "content": "from content"}), 5) == "from content"
+    assert extract(json.dumps({"message": 42}), 5) == "42"
+    with pytest.raises(ValueError):
+        extract(json.dumps({"subject": "no body"}), 5)
+
+
+def test_stops_reading_once_preferred_field_fills_the_cap():
+    document = json.dumps({"messageContent": "word " * 10000, "tail": "never read"})
+    extractor = JsonContentExtractor(lambda: HtmlTextNormalizer(100))
+    assert extractor.feed(document[:2000]) is False
+    assert 90 < len(extractor.close()) <= 100
+
+
+class EmailServer:
+    def __init__(self, payload):
+        self.payload = payload
+        self.connections = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                server.connections += 1
+                super().setup()
+
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(server.payload)))
+                self.end_headers()
+                self.wfile.write(server.payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/email.json"
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def test_fetch_reuses_connection_and_enforces_size_limit():
+    server = EmailServer(json.dumps({"messageContent": "<b>I need a car loan</b>"}).encode())
+    try:
+        pool = make_pool(connect_timeout=1, read_timeout=1)
+        for _ in range(3):
+            text, received = fetch_email_content(pool, server.url, HtmlTextNormalizer, max_bytes=1024)
+            assert text == "I need a car loan"
+            assert received == len(server.payload)
+        assert server.connections == 1
+
+        with pytest.raises(ValueError):
+            fetch_email_content(pool, server.url, HtmlTextNormalizer, max_bytes=10)
+    finally:
+        server.close()
@@ -0,0 +1,82 @@
+import io
+import json
+import threading
+
+import lambda_function
+from emf_metrics import InvocationMetrics
+
+
+class FakeBedrock:
+    def invoke_model(self, body, **kwargs):
+        text = json.dumps({"intents": ["Car loan request"], "pii_detected": False,
+                           "extracted_info": {}, "user_intent": "Car loan request"})
+        return {'body': io.BytesIO(json.dumps({"content": [{"text": text}]}).encode())}
+
+
+def test_one_emf_record_per_invocation_with_cold_start_flag():
+    records = []
+    metrics = InvocationMetrics(namespace='Test', dimensions={'function_name': 'fn'}, writer=records.append)
+
+    @metrics.handler
+    def handler(event, context):
+        with metrics.stage('work') as put_metric:
+            put_metric('payload_bytes', 12, 'Bytes')
+        return {}
+
+    handler({}, None)
+    handler({}, None)
+
+    assert len(records) == 2
+    first, second = records
+    directive = first['_aws']['CloudWatchMetrics'][0]
+    assert directive['Namespace'] == 'Test'
+    assert directive['Dimensions'] == [['function_name']]
+    assert {m['Name'] for m in directive['Metrics']} == {'cold_start', 'error', 'payload_bytes', 'total_ms', 'work_ms'}
+    assert first['function_name'] == 'fn'
+    assert first['payload_bytes'] == 12
+    assert first['cold_start'] == 1 and second['cold_start'] == 0
+    assert first['work_ms'] <= first['total_ms']
+
+
+def test_late_stage_does_not_leak_into_next_invocation():
+    records = []
+    metrics = InvocationMetrics(writer=records.append)
+    release = threading.Event()
+
+    def late_stage():
+        with metrics.stage('late'):
+            release.wait(2)
+
+    metrics.start_invocation()
+    worker = threading.Thread(target=late_stage)
+    worker.start()
+    metrics.flush()
+    metrics.start_invocation()
+    release.set()
+    worker.join()
+    metrics.flush()
+
+    assert all('late_ms' not in record for record in records)
+
+
+def test_handler_reports_stage_timings_and_sizes(monkeypatch, event):
+    records = []
+    monkeypatch.setattr(lambda_function.metrics, 'writer', records.append)
+    monkeypatch.setattr(lambda_function, 'analysis_cache', None)
+    monkeypatch.setattr(lambda_function, 'enable_analysis_cache', False)
+    monkeypatch.setattr(lambda_function, 'intent_classifier', None)
+    monkeypatch.setattr(lambda_function, 'bedrock', FakeBedrock())
+    monkeypatch.setattr(lambda_function, 'extract_email_content', lambda event, deadline=None: "Quote for a vehicle please")
+    monkeypatch.setattr(lambda_function, 'detect_language', lambda text, deadline=None: 'en')
+
+    response = lambda_function.lambda_handler(event, None)
+
+    assert response['user_intent'] == "Car loan request"
+    record = records[-1]
+    assert record['contact_id'] == 'contact-1'
+    assert record['error'] == 0
+    assert record['body_chars'] == len("Quote for a vehicle please")
+    assert record['bedrock_request_bytes'] > record['body_chars']
+    assert record['bedrock_response_bytes'] > 0
+    for stage in ('extract', 'trim', 'bedrock', 'total'):
+        assert record[f'{stage}_ms'] >= 0
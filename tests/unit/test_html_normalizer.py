@@ -0,0 +1,45 @@
+import pytest
+
+import lambda_function
+from html_normalizer import HtmlTextNormalizer, normalize_html
+
+OUTLOOK_HTML = """<html><head><meta charset="utf-8"><style><!-- p.MsoNormal {margin:0in;} --></style>
+<title>Subject</title></head><body>
+<!--[if gte mso 9]><xml><o:shapedefaults v:ext="edit" /></xml><![endif]-->
+<div class="WordSection1"><p class="MsoNormal">Hello&nbsp;team,<o:p></o:p></p>
+<p>I&#8217;d like a <b>home equity</b> line&nbsp;of&nbsp;credit &amp; a quote.</p>
+<script>if (a < b) { alert('x'); }</script><br/>Thanks<img src="data:image/png;base64,iVBORw0KGgo=">
+</div></body></html>"""
+
+EXPECTED = "Hello team, I’d like a home equity line of credit & a quote. Thanks"
+
+
+def test_strips_markup_and_decodes_entities():
+    assert normalize_html(OUTLOOK_HTML) == EXPECTED
+
+
+@pytest.mark.parametrize("size", [1, 2, 5, 13, 64])
+def test_chunked_input_matches_whole_input(size):
+    chunks = (OUTLOOK_HTML[i:i + size] for i in range(0, len(OUTLOOK_HTML), size))
+    assert normalize_html(chunks) == EXPECTED
+
+
+def test_plain_text_is_kept():
+    assert normalize_html("Reply to <jo@example.com> if x <y\n\n  thanks") == \
+        "Reply to <jo@example.com> if x <y thanks"
+    assert normalize_html("one</p><p>two<span>three</span>") == "one twothree"
+
+
+def test_output_cap_stops_reading():
+    normalizer = HtmlTextNormalizer(max_chars=9)
+    assert normalizer.feed("<p>one two ") is True
+    assert normalizer.feed("three four</p>") is False
+    assert normalizer.feed("ignored") is False
+    assert normalizer.close() == "one two t"
+
+
+def test_process_body_uses_normalizer(monkeypatch):
+    monkeypatch.setattr(lambda_function, 'max_body_chars', 20)
+    assert lambda_function.process_body("<style>x{}</style><p>Hello   world</p>") == "Hello world"
+    assert lambda_function.process_body("a " * 50) == ("a " * 10).strip()
+    assert lambda_function.process_body(None) == ""
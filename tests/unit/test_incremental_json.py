@@ -0,0 +1,99 @@
+import json
+
+import pytest
+
+import lambda_function
+from analysis_cache import AnalysisCache, LRUTier
+from incremental_json import IncrementalObjectParser, parse_model_json
+
+ANALYSIS = {
+    "user_intent": "Car loan request",
+    "pii_detected": True,
+    "intents": ["Car  loan", "Rate \"question\" {x}"],
+    "extracted_info": {"phone_number": "555 0100", "other_pii": []}
+}
+
+
+def test_fields_complete_as_they_arrive():
+    text = "Here is the analysis:\n```json\n" + json.dumps(ANALYSIS, indent=2) + "\n```"
+    parser = IncrementalObjectParser()
+    completed = []
+    for start in range(0, len(text), 3):
+        completed += parser.feed(text[start:start + 3])
+        if completed == ['user_intent', 'pii_detected']:
+            assert 'intents' not in parser.fields
+    assert completed == list(ANALYSIS)
+    assert parser.fields == ANALYSIS
+    assert parser.complete
+
+
+def test_parse_model_json_keeps_string_whitespace_and_rejects_truncation():
+    assert parse_model_json("Sure! " + json.dumps(ANALYSIS) + " Let me know.")['intents'][0] == "Car  loan"
+    with pytest.raises(ValueError):
+        parse_model_json('{"user_intent": "Car loan request", "intents": ["a"')
+
+
+class FakeStream:
+    def __init__(self, text):
+        self.events = [{'type': 'content_block_delta', 'delta': {'type': 'text_delta', 'text': text[i:i + 5]}}
+                       for i in range(0, len(text), 5)] + [{'type': 'message_stop'}]
+        self.read = 0
+        self.closed = False
+
+    def __iter__(self):
+        for event in self.events:
+            self.read += 1
+            yield {'chunk': {'bytes': json.dumps(event).encode()}}
+
+    def close(self):
+        self.closed = True
+
+
+class FakeStreamingBedrock:
+    def __init__(self):
+        self.stream = FakeStream(json.dumps(ANALYSIS))
+
+    def invoke_model_with_response_stream(self, **kwargs):
+        return {'body': self.stream}
+
+
+def test_streaming_returns_early_once_routing_fields_are_known(monkeypatch):
+    monkeypatch.setattr(lambda_function, 'bedrock_streaming', True)
+    monkeypatch.setattr(lambda_function, 'bedrock_fill_timeout', 0.0)
+    client = FakeStreamingBedrock()
+
+    result = lambda_function.call_bedrock(client, lambda_function.model_id, lambda_function.instruction, "email")
+
+    assert result['success'] and result['degradation'] == 'bedrock_partial'
+    assert result['data']['user_intent'] == "Car loan request"
+    assert result['data']['pii_detected'] is True
+    assert result['data']['intents'] == ["Car loan request"] and result['data']['extracted_info'] == {}
+    assert client.stream.closed and client.stream.read < len(client.stream.events)
+
+
+def test_streaming_reads_everything_when_time_allows(monkeypatch):
+    monkeypatch.setattr(lambda_function, 'bedrock_streaming', True)
+    monkeypatch.setattr(lambda_function, 'bedrock_fill_timeout', 60.0)
+
+    result = lambda_function.call_bedrock(FakeStreamingBedrock(), lambda_function.model_id,
+                                          lambda_function.instruction, "email")
+
+    assert result == {"success": True, "data": ANALYSIS, "usage": {}}
+
+
+def test_partial_analysis_is_routed_but_not_cached(monkeypatch, event, context):
+    monkeypatch.setattr(lambda_function, 'bedrock_streaming', True)
+    monkeypatch.setattr(lambda_function, 'bedrock_fill_timeout', 0.0)
+    monkeypatch.setattr(lambda_function, 'enable_analysis_cache', True)
+    monkeypatch.setattr(lambda_function, 'analysis_cache', AnalysisCache(LRUTier()))
+    monkeypatch.setattr(lambda_function, 'intent_classifier', None)
+    monkeypatch.setattr(lambda_function, 'pii_extractor', None)
+    monkeypatch.setattr(lambda_function, 'detect_language', lambda text, deadline=None: 'en')
+    monkeypatch.setattr(lambda_function, 'extract_email_content',
+                        lambda event, deadline=None: "What documents do I need for a car loan?")
+    monkeypatch.setattr(lambda_function, 'bedrock', FakeStreamingBedrock())
+
+    response = lambda_function.lambda_handler(event, context)
+
+    assert response['user_intent'] == "Car loan request" and response['degraded'] == 'bedrock_partial'
+    assert len(lambda_function.analysis_cache.local) == 0
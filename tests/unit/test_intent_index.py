@@ -0,0 +1,93 @@
+import json
+import os
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+import lambda_function  # noqa: E402
+from intent_index import INTENT_LABELS, HashingVectorizer, IntentIndex, load_examples  # noqa: E402
+
+EXAMPLES = os.path.join(os.path.dirname(__file__), '..', '..', 'benchmarks', 'data', 'intent_examples.jsonl')
+TOY_EXAMPLES = [
+    {"text": "I need a loan to buy a used car", "intent": "CarLoan"},
+    {"text": "Financing for a new car from the dealer", "intent": "CarLoan"},
+    {"text": "We want a mortgage for our first house", "intent": "HomeLoan"},
+    {"text": "How much can we borrow to buy a house", "intent": "HomeLoan"},
+    {"text": "I lost my debit card", "intent": "Unknown"},
+]
+
+
+def split(name):
+    return [example for example in load_examples(EXAMPLES) if example['split'] == name]
+
+
+def test_hashing_vectorizer_is_stable_and_normalized():
+    vectorizer = HashingVectorizer(dims=64)
+    matrix = vectorizer(["Car loan please", "car LOAN please", ""])
+
+    assert matrix.dtype == np.float32 and matrix.shape == (3, 64)
+    assert np.allclose(matrix[0], matrix[1])
+    assert np.isclose(np.linalg.norm(matrix[0]), 1.0) and not matrix[2].any()
+    assert 'car loan' in vectorizer.features("car loan")
+
+
+def test_save_and_load_memory_maps_the_vectors(tmp_path):
+    IntentIndex.build(TOY_EXAMPLES, HashingVectorizer(dims=128)).save(str(tmp_path))
+    index = IntentIndex.load(str(tmp_path), k=3, margin=0.3, min_similarity=0.1)
+
+    assert isinstance(index.vectors, np.memmap)
+    assert sorted(os.listdir(tmp_path)) == ['index.json', 'labels.npy', 'vectors.npy']
+    assert json.loads((tmp_path / 'index.json').read_text())['embedder'] == {'type': 'hashing', 'dims': 128, 'ngrams': 2}
+    assert index.classify("Can I get a loan for a used car?")['user_intent'] == 'Car loan request'
+    assert index.classify("We would like to buy a house with a mortgage")['user_intent'] == 'Home loan request'
+
+
+def test_close_votes_and_pii_go_to_bedrock():
+    index = IntentIndex.build(TOY_EXAMPLES, k=2, margin=0.5)
+
+    assert index.classify("a car or a house") is None
+    assert index.classify("Loan for a used car, call me on 555 010 3000") is None
+    assert index.stats == {'fast_path': 0, 'bedrock': 2}
+    assert IntentIndex.build(TOY_EXAMPLES, k=2, margin=0.5, skip_pii=False).classify(
+        "Loan for a used car, call me on 555 010 3000") is not None
+
+
+def test_custom_embedding_needs_to_be_passed_to_load(tmp_path):
+    embed = HashingVectorizer(dims=32)
+    IntentIndex.build(TOY_EXAMPLES, lambda texts: embed(texts)).save(str(tmp_path))
+
+    with pytest.raises(ValueError):
+        IntentIndex.load(str(tmp_path))
+    assert IntentIndex.load(str(tmp_path), embed=embed, margin=0.0).classify("used car loan") is not None
+
+
+def test_labelled_examples_are_routed_or_left_to_bedrock():
+    index = IntentIndex.build(split('train'))
+    answered = correct = 0
+    for example in split('test'):
+        result = index.classify(example['text'])
+        if result is not None:
+            answered += 1
+            correct += result['user_intent'] == INTENT_LABELS.get(example['intent'], example['intent'])
+
+    assert answered >= 0.7 * len(split('test'))
+    assert correct >= 0.95 * answered
+
+
+def test_handler_routes_from_the_index_without_bedrock(monkeypatch, event):
+    def fail_bedrock(*args, **kwargs):
+        raise AssertionError("call_bedrock should not be called")
+
+    monkeypatch.setattr(lambda_function, 'intent_index', IntentIndex.build(split('train')))
+    monkeypatch.setattr(lambda_function, 'intent_classifier', None)
+    monkeypatch.setattr(lambda_function, 'enable_analysis_cache', False)
+    monkeypatch.setattr(lambda_function, 'extract_email_content', lambda event, deadline=None:
+                        "Hello, I am looking to finance a second hand pickup truck from a local dealer. Thanks.")
+    monkeypatch.setattr(lambda_function, 'detect_language', lambda text, deadline=None: 'en')
+    monkeypatch.setattr(lambda_function, 'call_bedrock', fail_bedrock)
+
+    response = lambda_function.lambda_handler(event, None)
+
+    assert response['user_intent'] == 'Car loan request'
+    assert response['pii_detected'] == 'false'
@@ -0,0 +1,47 @@
+import lambda_function
+from intent_rules import AhoCorasick, IntentRuleClassifier
+
+
+def test_aho_corasick_finds_overlapping_matches():
+    matcher = AhoCorasick(["he", "she", "his", "hers"])
+    assert sorted(matcher.iter_matches("ushers")) == [(1, "she"), (2, "he"), (2, "hers")]
+
+
+def test_obvious_emails_take_fast_path():
+    classifier = IntentRuleClassifier()
+    equity = classifier.classify("Hi, I want a home equity line of credit for my kitchen")
+    car = classifier.classify("I would like to purchase a brand new car")
+
+    # Labels must keep matching the flow's TextContains routing conditions
+    assert "equity" in equity['user_intent'].lower()
+    assert "car loan" in car['user_intent'].lower()
+    assert equity['pii_detected'] is False
+    assert classifier.stats == {'fast_path': 2, 'bedrock': 0}
+
+
+def test_ambiguous_or_pii_emails_fall_through():
+    classifier = IntentRuleClassifier()
+    assert classifier.classify("I need a home loan and a car loan") is None
+    assert classifier.classify("Please call me on 555 123 4567 about my mortgage") is None
+    assert classifier.classify("Where is my statement?") is None
+    # Partial words do not count as matches
+    assert classifier.score("the vehicles") == {}
+    assert classifier.stats == {'fast_path': 0, 'bedrock': 3}
+
+
+def test_handler_fast_path_skips_bedrock(monkeypatch, event):
+    def fail_bedrock(*args):
+        raise AssertionError("Bedrock should not be called")
+
+    monkeypatch.setattr(lambda_function, 'enable_analysis_cache', False)
+    monkeypatch.setattr(lambda_function, 'intent_classifier', IntentRuleClassifier())
+    monkeypatch.setattr(lambda_function, 'extract_email_content', lambda event, deadline=None: "I want a home equity line of credit")
+    monkeypatch.setattr(lambda_function, 'call_bedrock', fail_bedrock)
+    monkeypatch.setattr(lambda_function, 'detect_language', lambda text, deadline=None: 'en')
+
+    response = lambda_function.lambda_handler(event, None)
+
+    assert response['user_intent'] == "Home equity loan request"
+    assert response['intent1'] == "Home equity loan request"
+    assert response['pii_detected'] == 'false'
+    assert response['language'] == 'en'
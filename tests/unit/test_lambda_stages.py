@@ -0,0 +1,54 @@
+import time
+
+import pytest
+
+import lambda_function
+from lambda_function import Stage, run_stages
+
+
+def slow(value, delay):
+    time.sleep(delay)
+    return value
+
+
+def fail():
+    raise RuntimeError("boom")
+
+
+def test_stages_run_concurrently():
+    started = time.monotonic()
+    results = run_stages({
+        'a': Stage(slow, ('a', 0.3), 2, None),
+        'b': Stage(slow, ('b', 0.3), 2, None),
+    })
+    elapsed = time.monotonic() - started
+
+    assert results == {'a': 'a', 'b': 'b'}
+    # Wall time tracks the slowest stage, not the sum
+    assert elapsed < 0.55
+
+
+def test_stage_timeout_returns_fallback():
+    started = time.monotonic()
+    results = run_stages({
+        'fast': Stage(slow, ('fast', 0.01), 1, None),
+        'slow': Stage(slow, ('slow', 1.0), 0.1, 'fallback'),
+    })
+
+    assert results == {'fast': 'fast', 'slow': 'fallback'}
+    assert time.monotonic() - started < 0.5
+
+
+def test_stage_error_uses_fallback_or_raises():
+    assert run_stages({'a': Stage(fail, (), 1, 'x')}) == {'a': 'x'}
+    with pytest.raises(RuntimeError):
+        run_stages({'a': Stage(fail, (), 1, None)})
+
+
+def test_sequential_mode(monkeypatch):
+    monkeypatch.setattr(lambda_function, 'concurrent_stages', False)
+    results = run_stages({
+        'a': Stage(slow, ('a', 0), None, None),
+        'b': Stage(fail, (), None, 'fallback'),
+    })
+    assert results == {'a': 'a', 'b': 'fallback'}
@@ -0,0 +1,90 @@
+import json
+import os
+
+import lambda_function
+from language_id import LanguageIdentifier, build_profiles, extract_ngrams
+
+SAMPLES = os.path.join(os.path.dirname(__file__), '..', '..', 'benchmarks', 'data', 'language_samples.jsonl')
+
+
+def test_extract_ngrams_stays_within_words():
+    grams = extract_ngrams("Hi, the")
+    assert ' th' in grams and 'he ' in grams
+    assert 'i t' not in grams
+
+
+def test_bundled_profiles_identify_labelled_samples():
+    identifier = LanguageIdentifier.load()
+    with open(SAMPLES, encoding='utf-8') as f:
+        samples = [json.loads(line) for line in f]
+
+    for sample in samples:
+        language, confidence = identifier.detect(sample['text'])
+        assert language == sample['language'], sample['text']
+        assert confidence >= lambda_function.language_confidence_threshold, sample['text']
+
+
+def test_unsupported_or_short_text_has_low_confidence():
+    identifier = LanguageIdentifier.load()
+    assert identifier.detect("Dzień dobry, mam pytanie dotyczące mojego konta")[1] < 0.75
+    assert identifier.detect("OK")[1] < 0.75
+    assert identifier.detect("12345") == ('', 0.0)
+
+
+def test_build_profiles_round_trip():
+    identifier = LanguageIdentifier(build_profiles({'aa': "aaa aab aba", 'bb': "bbb bba bab"}))
+    assert identifier.detect("aab aaa")[0] == 'aa'
+    assert identifier.detect("bab bbb")[0] == 'bb'
+
+
+def test_detect_language_falls_back_to_comprehend_when_uncertain(monkeypatch):
+    calls = []
+
+    class FakeComprehend:
+        def detect_dominant_language(self, Text):
+            calls.append(Text)
+            return {'Languages': [{'LanguageCode': 'pl', 'Score': 0.99}]}
+
+    monkeypatch.setattr(lambda_function, 'comprehend', FakeComprehend())
+    monkeypatch.setattr(lambda_function, 'language_detector', 'auto')
+
+    assert lambda_function.detect_language("I would like to open a savings account for my son") == 'en'
+    assert lambda_function.detect_language("Dzień dobry, mam pytanie dotyczące mojego konta") == 'pl'
+    assert len(calls) == 1
+
+    monkeypatch.setattr(lambda_function, 'language_detector', 'local')
+    lambda_function.detect_language("Dzień dobry, mam pytanie dotyczące mojego konta")
+    assert len(calls) == 1
+
+
+def test_single_call_mode_takes_the_language_from_bedrock(monkeypatch, event):
+    requests = []
+
+    def fake_bedrock(client, model_id, instruction, email_content, timeout=None):
+        requests.append(instruction)
+        return {"success": True, "data": lambda_function.complete_analysis(
+            {"intent": "Home loan request", "pii": False, "lang": "de"})}
+
+    def fail_language(*args):
+        raise AssertionError("detect_language should not be called")
+
+    monkeypatch.setattr(lambda_function, 'language_detector', 'bedrock')
+    monkeypatch.setattr(lambda_function, 'instruction', lambda_function.build_instruction(with_language=True))
+    monkeypatch.setattr(lambda_function, 'enable_analysis_cache', False)
+    monkeypatch.setattr(lambda_function, 'intent_classifier', None)
+    monkeypatch.setattr(lambda_function, 'extract_email_content', lambda event, deadline=None: "Ich brauche einen Kredit")
+    monkeypatch.setattr(lambda_function, 'call_bedrock', fake_bedrock)
+    monkeypatch.setattr(lambda_function, 'detect_language', fail_language)
+
+    response = lambda_function.lambda_handler(event, None)
+
+    assert response['language'] == 'de'
+    assert response['user_intent'] == 'Home loan request'
+    assert '"lang"' in requests[0]
+    assert '"lang"' not in lambda_function.build_instruction()
+
+
+def test_invalid_model_language_is_ignored():
+    assert lambda_function.valid_language(' pt-BR ') == 'pt-BR'
+    assert lambda_function.valid_language('English') is None
+    assert lambda_function.valid_language(None) is None
@@ -0,0 +1,89 @@
+import os
+import subprocess
+import time
+import zipfile
+
+import pytest
+
+from email_automation import layer_build
+
+REQUIREMENTS = ['botocore==1.35.76']
+SERVICES = ('connect', 's3')
+
+
+@pytest.fixture
+def installs(monkeypatch):
+    """Replaces pip with a fake install; each call is recorded with its platform"""
+    calls = []
+
+    def install(requirements, target_dir, platform, python_version):
+        calls.append(platform)
+        for service in ('connect', 's3', 'ec2'):
+            path = os.path.join(target_dir, 'botocore', 'data', service, '2017-08-08')
+            os.makedirs(path)
+            with open(os.path.join(path, 'service-2.json'), 'w') as f:
+                f.write('{}')
+        with open(os.path.join(target_dir, 'botocore', '__init__.py'), 'w') as f:
+            f.write("__version__ = '1.35.76'\n")
+        # Different builds write their files at different times
+        os.utime(os.path.join(target_dir, 'botocore', '__init__.py'), (time.time() + len(calls), ) * 2)
+
+    monkeypatch.setattr(layer_build, 'install', install)
+    return calls
+
+
+def build(cache_dir, platform='manylinux2014_x86_64', **kwargs):
+    return layer_build.build_layer(str(cache_dir), REQUIREMENTS, platform, '3.11', SERVICES, **kwargs)
+
+
+def test_cache_key_covers_every_input():
+    key = layer_build.cache_key(REQUIREMENTS, 'manylinux2014_x86_64', '3.11', SERVICES)
+    assert key == layer_build.cache_key(REQUIREMENTS, 'manylinux2014_x86_64', '3.11', tuple(reversed(SERVICES)))
+    assert len({
+        key,
+        layer_build.cache_key(['botocore==1.35.77'], 'manylinux2014_x86_64', '3.11', SERVICES),
+        layer_build.cache_key(REQUIREMENTS, 'manylinux2014_aarch64', '3.11', SERVICES),
+        layer_build.cache_key(REQUIREMENTS, 'manylinux2014_x86_64', '3.12', SERVICES),
+        layer_build.cache_key(REQUIREMENTS, 'manylinux2014_x86_64', '3.11', SERVICES + ('sts',)),
+    }) == 5
+
+
+def test_unchanged_inputs_reuse_the_cached_zip(tmp_path, installs):
+    first = build(tmp_path)
+    assert build(tmp_path) == first
+    assert installs == ['manylinux2014_x86_64']
+
+    build(tmp_path, platform='manylinux2014_aarch64')
+    assert installs == ['manylinux2014_x86_64', 'manylinux2014_aarch64']
+
+
+def test_zip_is_deterministic_and_laid_out_for_lambda(tmp_path, installs):
+    first = build(tmp_path / 'one')
+    second = build(tmp_path / 'two')
+    with open(first, 'rb') as a, open(second, 'rb') as b:
+        assert a.read() == b.read()
+
+    names = zipfile.ZipFile(first).namelist()
+    assert names == sorted(names)
+    assert 'python/botocore/__init__.py' in names
+    assert not any('/data/ec2/' in name for name in names)
+
+
+def test_offline_fails_fast_on_a_cold_cache(tmp_path, installs):
+    with pytest.raises(layer_build.LayerCacheMiss):
+        build(tmp_path, offline=True)
+    assert installs == []
+
+    cached = build(tmp_path)
+    assert build(tmp_path, offline=True) == cached
+
+
+def test_failed_install_leaves_nothing_cached(tmp_path, monkeypatch):
+    def install(*args):
+        raise subprocess.CalledProcessError(1, 'pip3')
+
+    monkeypatch.setattr(layer_build, 'install', install)
+    with pytest.raises(subprocess.CalledProcessError):
+        build(tmp_path)
+    with pytest.raises(layer_build.LayerCacheMiss):
+        build(tmp_path, offline=True)
@@ -0,0 +1,213 @@
+import json
+import os
+
+import lambda_function
+from analysis_cache import InMemoryBackend
+from intent_rules import IntentRuleClassifier
+from near_duplicate import Fingerprinter, NearDuplicateIndex, scope_keys
+from pii_extractor import PiiExtractor
+
+PAIRS = os.path.join(os.path.dirname(__file__), '..', '..', 'benchmarks', 'data', 'near_duplicate_pairs.jsonl')
+RULES = IntentRuleClassifier()
+EMAIL = ("Hello, I would like to apply for a car loan for a used hatchback I found at a dealership near my office. "
+         "I have been a customer for ten years and my salary is paid into my current account every month. "
+         "Please let me know which documents you need from me. Kind regards, Sam")
+
+
+def fingerprinter():
+    return Fingerprinter(key_terms=lambda text: RULES.score(text).keys())
+
+
+def load_pairs():
+    with open(PAIRS, encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+def reused(first, second, **options):
+    fingerprints = fingerprinter()
+    index = NearDuplicateIndex(**options)
+    index.add(['sender:a'], fingerprints.fingerprint(first), {'user_intent': 'first'})
+    return index.find(['sender:a'], fingerprints.fingerprint(second)) is not None
+
+
+def test_no_false_reuse_on_labelled_pairs():
+    pairs = load_pairs()
+    false_reuse = [pair['kind'] for pair in pairs if not pair['reuse'] and reused(pair['a'], pair['b'])]
+    missed = [pair['kind'] for pair in pairs if pair['reuse'] and not reused(pair['a'], pair['b'])]
+
+    assert false_reuse == []
+    assert len(missed) <= 0.1 * sum(pair['reuse'] for pair in pairs)
+
+
+def test_different_intent_is_never_reused_even_with_loose_thresholds():
+    swaps = [pair for pair in load_pairs() if pair['kind'] == 'intent_swap']
+    assert swaps
+    assert not any(reused(pair['a'], pair['b'], max_hamming=64, min_jaccard=0.0) for pair in swaps)
+
+
+def test_thresholds_are_configurable():
+    edited = EMAIL.replace("Kind regards, Sam", "Thanks, Sam")
+    assert reused(EMAIL, edited)
+    assert not reused(EMAIL, edited, min_jaccard=0.99)
+    assert not reused(EMAIL, edited, max_hamming=2)
+    assert reused(EMAIL, EMAIL, max_hamming=0, min_jaccard=1.0)
+
+
+def test_short_emails_get_no_fingerprint():
+    assert fingerprinter().fingerprint("I want a car loan") is None
+    assert fingerprinter().fingerprint(EMAIL).shingles > 8
+
+
+def test_scopes_hash_the_sender_and_keep_the_thread():
+    scopes = scope_keys({'RelatedContactId': 'contact-0',
+                         'CustomerEndpoint': {'Address': ' Sam@Example.com', 'Type': 'EMAIL_ADDRESS'}})
+
+    assert scopes[0] == 'thread:contact-0'
+    assert scopes[1].startswith('sender:') and 'example' not in scopes[1].lower()
+    assert scopes[1] == scope_keys({'CustomerEndpoint': {'Address': 'sam@example.com'}})[0]
+    assert scope_keys({'ContactId': 'contact-1'}) == []
+    assert scope_keys({'ContactId': 'contact-1'}, own_thread=True) == ['thread:contact-1']
+    assert scope_keys({'ContactId': 'contact-1', 'RelatedContactId': 'contact-0'},
+                      own_thread=True) == ['thread:contact-0', 'thread:contact-1']
+
+
+def test_index_is_bounded_and_expires():
+    now = [0.0]
+    index = NearDuplicateIndex(max_scopes=2, per_scope=1, ttl_seconds=60, clock=lambda: now[0])
+    fingerprint = fingerprinter().fingerprint(EMAIL)
+    for scope in ('sender:a', 'sender:b', 'sender:c'):
+        index.add([scope], fingerprint, {'user_intent': scope})
+
+    assert len(index) == 2
+    assert index.find(['sender:a'], fingerprint) is None
+    assert index.find(['sender:c'], fingerprint) == {'user_intent': 'sender:c'}
+    # Another sender's identical email is not reused
+    assert index.find(['sender:d'], fingerprint) is None
+    now[0] = 61
+    assert index.find(['sender:c'], fingerprint) is None
+    assert index.stats['hits'] == 1 and index.stats['misses'] == 3
+
+
+def test_shared_tier_is_seen_by_other_instances():
+    shared = InMemoryBackend()
+    fingerprint = fingerprinter().fingerprint(EMAIL)
+    NearDuplicateIndex(shared=shared).add(['thread:contact-0'], fingerprint, {'user_intent': 'Car loan request'})
+    other = NearDuplicateIndex(shared=shared)
+
+    assert other.find(['thread:contact-0'], fingerprint) == {'user_intent': 'Car loan request'}
+    assert other.stats['shared_hits'] == 1
+    # Copied into the local tier
+    assert other.find(['thread:contact-0'], fingerprint) is not None and other.stats['hits'] == 1
+
+
+def test_shared_tier_keeps_only_the_shared_fields():
+    shared = InMemoryBackend()
+    fingerprint = fingerprinter().fingerprint(EMAIL)
+    index = NearDuplicateIndex(shared=shared, shared_fields=('user_intent',))
+    index.add(['sender:a'], fingerprint, {'user_intent': 'Car loan request', 'phone_number': '555 0100'})
+
+    assert '555 0100' not in json.dumps(shared.get('near-duplicate:sender:a'))
+    # The local tier keeps the whole analysis
+    assert index.find(['sender:a'], fingerprint)['phone_number'] == '555 0100'
+    assert NearDuplicateIndex(shared=shared).find(['sender:a'], fingerprint) == {'user_intent': 'Car loan request'}
+
+
+def test_shared_tier_errors_are_misses():
+    class Broken:
+        def get(self, key):
+            raise RuntimeError("table unavailable")
+
+        def put(self, key, value):
+            raise RuntimeError("table unavailable")
+
+    index = NearDuplicateIndex(shared=Broken())
+    fingerprint = fingerprinter().fingerprint(EMAIL)
+    index.add(['sender:a'], fingerprint, {'user_intent': 'x'})
+
+    assert index.find(['sender:b'], fingerprint) is None
+    assert index.find(['sender:a'], fingerprint) == {'user_intent': 'x'}
+    assert index.stats['errors'] == 2
+
+
+def stub_analysis(monkeypatch):
+    """Near-duplicate detection on, and a Bedrock stand-in; returns the emails it was called with"""
+    calls = []
+
+    def fake_bedrock(client, model_id, instruction, email_content, timeout=None):
+        calls.append(email_content)
+        return {"success": True, "data": lambda_function.complete_analysis(
+            {"intent": "Car loan request", "pii": False})}
+
+    monkeypatch.setattr(lambda_function, 'enable_near_duplicate', True)
+    monkeypatch.setattr(lambda_function, 'near_duplicates', NearDuplicateIndex())
+    monkeypatch.setattr(lambda_function, 'enable_analysis_cache', False)
+    monkeypatch.setattr(lambda_function, 'intent_classifier', None)
+    monkeypatch.setattr(lambda_function, 'detect_language', lambda text, deadline=None: 'en')
+    monkeypatch.setattr(lambda_function, 'call_bedrock', fake_bedrock)
+    return calls
+
+
+def from_sender(event, sender):
+    event['Details']['ContactData']['CustomerEndpoint'] = {"Address": sender, "Type": "EMAIL_ADDRESS"}
+    return event
+
+
+def test_handler_reuses_the_analysis_of_a_resent_email(monkeypatch, event):
+    calls = stub_analysis(monkeypatch)
+
+    def invoke(body, sender):
+        monkeypatch.setattr(lambda_function, 'extract_email_content', lambda event, deadline=None: body)
+        return lambda_function.lambda_handler(from_sender(event, sender), None)
+
+    first = invoke(EMAIL, "sam@example.com")
+    again = invoke(EMAIL + " Any update on this?", "sam@example.com")
+    other_sender = invoke(EMAIL + " Any update on this?", "alex@example.com")
+
+    assert again == first and again['user_intent'] == 'Car loan request'
+    assert other_sender['user_intent'] == 'Car loan request'
+    assert len(calls) == 2
+
+
+def test_handler_reuses_the_analysis_for_a_reply_in_the_thread(monkeypatch, event):
+    calls = stub_analysis(monkeypatch)
+
+    def invoke(body, **contact_data):
+        monkeypatch.setattr(lambda_function, 'extract_email_content', lambda event, deadline=None: body)
+        contact_data['InstanceARN'] = event['Details']['ContactData']['InstanceARN']
+        return lambda_function.lambda_handler({"Details": {"ContactData": contact_data}}, None)
+
+    # The first email of the thread has no related contact and, here, no sender address
+    first = invoke(EMAIL, ContactId='contact-1')
+    reply = invoke(EMAIL + " Any update on this?", ContactId='contact-2', RelatedContactId='contact-1')
+    other_thread = invoke(EMAIL + " Any update on this?", ContactId='contact-3', RelatedContactId='contact-9')
+
+    assert reply == first
+    assert other_thread['user_intent'] == 'Car loan request'
+    assert len(calls) == 2
+
+
+def test_reused_analysis_carries_the_pii_of_the_new_email(monkeypatch, event):
+    calls = stub_analysis(monkeypatch)
+    monkeypatch.setattr(lambda_function, 'pii_extractor', PiiExtractor())
+
+    def fake_bedrock(client, model_id, instruction, email_content, timeout=None):
+        calls.append(email_content)
+        return {"success": True, "data": lambda_function.complete_analysis(
+            {"intent": "Account query", "pii": True, "info": {"name": "Alex"}})}
+    monkeypatch.setattr(lambda_function, 'call_bedrock', fake_bedrock)
+
+    responses = []
+    for pair in (pair for pair in load_pairs() if pair['kind'] == 'changed_pii'):
+        for body in (pair['a'], pair['b']):
+            monkeypatch.setattr(lambda_function, 'extract_email_content', lambda event, deadline=None: body)
+            responses.append(lambda_function.lambda_handler(from_sender(event, "alex@example.com"), None))
+
+    # Only the first email of each pair is analyzed; the second reuses its intent
+    assert len(calls) == 2
+    first_call, first_reply, second_call, second_reply = responses
+    assert first_reply['user_intent'] == first_call['user_intent'] == 'Account query'
+    assert first_call['phone_number'] != first_reply['phone_number'] == '020 7946 0342'
+    assert second_call['account_number'] != second_reply['account_number'] == '41227615'
+    # PII the local extractor cannot find is not carried over from the earlier email
+    assert first_call['name'] == 'Alex' and first_reply['name'] == ''
+    assert first_reply['pii_detected'] == second_reply['pii_detected'] == 'true'
@@ -0,0 +1,154 @@
+import json
+import os
+
+import pytest
+
+import lambda_function
+from analysis_cache import AnalysisCache, LRUTier
+from pii_extractor import PiiExtractor, extracted_info, luhn_valid, mod97_valid
+
+SAMPLES = os.path.join(os.path.dirname(__file__), '..', '..', 'benchmarks', 'data', 'pii_samples.jsonl')
+
+def test_extracts_phone_email_and_account_numbers():
+    found = PiiExtractor().extract("Call me on +44 20 7946 0958 or (212) 555-0199, mail jo.doe+x@example.co.uk. "
+                                   "My card 4111 1111 1111 1111 and IBAN GB82 WEST 1234 5698 7654 32.")
+
+    assert found['phone_number'] == ['+44 20 7946 0958', '(212) 555-0199']
+    assert found['email_address'] == ['jo.doe+x@example.co.uk']
+    assert found['account_number'] == ['4111 1111 1111 1111', 'GB82 WEST 1234 5698 7654 32']
+
+
+def test_numbers_need_a_checksum_or_a_label():
+    extractor = PiiExtractor()
+
+    assert not any(extractor.extract("Order 88812345 on 2024-05-01 at 10:30 for 1,204.55, app 3.12.4").values())
+    assert extractor.extract("Ref 4111 1111 1111 1112 and IBAN GB82 WEST 1234 5698 7654 33")['account_number'] == []
+    assert extractor.extract("My account number is 12345678")['account_number'] == ['12345678']
+    # National numbers that are not NANP-shaped only count after a word like "call"
+    assert extractor.extract("Ticket 555 0100 is open")['phone_number'] == []
+    assert extractor.extract("Please ring 555 0100")['phone_number'] == ['555 0100']
+
+
+def test_account_formats_can_be_configured(tmp_path):
+    path = tmp_path / 'formats.json'
+    path.write_text(json.dumps([{"name": "member_id", "pattern": "M\\d{8}", "checksum": "luhn"}]))
+    extractor = PiiExtractor.from_file(str(path), account_formats=['iban'])
+
+    found = extractor.extract("Member M79927398 (not M79927390), card 4111 1111 1111 1111")
+
+    assert found['account_number'] == ['M79927398']
+    with pytest.raises(ValueError):
+        PiiExtractor(account_formats=['passport'])
+    with pytest.raises(ValueError):
+        PiiExtractor(custom_formats=[{"name": "x", "pattern": "X\\d+", "checksum": "crc"}])
+
+
+def test_checksums():
+    assert luhn_valid('79927398713') and not luhn_valid('79927398710')
+    assert mod97_valid('DE89 3704 0044 0532 0130 00') and not mod97_valid('DE89 3704 0044 0532 0130 01')
+
+
+def test_extracted_info_keeps_extra_values_as_other_pii():
+    info = extracted_info({'phone_number': ['555 0100', '555 0142'], 'email_address': [], 'account_number': []})
+    assert info == {'phone_number': '555 0100', 'other_pii': ['555 0142']}
+
+
+def test_labelled_samples():
+    with open(SAMPLES, encoding='utf-8') as f:
+        samples = [json.loads(line) for line in f]
+    extractor = PiiExtractor()
+    found = {field: [0, 0, 0] for field in ('phone_number', 'email_address', 'account_number')}
+    for sample in samples:
+        result = extractor.extract(sample['text'])
+        for field, counts in found.items():
+            expected, got = set(sample[field]), set(result[field])
+            counts[0] += len(expected & got)
+            counts[1] += len(got - expected)
+            counts[2] += len(expected - got)
+
+    for field, (true_positives, false_positives, false_negatives) in found.items():
+        assert true_positives / (true_positives + false_positives) >= 0.9, field
+        assert true_positives / (true_positives + false_negatives) >= 0.9, field
+
+
+def test_handler_asks_the_model_for_the_intent_only(monkeypatch, event):
+    instructions = []
+
+    def fake_bedrock(client, model_id, instruction, email_content, timeout=None):
+        instructions.append(instruction)
+        return {"success": True, "data": lambda_function.complete_analysis(
+            {"intent": "Card dispute", "info": {"name": "Sam Lee"}})}
+
+    monkeypatch.setattr(lambda_function, 'pii_extractor', PiiExtractor())
+    monkeypatch.setattr(lambda_function, 'instruction', lambda_function.build_instruction(pii_fields=['name']))
+    monkeypatch.setattr(lambda_function, 'enable_analysis_cache', False)
+    monkeypatch.setattr(lambda_function, 'intent_classifier', None)
+    monkeypatch.setattr(lambda_function, 'extract_email_content', lambda event, deadline=None:
+                        "I dispute a payment, call me on 555 0100 or mail sam@example.com. Sam Lee")
+    monkeypatch.setattr(lambda_function, 'detect_language', lambda text, deadline=None: 'en')
+    monkeypatch.setattr(lambda_function, 'call_bedrock', fake_bedrock)
+
+    response = lambda_function.lambda_handler(event, None)
+
+    assert '"pii"' not in instructions[0] and '"phone"' not in instructions[0]
+    assert response['user_intent'] == 'Card dispute'
+    assert response['pii_detected'] == 'true'
+    assert response['phone_number'] == '555 0100'
+    assert response['email_address'] == 'sam@example.com'
+    assert response['name'] == 'Sam Lee'
+
+
+def test_local_pii_replaces_the_fallback_hint(monkeypatch):
+    text = "Order 1234 5678 90 shipped, call 555 0100"
+    assert lambda_function.fallback_analysis("Order 1234 5678 90 shipped")['pii_detected'] is True
+
+    monkeypatch.setattr(lambda_function, 'pii_extractor', PiiExtractor())
+    assert lambda_function.fallback_analysis("Order 1234 5678 90 shipped")['pii_detected'] is False
+    analysis = lambda_function.merge_local_pii(lambda_function.fallback_analysis(text),
+                                               lambda_function.pii_extractor.extract(text))
+    assert analysis['pii_detected'] is True
+    assert analysis['extracted_info'] == {'phone_number': '555 0100'}
+
+    with pytest.raises(ValueError):
+        lambda_function.complete_analysis({"pii": True})
+    assert lambda_function.complete_analysis({"intent": "Balance"})['pii_detected'] is False
+
+
+def test_phone_number_in_the_signature_is_found(monkeypatch, event):
+    model_inputs = []
+
+    def fake_bedrock(client, model_id, instruction, email_content, timeout=None):
+        model_inputs.append(email_content)
+        in_signature = "020 7946 0018" in email_content
+        return {"success": True, "data": lambda_function.complete_analysis(
+            {"intent": "Card dispute", "pii": in_signature, "info": {"phone": "020 7946 0018"} if in_signature else {}})}
+
+    def email(phone):
+        return (f"I do not recognise a card payment from yesterday, please call me back.\n--\nSam Lee\nTel: {phone}\n"
+                "On Tue, Apr 2, 2024 at 10:03 AM Care <care@bank.example> wrote:\n> Call us on 0800 123 4567")
+
+    monkeypatch.setattr(lambda_function, 'enable_thread_trim', True)
+    monkeypatch.setattr(lambda_function, 'enable_analysis_cache', True)
+    monkeypatch.setattr(lambda_function, 'analysis_cache', AnalysisCache(LRUTier()))
+    monkeypatch.setattr(lambda_function, 'intent_classifier', None)
+    monkeypatch.setattr(lambda_function, 'detect_language', lambda text, deadline=None: 'en')
+    monkeypatch.setattr(lambda_function, 'call_bedrock', fake_bedrock)
+
+    # Without the local extractor the model sees the signature, but not the quoted history
+    monkeypatch.setattr(lambda_function, 'extract_email_content', lambda event, deadline=None: email("020 7946 0018"))
+    response = lambda_function.lambda_handler(event, None)
+    assert "Tel: 020 7946 0018" in model_inputs[0] and "0800" not in model_inputs[0]
+    assert response['phone_number'] == '020 7946 0018'
+
+    # The local extractor reads the whole body; the model does not get the signature
+    monkeypatch.setattr(lambda_function, 'pii_extractor', PiiExtractor())
+    monkeypatch.setattr(lambda_function, 'analysis_cache', AnalysisCache(LRUTier()))
+    response = lambda_function.lambda_handler(event, None)
+    assert "0018" not in model_inputs[1]
+    assert response['phone_number'] == '020 7946 0018' and response['pii_detected'] == 'true'
+
+    # The trimmed text is the same, so this is a cache hit, with the phone number of this email
+    monkeypatch.setattr(lambda_function, 'extract_email_content', lambda event, deadline=None: email("020 7946 0342"))
+    response = lambda_function.lambda_handler(event, None)
+    assert len(model_inputs) == 2
+    assert response['phone_number'] == '020 7946 0342'
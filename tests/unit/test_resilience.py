@@ -0,0 +1,158 @@
+import pytest
+from botocore.exceptions import ClientError, ReadTimeoutError
+
+import lambda_function
+from deadline import Deadline
+from resilience import CircuitBreaker, CircuitOpenError, Guard, RetryPolicy, is_retryable
+
+
+def client_error(code):
+    return ClientError({'Error': {'Code': code, 'Message': code}}, 'InvokeModel')
+
+
+class Flaky:
+    """Raises the given errors in turn, then returns 'ok'"""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'ok'
+
+
+def test_only_throttling_server_and_connection_errors_are_retryable():
+    assert is_retryable(client_error('ThrottlingException'))
+    assert is_retryable(client_error('ServiceUnavailableException'))
+    assert is_retryable(ReadTimeoutError(endpoint_url='https://bedrock'))
+    assert not is_retryable(client_error('ValidationException'))
+    assert not is_retryable(ValueError('Model output is missing user_intent'))
+
+
+def test_backoff_is_jittered_exponential_and_capped():
+    policy = RetryPolicy(base_delay=0.1, max_delay=0.5, rng=lambda: 1.0)
+    assert [policy.delay(n) for n in (1, 2, 3, 4, 5)] == [0.1, 0.2, 0.4, 0.5, 0.5]
+    assert RetryPolicy(base_delay=0.1, rng=lambda: 0.25).delay(2) == 0.05
+
+
+def test_throttled_call_is_retried_until_it_succeeds(clock):
+    metrics = {}
+    guard = Guard('bedrock', RetryPolicy(max_attempts=3, rng=lambda: 1.0),
+                  put_metric=lambda name, value: metrics.update({name: value}), sleep=clock.sleep)
+    fn = Flaky(client_error('ThrottlingException'), client_error('ThrottlingException'))
+
+    assert guard.call(fn, Deadline(5, clock)) == 'ok'
+    assert fn.calls == 3
+    assert clock.now == pytest.approx(100.3)
+    assert metrics == {'bedrock_retries': 2}
+
+
+def test_no_retry_for_request_errors_or_without_time_for_another_attempt(clock):
+    guard = Guard('bedrock', RetryPolicy(max_attempts=3, rng=lambda: 1.0), min_attempt=1.0, sleep=clock.sleep)
+
+    fn = Flaky(client_error('ValidationException'))
+    with pytest.raises(ClientError):
+        guard.call(fn, Deadline(5, clock))
+    assert fn.calls == 1
+
+    fn = Flaky(client_error('ThrottlingException'))
+    with pytest.raises(ClientError):
+        guard.call(fn, Deadline(1.05, clock))
+    assert fn.calls == 1
+
+
+def test_breaker_opens_on_error_rate_then_half_opens(clock):
+    breaker = CircuitBreaker(error_rate=0.5, min_calls=4, window=10, open_seconds=30, clock=clock)
+    guard = Guard('bedrock', breaker=breaker)
+    for fn in (Flaky(), Flaky(client_error('ServiceUnavailableException')), Flaky(),
+               Flaky(client_error('ServiceUnavailableException'))):
+        try:
+            guard.call(fn)
+        except ClientError:
+            pass
+    assert breaker.state == CircuitBreaker.OPEN
+
+    fn = Flaky()
+    with pytest.raises(CircuitOpenError):
+        guard.call(fn)
+    assert fn.calls == 0
+
+    clock.now += 31
+    breaker.before_call()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # Only one trial call at a time
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.on_failure()
+    assert breaker.state == CircuitBreaker.OPEN and breaker.opened == 2
+
+    clock.now += 31
+    assert guard.call(Flaky()) == 'ok'
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_calls_in_flight_when_the_breaker_closed_cannot_reopen_it(clock):
+    breaker = CircuitBreaker(min_calls=1, open_seconds=30, clock=clock)
+    stale = breaker.before_call()
+    breaker.on_failure(stale)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    clock.now += 31
+    breaker.on_success(breaker.before_call())
+    assert breaker.state == CircuitBreaker.CLOSED
+    # A slow call that started during the outage fails after the breaker closed
+    breaker.on_failure(stale)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_throttling_does_not_open_the_breaker():
+    breaker = CircuitBreaker(min_calls=2)
+    guard = Guard('bedrock', breaker=breaker)
+    for _ in range(5):
+        with pytest.raises(ClientError):
+            guard.call(Flaky(client_error('ThrottlingException')))
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_request_errors_do_not_open_the_breaker():
+    breaker = CircuitBreaker(min_calls=2)
+    guard = Guard('bedrock', breaker=breaker)
+    for _ in range(5):
+        with pytest.raises(ClientError):
+            guard.call(Flaky(client_error('ValidationException')))
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+class FailingBedrock:
+    def __init__(self):
+        self.calls = 0
+
+    def invoke_model(self, **kwargs):
+        self.calls += 1
+        raise client_error('ServiceUnavailableException')
+
+
+def test_open_circuit_routes_to_the_fallback_without_calling_bedrock(monkeypatch, event, context):
+    bedrock = FailingBedrock()
+    monkeypatch.setattr(lambda_function, 'bedrock_guard',
+                        Guard('bedrock', RetryPolicy(max_attempts=2, rng=lambda: 0.0),
+                              CircuitBreaker(error_rate=0.5, min_calls=2)))
+    monkeypatch.setattr(lambda_function, 'bedrock', bedrock)
+    monkeypatch.setattr(lambda_function, 'enable_analysis_cache', False)
+    monkeypatch.setattr(lambda_function, 'intent_classifier', None)
+    monkeypatch.setattr(lambda_function, 'detect_language', lambda text, deadline=None: 'en')
+    monkeypatch.setattr(lambda_function, 'extract_email_content',
+                        lambda event, deadline=None: "What documents do I need for a car loan?")
+
+    first = lambda_function.lambda_handler(event, context)
+    assert bedrock.calls == 2
+    assert first['user_intent'] == 'Unknown'
+    assert first['degraded'] == 'bedrock_error'
+
+    second = lambda_function.lambda_handler(event, context)
+    assert bedrock.calls == 2
+    assert second['user_intent'] == 'Unknown'
+    assert second['degraded'] == 'bedrock_circuit_open'
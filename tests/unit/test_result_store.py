@@ -0,0 +1,177 @@
+import gzip
+import json
+import time
+
+import pytest
+
+import lambda_function
+from result_store import BatchWriter, LocalStore, WriteBehindBuffer, date_partition
+
+
+class FlakyStore:
+    """Records the objects put; fails while failing is set"""
+
+    def __init__(self):
+        self.objects = {}
+        self.failing = False
+
+    def put(self, key, data, content_type=None):
+        if self.failing:
+            raise RuntimeError("SlowDown")
+        self.objects[key] = data
+        return key
+
+
+def read_records(data):
+    return [json.loads(line) for line in gzip.decompress(data).decode('utf-8').splitlines()]
+
+
+def test_batches_are_gzipped_and_partitioned_by_date(tmp_path):
+    writer = BatchWriter(LocalStore(str(tmp_path)), 'results', compress=True, partition=date_partition)
+    objects = writer.write([
+        {'timestamp': '2024-05-01T23:59:59Z', 'user_intent': 'Car loan request'},
+        {'timestamp': '2024-05-02T00:00:01Z', 'user_intent': 'Home loan request'},
+        {'timestamp': '2024-05-01T23:59:59Z', 'user_intent': 'Unknown'},
+    ])
+
+    assert [path.split('/')[-2] for path in objects] == ['dt=2024-05-01', 'dt=2024-05-02']
+    assert all(path.endswith('.jsonl.gz') for path in objects)
+    with open(objects[0], 'rb') as f:
+        assert [record['user_intent'] for record in read_records(f.read())] == ['Car loan request', 'Unknown']
+
+
+def test_buffer_writes_when_full_or_old(clock):
+    store = FlakyStore()
+    buffer = WriteBehindBuffer(BatchWriter(store, 'results', compress=True), batch_size=3, max_age=60, clock=clock)
+
+    buffer.add({'n': 1})
+    buffer.add({'n': 2})
+    assert buffer.flush_due() is None
+    buffer.add({'n': 3})
+    assert buffer.flush_due().result() == 3
+    assert len(store.objects) == 1 and len(buffer) == 0
+
+    buffer.add({'n': 4})
+    clock.now += 61
+    assert buffer.flush_due().result() == 1
+    assert buffer.stats == {'added': 4, 'written': 4, 'dropped': 0, 'errors': 0, 'objects': 2}
+
+
+def test_failed_write_keeps_the_records_and_memory_stays_bounded():
+    store = FlakyStore()
+    store.failing = True
+    buffer = WriteBehindBuffer(BatchWriter(store, 'results'), batch_size=2, max_records=3)
+    for n in range(3):
+        buffer.add({'n': n})
+    with pytest.raises(RuntimeError):
+        buffer.flush_due().result()
+    assert len(buffer) == 3
+
+    buffer.add({'n': 3})
+    store.failing = False
+    assert buffer.flush() == 3
+    written = [json.loads(line) for data in store.objects.values() for line in data.decode().splitlines()]
+    assert [record['n'] for record in written] == [1, 2, 3]
+    assert buffer.stats['dropped'] == 1 and buffer.stats['errors'] == 1
+
+
+def test_handler_records_results_without_waiting_for_the_store(monkeypatch, tmp_path, event, context):
+    class SlowStore(LocalStore):
+        def put(self, key, data, content_type=None):
+            time.sleep(0.5)
+            return super().put(key, data, content_type)
+
+    result_log = WriteBehindBuffer(BatchWriter(SlowStore(str(tmp_path)), 'results', compress=True,
+                                               partition=date_partition), batch_size=2)
+    monkeypatch.setattr(lambda_function, 'result_log', result_log)
+    monkeypatch.setattr(lambda_function, 'enable_analysis_cache', False)
+    monkeypatch.setattr(lambda_function, 'intent_classifier', None)
+    monkeypatch.setattr(lambda_function, 'detect_language', lambda text, deadline=None: 'en')
+    monkeypatch.setattr(lambda_function, 'extract_email_content',
+                        lambda event, deadline=None: "What documents do I need for a car loan?")
+    monkeypatch.setattr(lambda_function, 'call_bedrock', lambda *args: {"success": True, "data": {
+        'user_intent': 'Car loan request', 'intents': [], 'pii_detected': True,
+        'extracted_info': {'phone_number': '555 0100'}}})
+
+    assert lambda_function.result_log_flush_wait == 0
+    lambda_function.lambda_handler(event, context)
+    assert len(result_log) == 1 and result_log._pending is None
+    # The second record fills the batch; its write starts and the invocation returns before it is done
+    started = time.monotonic()
+    lambda_function.lambda_handler(event, context)
+    assert time.monotonic() - started < 0.4
+    assert result_log._pending is not None and not result_log._pending.done()
+    result_log._pending.result()
+    assert len(result_log) == 0
+
+    [path] = list(tmp_path.glob('results/dt=*/part-*.jsonl.gz'))
+    records = read_records(path.read_bytes())
+    assert len(records) == 2
+    assert records[0]['contact_id'] == 'contact-1' and records[0]['source'] == 'bedrock'
+    assert records[0]['user_intent'] == 'Car loan request' and records[0]['pii_detected'] is True
+    assert records[0]['language'] == 'en' and records[0]['model_id'] == lambda_function.model_id
+    assert 'extract' in records[0]['stages_ms'] and 'trim' in records[0]['stages_ms']
+    # PII values are not part of the log
+    assert '555 0100' not in json.dumps(records)
+
+
+def stub_analysis(monkeypatch):
+    monkeypatch.setattr(lambda_function, 'enable_analysis_cache', False)
+    monkeypatch.setattr(lambda_function, 'intent_classifier', None)
+    monkeypatch.setattr(lambda_function, 'detect_language', lambda text, deadline=None: 'en')
+    monkeypatch.setattr(lambda_function, 'extract_email_content',
+                        lambda event, deadline=None: "What documents do I need for a car loan?")
+    monkeypatch.setattr(lambda_function, 'call_bedrock', lambda *args: {"success": True, "data": {
+        'user_intent': 'Car loan request', 'intents': [], 'pii_detected': False, 'extracted_info': {}}})
+
+
+def test_handler_writes_its_result_before_returning(monkeypatch, event, context):
+    store = FlakyStore()
+    result_log = WriteBehindBuffer(BatchWriter(store, 'results', compress=True), batch_size=100, max_age=300)
+    monkeypatch.setattr(lambda_function, 'result_log', result_log)
+    monkeypatch.setattr(lambda_function, 'result_log_flush_wait', 1.0)
+    stub_analysis(monkeypatch)
+
+    lambda_function.lambda_handler(event, context)
+
+    # Nothing is held when the environment is frozen, so removing it loses no records
+    assert len(result_log) == 0
+    [data] = store.objects.values()
+    assert read_records(data)[0]['contact_id'] == 'contact-1'
+
+
+def test_shutdown_writes_records_still_held(monkeypatch, event, context):
+    class SlowStore(FlakyStore):
+        def put(self, key, data, content_type=None):
+            time.sleep(0.3)
+            return super().put(key, data, content_type)
+
+    store = SlowStore()
+    store.failing = True
+    result_log = WriteBehindBuffer(BatchWriter(store, 'results'), batch_size=100, max_age=300)
+    monkeypatch.setattr(lambda_function, 'result_log', result_log)
+    monkeypatch.setattr(lambda_function, 'result_log_flush_wait', 0.05)
+    stub_analysis(monkeypatch)
+
+    started = time.monotonic()
+    lambda_function.lambda_handler(event, context)
+    # The response waits at most RESULT_LOG_FLUSH_WAIT for the write
+    assert time.monotonic() - started < 0.3
+    result_log._pending.exception()
+    assert len(result_log) == 1 and result_log.stats['errors'] == 1
+
+    store.failing = False
+    with pytest.raises(SystemExit):
+        lambda_function.flush_result_log(15, None)
+    assert len(result_log) == 0 and len(store.objects) == 1
+
+
+def test_flush_and_wait_covers_records_added_during_a_write():
+    store = FlakyStore()
+    buffer = WriteBehindBuffer(BatchWriter(store, 'results'), batch_size=100, max_age=0)
+    buffer.add({'n': 1})
+    assert buffer.flush_due() is not None
+    buffer.add({'n': 2})
+
+    assert buffer.flush_and_wait(1.0) is True
+    assert buffer.stats['written'] == 2 and len(buffer) == 0
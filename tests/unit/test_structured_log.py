@@ -0,0 +1,85 @@
+import json
+
+import pytest
+
+import lambda_function
+from structured_log import StructuredLogger
+
+
+def make_logger(**kwargs):
+    lines = []
+    logger = StructuredLogger(writer=lines.append, **kwargs)
+    logger.start_invocation(request_id='req-1', contact_id=None)
+    return logger, lines
+
+
+def test_disabled_fields_are_never_evaluated():
+    logger, lines = make_logger(level='INFO', buffer_size=0)
+    calls = []
+    logger.debug("Expensive", payload=lambda: calls.append(1))
+    assert lines == [] and calls == []
+
+
+def test_sampled_invocation_writes_debug_records():
+    logger, lines = make_logger(level='ERROR', sample_rate=1.0)
+    logger.debug("Incoming event", size=lambda: 42)
+    record = json.loads(lines[0])
+    assert record['message'] == "Incoming event"
+    assert record['size'] == 42
+    assert record['request_id'] == 'req-1' and record['sampled'] is True
+    assert 'contact_id' not in record
+
+
+def test_error_flushes_buffered_debug_trail():
+    logger, lines = make_logger(level='ERROR')
+    logger.debug("Step one")
+    logger.debug("Step two")
+    assert lines == []
+    logger.error("Failed", error="boom")
+    assert [json.loads(line)['message'] for line in lines] == ["Step one", "Step two", "Failed"]
+
+    # The trail belongs to one invocation only
+    logger.start_invocation(request_id='req-2')
+    logger.error("Failed again")
+    assert len(lines) == 4
+
+
+def test_errors_only_logging_writes_no_debug_trail(monkeypatch):
+    # As configured with ENABLE_LOGGING=false
+    logger, lines = make_logger(level='ERROR', buffer_size=0)
+    monkeypatch.setattr(lambda_function, 'log', logger)
+
+    with pytest.raises(KeyError):
+        lambda_function.extract_email_content({"ContactId": "contact-1", "CustomerEndpoint": {
+            "Address": "sam@example.com", "Type": "EMAIL_ADDRESS"}})
+
+    assert [json.loads(line)['message'] for line in lines] == ["Error in extract_email_content"]
+    assert 'sam@example.com' not in lines[0]
+
+
+def test_bodies_are_redacted_and_long_values_truncated():
+    logger, lines = make_logger(level='DEBUG', max_field_chars=10)
+    logger.debug("Request", body="secret email text", extracted_info={'name': 'Sam'}, note="x" * 25)
+    record = json.loads(lines[0])
+    assert record['body'] == "[redacted 17 chars]"
+    assert record['extracted_info'] == "[redacted]"
+    assert record['note'] == "x" * 10 + "...[+15 chars]"
+
+    logger, lines = make_logger(level='DEBUG', log_bodies=True)
+    logger.debug("Request", body="secret email text")
+    assert json.loads(lines[0])['body'] == "secret email text"
+
+
+def test_email_addresses_and_urls_are_redacted():
+    logger, lines = make_logger(level='DEBUG')
+    url = "https://files.example.com/email.json?X-Amz-Signature=abc"
+    logger.debug("Incoming event", event={
+        "CustomerEndpoint": {"Address": "sam@example.com", "Type": "EMAIL_ADDRESS"},
+        "References": {"attachment": {"Type": "ATTACHMENT", "Value": url}}})
+    logger.debug("get_attached_file response", response={"DownloadUrlMetadata": {"Url": url}})
+    assert 'sam@example.com' not in lines[0] and 'X-Amz-Signature' not in ''.join(lines)
+    assert json.loads(lines[0])['event']['CustomerEndpoint']['Type'] == 'EMAIL_ADDRESS'
+
+    logger, lines = make_logger(level='DEBUG', log_bodies=True)
+    logger.debug("get_attached_file response", response={"DownloadUrlMetadata": {"Url": url}})
+    assert json.loads(lines[0])['response']['DownloadUrlMetadata']['Url'] == url
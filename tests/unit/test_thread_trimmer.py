@@ -0,0 +1,58 @@
+import lambda_function
+from html_normalizer import normalize_html
+from thread_trimmer import trim_email
+
+
+def test_drops_quoted_reply_and_signature():
+    text = ("Thanks, the 15th works for me.\n\nOn Tue, Apr 2, 2024 at 10:03 AM Care <care@bank.example> wrote:\n"
+            "> Hi Sam,\n> We can meet on the 15th.\n--\nSam")
+    trimmed, removed = trim_email(text)
+    assert trimmed == "Thanks, the 15th works for me."
+    assert removed['quoted'] > 0
+
+
+def test_signature_can_be_kept():
+    text = "Please call me about my loan.\n--\nSam Lee\nTel: 020 7946 0018\nSent from my iPhone"
+    trimmed, removed = trim_email(text, keep_signature=True)
+    assert trimmed == "Please call me about my loan. Sam Lee Tel: 020 7946 0018"
+    assert removed['signature'] == len("--\nSent from my iPhone\n")
+
+
+def test_drops_outlook_header_block_from_html_reply():
+    body = ("<div><p>I would like a car loan quote.</p><p>Jo</p>"
+            "<div style='border-top:solid'><p><b>From:</b> Care &lt;care@bank.example&gt;<br><b>Sent:</b> Monday<br>"
+            "<b>To:</b> Jo<br><b>Subject:</b> RE: Loans</p></div><p>Hello Jo, how can we help?</p>"
+            "<blockquote><p>Old message</p></blockquote></div>")
+    trimmed, removed = trim_email(normalize_html(body, keep_lines=True))
+    assert trimmed == "I would like a car loan quote. Jo"
+    assert removed['quoted'] == len("From: Care <care@bank.example>\nSent: Monday\nTo: Jo\nSubject: RE: Loans\n"
+                                    "Hello Jo, how can we help?\n> Old message\n")
+
+
+def test_keeps_forwarded_content_when_new_text_is_tiny():
+    text = "FYI\n---------- Forwarded message ---------\nFrom: Pat\nI want to finance a new car."
+    trimmed, removed = trim_email(text)
+    assert "finance a new car" in trimmed
+    assert sum(removed.values()) == 0
+
+
+def test_drops_disclaimer_and_mobile_signature():
+    text = ("Please close my savings account.\nSent from my iPhone\n"
+            "This email is confidential and may be privileged. If you are not the intended recipient, "
+            "please notify the sender and delete this email.")
+    trimmed, removed = trim_email(text)
+    assert trimmed == "Please close my savings account."
+    assert removed['disclaimer'] > 0 and removed['signature'] > 0
+
+
+def test_head_tail_budget():
+    text = ' '.join(f"w{i}" for i in range(1000))
+    trimmed, removed = trim_email(text, head_tokens=5, tail_tokens=5)
+    assert trimmed.startswith("w0 w1") and trimmed.endswith("w998 w999")
+    assert " ... " in trimmed
+    assert removed['budget'] == len(text) - 40
+
+
+def test_trim_body_can_be_disabled(monkeypatch):
+    monkeypatch.setattr(lambda_function, 'enable_thread_trim', False)
+    assert lambda_function.trim_body("a\n> b") == ("a\n> b", {})